@@ -0,0 +1,87 @@
+from flask import Blueprint, request
+from concurrent.futures import ThreadPoolExecutor
+from services.harbor_service import HarborService
+from utils.response import success_response, error_response
+from utils.auth import require_harbor_config
+from utils.logger import setup_logger
+from utils import tracing
+from config import Config
+
+logger = setup_logger('api_batch')
+
+batch_bp = Blueprint('batch', __name__, url_prefix='/api')
+
+
+def _require(params, key):
+    value = params.get(key)
+    if not value:
+        raise ValueError(f'缺少 {key} 参数')
+    return value
+
+
+# 可批量调用的操作：op -> (service, params) -> data
+OPERATIONS = {
+    'projects': lambda s, p: {'projects': s.get_projects(p.get('page', 1), p.get('pageSize', 100))},
+    'project': lambda s, p: {'project': s.get_project_detail(_require(p, 'project'))},
+    'repositories': lambda s, p: {
+        'repositories': s.get_repositories(_require(p, 'project'), p.get('page', 1), p.get('pageSize', 100))
+    },
+    'tags': lambda s, p: {'tags': s.resolve_tags(_require(p, 'project'), _require(p, 'repo'))[0]},
+    'search': lambda s, p: {'results': s.search_repositories(_require(p, 'query'))},
+    'system-info': lambda s, p: {'info': s.get_system_info()},
+    'statistics': lambda s, p: {'statistics': s.get_statistics()},
+    'check-upload-permission': lambda s, p: s.check_upload_permission(_require(p, 'project')),
+}
+
+
+@batch_bp.route('/batch', methods=['POST'])
+@require_harbor_config
+def batch():
+    """一次请求执行多个 Harbor 操作，共用同一个客户端并发执行，结果按名称返回"""
+    try:
+        data = request.get_json()
+        operations = data.get('operations') or []
+        if not isinstance(operations, list) or not operations:
+            return error_response('缺少 operations 参数', 400)
+        if len(operations) > Config.BATCH_MAX_OPERATIONS:
+            return error_response(f'单次最多执行 {Config.BATCH_MAX_OPERATIONS} 个操作', 400)
+
+        names = set()
+        for item in operations:
+            if not isinstance(item, dict):
+                return error_response('operations 中的每一项必须为对象', 400)
+            if not isinstance(item.get('params') or {}, dict):
+                return error_response(f"操作 {item.get('name') or item.get('op')} 的 params 必须为对象", 400)
+            name = item.get('name') or item.get('op')
+            if item.get('op') not in OPERATIONS:
+                return error_response(f"不支持的操作: {item.get('op')}", 400)
+            if name in names:
+                return error_response(f'操作名称重复: {name}', 400)
+            names.add(name)
+
+        service = HarborService(data['harborUrl'], data['username'], data['password'])
+
+        def run(item):
+            try:
+                result = OPERATIONS[item['op']](service, item.get('params') or {})
+                return {'success': True, 'data': result}
+            except Exception as e:
+                logger.warning(f"[batch] {item['op']} 失败: {str(e)}")
+                return {'success': False, 'error': str(e)}
+
+        with ThreadPoolExecutor(max_workers=min(Config.HARBOR_BULK_WORKERS, len(operations))) as pool:
+            outcomes = list(pool.map(tracing.propagate(run), operations))
+
+        results = {
+            (item.get('name') or item['op']): outcome
+            for item, outcome in zip(operations, outcomes)
+        }
+        failed = [name for name, r in results.items() if not r['success']]
+        return success_response(
+            data={'results': results, 'failed': failed},
+            message=f'执行完成，{len(results) - len(failed)} 个成功，{len(failed)} 个失败'
+        )
+
+    except Exception as e:
+        logger.error(f"批量请求失败: {str(e)}")
+        return error_response(str(e), 500)
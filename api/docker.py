@@ -1,23 +1,62 @@
-from flask import Blueprint, send_file, request
-from services.docker_service import DockerService
-from utils.response import success_response, error_response
+from flask import Blueprint, request, g
+from functools import wraps
+from services.docker_service import get_docker_service, record_phase
+from services.system_monitor import account_file, remove_file, remove_tree
+from services import inflight, bandwidth, job_journal, shutdown
+from services.scheduler import QueueTimeoutError
+from services.harbor_service import HarborService
+from utils.response import success_response, error_response, file_download_response
 from utils.auth import require_harbor_config
 from utils.logger import setup_logger
+from utils import tracing
 import os
+import time
+from urllib.parse import urlparse
 
 logger = setup_logger('api_docker')
 
 docker_bp = Blueprint('docker', __name__, url_prefix='/api/docker')
 
-# 全局 Docker 服务实例
-docker_service = None
+# 服务停止时建议客户端重试的间隔（秒）
+DRAIN_RETRY_AFTER = 30
 
-def get_docker_service():
-    """获取 Docker 服务实例"""
-    global docker_service
-    if docker_service is None:
-        docker_service = DockerService()
-    return docker_service
+def reject_while_draining(f):
+    """服务停止过程中不再开始新的传输，返回 503 由客户端稍后重试"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if shutdown.draining():
+            response, code = error_response('服务正在停止，请稍后重试', 503)
+            response.headers['Retry-After'] = str(DRAIN_RETRY_AFTER)
+            return response, code
+        return f(*args, **kwargs)
+    return decorated_function
+
+def _send_export(result):
+    """发送导出文件：发送完毕（文件关闭）时删除本次导出的临时目录（预热 / 续传文件保留）并释放引用"""
+    send_started = time.perf_counter()
+    trace = tracing.current()
+    shaper = bandwidth.start_job(g.request_id, request.remote_addr, 'download')
+    
+    def release():
+        shaper.finish()
+        record_phase('download', 'send', send_started, result['size'], trace=trace)
+        if result.get('job') is not None:
+            result['job'].done()
+        if result.get('temp_dir'):
+            remove_tree(result['temp_dir'])
+        result['lease'].release()
+    
+    try:
+        return file_download_response(
+            result['path'],
+            result['filename'],
+            on_close=release,
+            mimetype='application/gzip',
+            shaper=shaper
+        )
+    except Exception:
+        release()
+        raise
 
 @docker_bp.route('/ping', methods=['GET'])
 def ping():
@@ -33,6 +72,7 @@ def ping():
         return error_response(str(e), 500)
 
 @docker_bp.route('/download', methods=['POST'])
+@reject_while_draining
 @require_harbor_config
 def download_image():
     """下载镜像"""
@@ -58,14 +98,11 @@ def download_image():
             tag
         )
         
-        # 返回文件
-        return send_file(
-            result['path'],
-            mimetype='application/gzip',
-            as_attachment=True,
-            download_name=result['filename']
-        )
+        return _send_export(result)
         
+    except QueueTimeoutError as e:
+        logger.warning(f"下载镜像排队超时: {str(e)}")
+        return error_response(str(e), 503)
     except Exception as e:
         logger.error(f"下载镜像失败: {str(e)}")
         return error_response(str(e), 500)
@@ -100,9 +137,16 @@ def remove_image():
         return error_response(str(e), 500)
 
 @docker_bp.route('/upload', methods=['POST'])
+@reject_while_draining
 def upload_image():
     """上传镜像到 Harbor"""
     temp_file_path = None
+    lease = None
+    job = None
+    # 在解析表单前包装请求体，按客户端 IP / 任务限速接收
+    shaper = bandwidth.start_job(g.request_id, request.remote_addr, 'upload')
+    if shaper.limited():
+        request.environ['wsgi.input'] = bandwidth.ThrottledStream(request.environ['wsgi.input'], shaper)
     
     try:
         if 'file' not in request.files:
@@ -123,7 +167,6 @@ def upload_image():
         if not all([harbor_url, username, password, project]):
             return error_response('缺少必要参数: harborUrl, username, password, project', 400)
         
-        from urllib.parse import urlparse
         url = str(harbor_url).strip()
         if url.lower() == 'string':
             return error_response('harborUrl 不能为示例值，请填写真实地址', 400)
@@ -135,8 +178,23 @@ def upload_image():
         os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
         
         temp_file_path = os.path.join(Config.UPLOAD_FOLDER, file.filename)
+        lease = inflight.acquire(paths=[temp_file_path], operation='upload')
+        job = job_journal.start(
+            job_journal.KIND_UPLOAD,
+            path=temp_file_path,
+            filename=file.filename,
+            registry=parsed.netloc,
+            harbor_url=url,
+            project=project,
+            operator=username
+        )
         logger.info(f"保存上传文件到: {temp_file_path}")
+        started = time.perf_counter()
         file.save(temp_file_path)
+        account_file(temp_file_path)
+        size = os.path.getsize(temp_file_path)
+        record_phase('upload', 'receive', started, size)
+        job.phase('received', size=size, received=True)
         
         service = get_docker_service()
         result = service.upload_image(
@@ -144,21 +202,137 @@ def upload_image():
             username,
             password,
             project,
-            temp_file_path
+            temp_file_path,
+            job=job
         )
+        job.done()
         
         return success_response(
             data=result,
             message=f"镜像上传成功，共上传 {len(result['uploaded_images'])} 个镜像"
         )
         
+    except QueueTimeoutError as e:
+        logger.warning(f"上传镜像排队超时: {str(e)}")
+        if job is not None:
+            job.failed(e)
+        return error_response(str(e), 503)
     except Exception as e:
         logger.error(f"上传镜像失败: {str(e)}")
+        if job is not None:
+            job.failed(e)
         return error_response(str(e), 500)
     finally:
         if temp_file_path and os.path.exists(temp_file_path):
             try:
-                os.remove(temp_file_path)
+                remove_file(temp_file_path)
                 logger.info(f"已清理临时文件: {temp_file_path}")
             except Exception as e:
                 logger.warning(f"清理临时文件失败: {str(e)}")
+        if lease is not None:
+            lease.release()
+        shaper.finish()
+
+
+def _authenticate(harbor_url, username, password):
+    """向 Harbor 校验凭据，失败时返回错误响应；任务日志不保存密码，列出与续传任务前都需校验"""
+    try:
+        HarborService(harbor_url, username, password).get_current_user()
+    except Exception as e:
+        if '401' in str(e) or '403' in str(e):
+            return error_response('Harbor 认证失败', 401)
+        raise
+    return None
+
+
+@docker_bp.route('/jobs', methods=['POST'])
+@require_harbor_config
+def list_jobs():
+    """当前用户在该 Harbor 上进行中与可续传的传输任务（服务重启或工作进程退出后中断的任务）"""
+    try:
+        data = request.get_json()
+        denied = _authenticate(data['harborUrl'], data['username'], data['password'])
+        if denied is not None:
+            return denied
+        registry = urlparse(HarborService.normalize_url(data['harborUrl'])).netloc
+        return success_response(data={
+            'shutdown': shutdown.status(),
+            'jobs': job_journal.resumable_jobs(data['username'], registry)
+        })
+    except Exception as e:
+        logger.error(f"获取任务列表失败: {str(e)}")
+        return error_response(str(e), 500)
+
+
+@docker_bp.route('/jobs/<job_id>/resume', methods=['POST'])
+@reject_while_draining
+def resume_job(job_id):
+    """续传中断的任务：导出任务直接发送已打包的文件，上传任务跳过已推送的镜像
+
+    只有任务的发起用户可以续传，目标为任务原来的 Harbor；任务日志不保存密码，需重新提供
+    """
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    password = data.get('password')
+    if not all([username, password]):
+        return error_response('缺少必要参数: username, password', 400)
+    
+    state = job_journal.get(job_id)
+    # 其他用户的任务与不存在的任务返回相同结果，不暴露任务是否存在
+    if state is None or state.get('operator') != username:
+        return error_response(f"任务不存在: {job_id}", 404)
+    if state.get('status') != job_journal.STATUS_RESUMABLE:
+        return error_response(f"任务当前状态为 {state.get('status')}，无法续传", 409)
+    
+    try:
+        denied = _authenticate(state['harbor_url'], username, password)
+        if denied is not None:
+            return denied
+        if state.get('kind') == job_journal.KIND_DOWNLOAD:
+            # 按镜像重新导出，download_image 会找到该任务保留的导出文件（digest 变化时重新拉取）
+            service = get_docker_service()
+            result = service.download_image(
+                state['harbor_url'],
+                username,
+                password,
+                state['image_name'],
+                state['tag']
+            )
+            return _send_export(result)
+        return _resume_upload(job_id, username, password)
+    except job_journal.JobConflictError as e:
+        return error_response(str(e), 409)
+    except QueueTimeoutError as e:
+        logger.warning(f"续传任务排队超时: {str(e)}")
+        return error_response(str(e), 503)
+    except Exception as e:
+        logger.error(f"续传任务失败: {str(e)}")
+        return error_response(str(e), 500)
+
+
+def _resume_upload(job_id, username, password):
+    job, state = job_journal.claim(job_id, job_journal.KIND_UPLOAD)
+    path = state['path']
+    lease = inflight.acquire(paths=[path], operation='upload')
+    try:
+        result = get_docker_service().upload_image(
+            state['harbor_url'],
+            username,
+            password,
+            state['project'],
+            path,
+            job=job,
+            skip=state.get('pushed') or []
+        )
+    except Exception:
+        # 退回可续传状态，文件保留
+        job.release()
+        raise
+    finally:
+        lease.release()
+    job.done()
+    remove_file(path)
+    return success_response(
+        data=result,
+        message=f"镜像续传成功，共上传 {len(result['uploaded_images'])} 个镜像"
+    )
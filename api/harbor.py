@@ -1,8 +1,15 @@
 from flask import Blueprint, request
 from services.harbor_service import HarborService
-from utils.response import success_response, error_response
+from services.catalog_service import get_catalog, start_auto_sync
+from services.search_index import get_search_index, KIND_REPOSITORY, KIND_TAG
+from services.storage_analytics import analyze_storage
+from services.webhook_service import verify_secret, handle_event
+from utils.response import success_response, error_response, stream_list_response, ndjson_response
 from utils.auth import require_harbor_config
 from utils.logger import setup_logger
+from utils import tracing
+from config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = setup_logger('api_harbor')
 
@@ -95,7 +102,7 @@ def get_repositories():
         
         repositories = service.get_repositories(project, page, page_size)
         
-        return success_response(data={'repositories': repositories})
+        return stream_list_response('repositories', repositories)
         
     except Exception as e:
         logger.error(f"获取仓库列表失败: {str(e)}")
@@ -113,49 +120,109 @@ def get_repository_tags():
             return error_response('缺少参数', 400)
         service = HarborService(data['harborUrl'], data['username'], data['password'])
         logger.info(f"[tags] req project={project} repo={repo_full_name}")
-        tags = []
-        try:
-            tags = service.get_registry_tags(repo_full_name)
-        except Exception:
-            tags = []
-        if not tags:
-            parts = repo_full_name.split('/')
-            repo_path = '/'.join(parts[1:]) if len(parts) > 1 else parts[0]
+        repo_path = HarborService.strip_project_prefix(repo_full_name)
+        
+        # 分页模式：按 Registry 的 n/last 游标返回单页
+        page_size = data.get('pageSize')
+        if page_size:
             try:
-                tags = service.get_registry_tags(repo_path)
+                tags, next_last = service.get_registry_tags_page(repo_full_name, int(page_size), data.get('last'))
             except Exception:
-                tags = []
-        artifacts_count = 0
-        if not tags:
-            # 先用完整仓库名取 artifacts
+                tags, next_last = service.get_registry_tags_page(repo_path, int(page_size), data.get('last'))
+            return success_response(data={'tags': tags, 'next': next_last})
+        
+        # 流式模式：逐页跟随 Link 头，以 NDJSON 每行输出一个 tag
+        if data.get('stream'):
+            # 开始输出前先取第一页（与分页模式相同的去前缀回退），失败时仍能返回错误状态码
+            stream_repo = repo_full_name
             try:
-                artifacts = service.get_all_artifacts(project, repo_full_name)
-                artifacts_count = len(artifacts)
-                for a in artifacts:
-                    tags.extend(a.get('tags', []))
-            except Exception as e:
-                if '404' in str(e):
-                    artifacts = []
-                else:
-                    artifacts = []
-            # 若仍为空，尝试去前缀仓库路径
-            if not tags:
-                try:
-                    parts = repo_full_name.split('/')
-                    repo_path = '/'.join(parts[1:]) if len(parts) > 1 else parts[0]
-                    artifacts2 = service.get_all_artifacts(project, repo_path)
-                    artifacts_count = max(artifacts_count, len(artifacts2))
-                    for a in artifacts2:
-                        tags.extend(a.get('tags', []))
-                except Exception:
-                    pass
-            tags = list(set(tags))
+                first, next_last = service.get_registry_tags_page(stream_repo, Config.REGISTRY_TAGS_PAGE_SIZE)
+            except Exception:
+                stream_repo = repo_path
+                first, next_last = service.get_registry_tags_page(stream_repo, Config.REGISTRY_TAGS_PAGE_SIZE)
+            
+            def stream_tags():
+                yield from first
+                if first and next_last:
+                    yield from service.iter_registry_tags(stream_repo, last=next_last)
+            
+            return ndjson_response(
+                ({'tag': tag} for tag in stream_tags()),
+                on_error=lambda e: logger.error(f"[tags] 流式获取标签失败: {str(e)}")
+            )
+        
+        tags, artifacts_count, _ = service.resolve_tags(project, repo_full_name)
         logger.info(f"[tags] artifacts={artifacts_count} tags={len(tags)}")
-        return success_response(data={'tags': tags})
+        return stream_list_response('tags', tags)
     except Exception as e:
         logger.error(f"获取仓库标签失败: {str(e)}")
         return error_response(str(e), 500)
 
+@harbor_bp.route('/repositories/tags', methods=['POST'])
+@require_harbor_config
+def get_repositories_tags():
+    """批量获取多个仓库的标签列表，单个仓库失败不影响其他仓库"""
+    try:
+        data = request.get_json()
+        default_project = data.get('project')
+        items = data.get('repos') or []
+        if not isinstance(items, list) or not items:
+            return error_response('缺少 repos 参数', 400)
+        if len(items) > Config.HARBOR_BULK_MAX_REPOS:
+            return error_response(f'单次最多查询 {Config.HARBOR_BULK_MAX_REPOS} 个仓库', 400)
+        
+        targets = []
+        for item in items:
+            if isinstance(item, dict):
+                repo = item.get('repo')
+                project = item.get('project') or default_project
+            else:
+                repo = str(item)
+                project = default_project
+            if repo and not project:
+                project = repo.split('/')[0]
+            if not repo:
+                return error_response('repos 中存在空仓库名', 400)
+            target = (project, repo)
+            if target not in targets:
+                targets.append(target)
+        
+        # 共用一个服务实例（同一个连接池），线程数受 HARBOR_BULK_WORKERS 限制
+        service = HarborService(data['harborUrl'], data['username'], data['password'])
+        logger.info(f"[tags] bulk req repos={len(targets)}")
+        
+        def resolve(target):
+            project, repo = target
+            tags, _, errors = service.resolve_tags(project, repo)
+            if not tags and errors:
+                return {'success': False, 'tags': [], 'error': errors[-1]}
+            return {'success': True, 'tags': tags}
+        
+        def result_key(target):
+            # 按 项目/仓库 索引，不同项目下的同名仓库不会互相覆盖
+            project, repo = target
+            return repo if repo.startswith(f"{project}/") else f"{project}/{repo}"
+        
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(Config.HARBOR_BULK_WORKERS, len(targets))) as pool:
+            futures = {pool.submit(tracing.propagate(resolve), target): result_key(target) for target in targets}
+            for future in as_completed(futures):
+                repo = futures[future]
+                try:
+                    results[repo] = future.result()
+                except Exception as e:
+                    results[repo] = {'success': False, 'tags': [], 'error': str(e)}
+        
+        failed = [repo for repo, r in results.items() if not r['success']]
+        logger.info(f"[tags] bulk done repos={len(results)} failed={len(failed)}")
+        return success_response(
+            data={'results': results, 'failed': failed},
+            message=f'获取完成，{len(results) - len(failed)} 个成功，{len(failed)} 个失败'
+        )
+    except Exception as e:
+        logger.error(f"批量获取仓库标签失败: {str(e)}")
+        return error_response(str(e), 500)
+
 @harbor_bp.route('/search', methods=['POST'])
 @require_harbor_config
 def search_repositories():
@@ -167,6 +234,26 @@ def search_repositories():
         if not query:
             return error_response('缺少 query 参数', 400)
         
+        try:
+            limit = int(data.get('limit', 20))
+        except (TypeError, ValueError):
+            return error_response('limit 必须为整数', 400)
+        if limit < 1:
+            return error_response('limit 必须大于 0', 400)
+        
+        # 目录已同步时直接查询本地索引，不再访问 Harbor
+        if data.get('source') != 'harbor':
+            index = get_search_index(data['harborUrl'], data['username'], data['password'])
+            if index is not None:
+                kind = {'repository': KIND_REPOSITORY, 'tag': KIND_TAG}.get(data.get('type'))
+                results = index.search(
+                    query,
+                    limit=limit,
+                    kind=kind,
+                    project_name=data.get('project')
+                )
+                return success_response(data={'results': results, 'source': 'index'})
+        
         service = HarborService(
             data['harborUrl'],
             data['username'],
@@ -174,7 +261,7 @@ def search_repositories():
         )
         
         results = service.search_repositories(query)
-        return success_response(data={'results': results})
+        return success_response(data={'results': results, 'source': 'harbor'})
         
     except Exception as e:
         logger.error(f"搜索失败: {str(e)}")
@@ -218,6 +305,53 @@ def get_statistics():
         logger.error(f"获取统计信息失败: {str(e)}")
         return error_response(str(e), 500)
 
+@harbor_bp.route('/analytics/storage', methods=['POST'])
+@require_harbor_config
+def get_storage_analytics():
+    """按层去重的存储分析，可评估删除候选 tag 后释放的空间"""
+    try:
+        data = request.get_json()
+        projects = data.get('projects') or None
+        candidates = data.get('candidates') or None
+        if projects is not None and not isinstance(projects, list):
+            return error_response('projects 必须为数组', 400)
+        if candidates is not None and not isinstance(candidates, list):
+            return error_response('candidates 必须为数组', 400)
+        if candidates and not all(isinstance(item, dict) for item in candidates):
+            return error_response('candidates 的每一项必须为 {"repo": ..., "tag": ...} 对象', 400)
+        
+        service = HarborService(
+            data['harborUrl'],
+            data['username'],
+            data['password']
+        )
+        
+        # 索引在后台刷新，首次刷新完成前返回 202，客户端轮询同一接口
+        report, status = analyze_storage(service, projects, candidates, refresh=bool(data.get('refresh')))
+        if report is None:
+            return success_response(data={'analytics': None, 'status': status}, message='存储分析进行中，请稍后重试', code=202)
+        return success_response(data={'analytics': report, 'status': status})
+        
+    except Exception as e:
+        logger.error(f"存储分析失败: {str(e)}")
+        return error_response(str(e), 500)
+
+@harbor_bp.route('/webhook', methods=['POST'])
+def receive_webhook():
+    """接收 Harbor webhook 事件（PUSH_ARTIFACT / DELETE_ARTIFACT）"""
+    try:
+        if not verify_secret(request.headers.get('Authorization')):
+            return error_response('webhook 认证失败', 401)
+        payload = request.get_json(silent=True)
+        if not payload:
+            return error_response('请求体不能为空', 400)
+        summary = handle_event(payload)
+        return success_response(data=summary, message='事件已处理')
+        
+    except Exception as e:
+        logger.error(f"处理 webhook 失败: {str(e)}")
+        return error_response(str(e), 500)
+
 @harbor_bp.route('/check-upload-permission', methods=['POST'])
 @require_harbor_config
 def check_upload_permission():
@@ -245,3 +379,43 @@ def check_upload_permission():
     except Exception as e:
         logger.error(f"检查上传权限失败: {str(e)}")
         return error_response(str(e), 500)
+
+@harbor_bp.route('/catalog/sync', methods=['POST'])
+@require_harbor_config
+def sync_catalog():
+    """增量同步本地元数据目录"""
+    try:
+        data = request.get_json()
+        with_artifacts = bool(data.get('withArtifacts', False))
+        service = HarborService(
+            data['harborUrl'],
+            data['username'],
+            data['password']
+        )
+        
+        catalog = get_catalog(data['harborUrl'], data['username'], data['password'])
+        stats = catalog.sync(service, with_artifacts=with_artifacts, full=bool(data.get('full', False)))
+        if data.get('autoSync'):
+            stats['auto_sync'] = start_auto_sync(
+                data['harborUrl'], data['username'], data['password'], with_artifacts=with_artifacts
+            )
+        return success_response(data={'stats': stats}, message='目录同步完成')
+        
+    except Exception as e:
+        logger.error(f"目录同步失败: {str(e)}")
+        return error_response(str(e), 500)
+
+@harbor_bp.route('/catalog', methods=['POST'])
+@require_harbor_config
+def get_catalog_view():
+    """读取本地元数据目录（不访问 Harbor）"""
+    try:
+        data = request.get_json()
+        catalog = get_catalog(data['harborUrl'], data['username'], data['password'], create=False)
+        if catalog is None or catalog.last_sync is None:
+            return error_response('目录尚未同步，请先调用 /api/harbor/catalog/sync', 404)
+        return success_response(data={'catalog': catalog.snapshot(data.get('project'))})
+        
+    except Exception as e:
+        logger.error(f"读取目录失败: {str(e)}")
+        return error_response(str(e), 500)
@@ -4,10 +4,16 @@
 from flask import Blueprint
 from utils.response import success_response, error_response
 from utils.logger import setup_logger
-from utils.operation_logger import append as append_oplog, read_lines as read_oplog
-import psutil
+from utils.operation_logger import append as append_oplog, query as query_oplog
+from services.system_monitor import get_system_sampler, remove_file, remove_tree
+from services.janitor import janitor
+from services.health_prober import health_prober
+from services import inflight
+from utils.log_tail import tail as tail_log, follow as follow_log
+from utils import tracing
+import json
 import os
-import shutil
+import time
 from config import Config
 
 logger = setup_logger('api_system')
@@ -16,65 +22,100 @@ system_bp = Blueprint('system', __name__, url_prefix='/api/system')
 
 @system_bp.route('/health', methods=['GET'])
 def health_check():
-    """健康检查"""
+    """健康检查（返回后台探测的缓存结果）"""
     try:
-        from services.docker_service import DockerService
-        docker_service = DockerService()
-        docker_connected = docker_service.ping()
-        
-        return success_response(data={
-            'status': 'healthy',
-            'docker': 'connected' if docker_connected else 'disconnected'
-        })
+        return success_response(data=health_prober.snapshot())
+    except Exception as e:
+        return error_response(str(e), 500)
+
+@system_bp.route('/health/live', methods=['GET'])
+def liveness():
+    """存活探针：进程能处理请求即视为存活"""
+    return success_response(data={'status': 'alive'})
+
+@system_bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """就绪探针：Docker 可用（及按配置要求 Harbor 可达）时返回 200，否则 503"""
+    ready, reasons = health_prober.readiness()
+    if ready:
+        return success_response(data={'status': 'ready'})
+    return error_response('服务未就绪', 503, details=reasons)
+
+@system_bp.route('/harbor-hosts', methods=['GET'])
+def harbor_hosts():
+    """各 Harbor 主机的熔断状态与延迟分位数"""
+    try:
+        from services.host_health import all_host_health
+        return success_response(data={'hosts': all_host_health()})
     except Exception as e:
+        logger.error(f"获取 Harbor 主机状态失败: {str(e)}")
+        return error_response(str(e), 500)
+
+@system_bp.route('/scheduler', methods=['GET'])
+def scheduler_status():
+    """各 registry 主机的并发槽位、排队深度、等待时间与各租户情况（本进程）"""
+    try:
+        from services import scheduler
+        return success_response(data=scheduler.snapshot())
+    except Exception as e:
+        logger.error(f"获取调度状态失败: {str(e)}")
+        return error_response(str(e), 500)
+
+@system_bp.route('/bandwidth', methods=['GET'])
+def bandwidth_status():
+    """当前限速设置与本进程进行中的传输"""
+    try:
+        from services import bandwidth
+        return success_response(data=bandwidth.snapshot())
+    except Exception as e:
+        logger.error(f"获取限速状态失败: {str(e)}")
+        return error_response(str(e), 500)
+
+@system_bp.route('/bandwidth', methods=['PUT'])
+def bandwidth_update():
+    """修改限速（字节/秒，0 为不限）：global / per_ip / per_job，jobs 按任务 ID 单独设置（null 为取消）"""
+    try:
+        from flask import request
+        from services import bandwidth
+        data = request.get_json(silent=True) or {}
+        try:
+            limits = {k: bandwidth.validate_rate(data[k]) for k in bandwidth.LIMIT_KEYS if k in data}
+            jobs = data.get('jobs') or {}
+            if not isinstance(jobs, dict):
+                raise ValueError('jobs 需为 {任务 ID: 速率} 对象')
+            jobs = {str(k): (None if v is None else bandwidth.validate_rate(v)) for k, v in jobs.items()}
+        except ValueError as e:
+            return error_response(str(e), 400)
+        if not limits and not jobs:
+            return error_response('缺少 global / per_ip / per_job / jobs 参数', 400)
+        bandwidth.settings.update(limits, jobs)
+        logger.info(f"[bandwidth] 限速设置已修改: {limits} {jobs}")
+        return success_response(data=bandwidth.snapshot(), message='限速设置已更新')
+    except Exception as e:
+        logger.error(f"修改限速设置失败: {str(e)}")
+        return error_response(str(e), 500)
+
+@system_bp.route('/bandwidth', methods=['DELETE'])
+def bandwidth_reset():
+    """清除运行时修改，恢复配置中的限速"""
+    try:
+        from services import bandwidth
+        bandwidth.settings.reset()
+        logger.info("[bandwidth] 限速设置已恢复为配置值")
+        return success_response(data=bandwidth.snapshot(), message='限速设置已恢复默认')
+    except Exception as e:
+        logger.error(f"恢复限速设置失败: {str(e)}")
         return error_response(str(e), 500)
 
 @system_bp.route('/info', methods=['GET'])
 def system_info():
-    """系统信息"""
+    """系统信息（读取后台采样快照，history=1 时附带历史采样）"""
     try:
-        # CPU 信息
-        cpu_percent = psutil.cpu_percent(interval=1)
-        cpu_count = psutil.cpu_count()
-        
-        # 内存信息
-        memory = psutil.virtual_memory()
-        
-        # 磁盘信息
-        disk = psutil.disk_usage('/')
-        
-        # 下载目录信息
-        download_dir_size = 0
-        if os.path.exists(Config.DOWNLOAD_FOLDER):
-            for dirpath, dirnames, filenames in os.walk(Config.DOWNLOAD_FOLDER):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    if os.path.exists(fp):
-                        download_dir_size += os.path.getsize(fp)
-        
-        return success_response(data={
-            'cpu': {
-                'percent': cpu_percent,
-                'count': cpu_count
-            },
-            'memory': {
-                'total': memory.total,
-                'available': memory.available,
-                'percent': memory.percent,
-                'used': memory.used
-            },
-            'disk': {
-                'total': disk.total,
-                'used': disk.used,
-                'free': disk.free,
-                'percent': disk.percent
-            },
-            'download_folder': {
-                'path': Config.DOWNLOAD_FOLDER,
-                'size': download_dir_size
-            },
-            'harbor_api_version': Config.HARBOR_API_VERSION
-        })
+        from flask import request
+        with_history = request.args.get('history', '').lower() in ('1', 'true')
+        data = get_system_sampler().snapshot(with_history)
+        data['harbor_api_version'] = Config.HARBOR_API_VERSION
+        return success_response(data=data)
     except Exception as e:
         logger.error(f"获取系统信息失败: {str(e)}")
         return error_response(str(e), 500)
@@ -85,25 +126,22 @@ def cleanup_temp_files():
     try:
         cleaned_size = 0
         cleaned_count = 0
+        skipped_count = 0
         
         # 清理下载目录
         if os.path.exists(Config.DOWNLOAD_FOLDER):
             for item in os.listdir(Config.DOWNLOAD_FOLDER):
                 item_path = os.path.join(Config.DOWNLOAD_FOLDER, item)
+                # 跳过进行中的导出 / 预热
+                if inflight.is_path_busy(item_path):
+                    skipped_count += 1
+                    continue
                 try:
                     if os.path.isfile(item_path):
-                        size = os.path.getsize(item_path)
-                        os.remove(item_path)
-                        cleaned_size += size
+                        cleaned_size += remove_file(item_path)
                         cleaned_count += 1
                     elif os.path.isdir(item_path):
-                        size = sum(
-                            os.path.getsize(os.path.join(dirpath, filename))
-                            for dirpath, dirnames, filenames in os.walk(item_path)
-                            for filename in filenames
-                        )
-                        shutil.rmtree(item_path)
-                        cleaned_size += size
+                        cleaned_size += remove_tree(item_path)
                         cleaned_count += 1
                 except Exception as e:
                     logger.warning(f"清理文件失败 {item_path}: {str(e)}")
@@ -111,7 +149,8 @@ def cleanup_temp_files():
         return success_response(
             data={
                 'cleaned_count': cleaned_count,
-                'cleaned_size': cleaned_size
+                'cleaned_size': cleaned_size,
+                'skipped_in_flight': skipped_count
             },
             message=f'清理完成，删除 {cleaned_count} 个文件/目录，释放 {cleaned_size / 1024 / 1024:.2f} MB'
         )
@@ -119,23 +158,72 @@ def cleanup_temp_files():
         logger.error(f"清理临时文件失败: {str(e)}")
         return error_response(str(e), 500)
 
+@system_bp.route('/janitor', methods=['GET'])
+def janitor_status():
+    """后台清理任务状态"""
+    try:
+        return success_response(data=janitor.status())
+    except Exception as e:
+        logger.error(f"获取清理任务状态失败: {str(e)}")
+        return error_response(str(e), 500)
+
+@system_bp.route('/janitor/run', methods=['POST'])
+def janitor_run():
+    """立即按保留策略执行一次清理（跳过进行中的操作）"""
+    try:
+        stats = janitor.run_once()
+        return success_response(
+            data=stats,
+            message=f"清理完成，删除 {stats['files_removed']} 个文件/目录、{stats['images_removed']} 个镜像"
+        )
+    except Exception as e:
+        logger.error(f"执行清理任务失败: {str(e)}")
+        return error_response(str(e), 500)
+
 @system_bp.route('/logs', methods=['GET'])
 def get_logs():
-    """获取最新日志"""
+    """获取最新日志（从文件末尾反向读取，支持 lines / level / logger 参数）"""
     try:
+        from flask import request
         if not os.path.exists(Config.LOG_FILE):
             return success_response(data={'logs': []}, message='日志文件不存在')
         
-        # 读取最后 100 行日志
-        with open(Config.LOG_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            last_lines = lines[-100:] if len(lines) > 100 else lines
+        lines = min(max(request.args.get('lines', 100, type=int), 1), Config.LOG_TAIL_MAX_LINES)
+        names = [n for n in request.args.get('logger', '').split(',') if n]
+        logs, cursor = tail_log(Config.LOG_FILE, lines, request.args.get('level'), names)
         
-        return success_response(data={'logs': last_lines})
+        return success_response(data={'logs': logs, 'cursor': cursor})
     except Exception as e:
         logger.error(f"获取日志失败: {str(e)}")
         return error_response(str(e), 500)
 
+@system_bp.route('/logs/stream', methods=['GET'])
+def stream_logs():
+    """以 SSE 实时跟随日志；断线重连时按 Last-Event-ID 从原偏移量继续"""
+    from flask import request, Response, stream_with_context
+    if not os.path.exists(Config.LOG_FILE):
+        return error_response('日志文件不存在', 404)
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    level = request.args.get('level')
+    names = [n for n in request.args.get('logger', '').split(',') if n]
+    
+    def generate():
+        last_beat = time.time()
+        yield 'retry: 3000\n\n'
+        for line, position in follow_log(Config.LOG_FILE, cursor, level, names, max_seconds=Config.LOG_FOLLOW_MAX_SECONDS):
+            if line is None:
+                if time.time() - last_beat >= 15:
+                    last_beat = time.time()
+                    yield ': keep-alive\n\n'
+                continue
+            yield f"id: {position}\ndata: {json.dumps({'line': line}, ensure_ascii=False)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @system_bp.route('/record', methods=['POST'])
 def record_operation():
     try:
@@ -158,13 +246,57 @@ def record_operation():
 
 @system_bp.route('/operations', methods=['GET'])
 def list_operations():
+    """查询操作日志：按 operator / action / since / until 过滤，最新在前，按 cursor 翻页"""
     try:
         from flask import request
-        operator = request.args.get('operator')
-        logs = read_oplog(limit=1000)
-        if operator:
-            logs = [l for l in logs if l.get('operator') == operator]
-        return success_response(data={'operations': logs})
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        try:
+            logs, next_cursor = query_oplog(
+                operator=request.args.get('operator'),
+                action=request.args.get('action'),
+                since=request.args.get('since'),
+                until=request.args.get('until'),
+                cursor=request.args.get('cursor', type=int),
+                limit=limit
+            )
+        except ValueError as e:
+            return error_response(str(e), 400)
+        return success_response(data={'operations': logs, 'next_cursor': next_cursor})
     except Exception as e:
         logger.error(f"获取操作日志失败: {str(e)}")
         return error_response(str(e), 500)
+
+@system_bp.route('/traces', methods=['GET'])
+def list_traces():
+    """最近保留的请求 trace 摘要，最新在前"""
+    return success_response(data={'traces': tracing.recent()})
+
+@system_bp.route('/traces/export', methods=['GET'])
+def export_traces():
+    """导出全部最近 trace 为一个 Chrome trace 文件"""
+    return _chrome_trace_response(tracing.all_traces(), 'traces.json')
+
+@system_bp.route('/traces/<request_id>', methods=['GET'])
+def export_trace(request_id):
+    """按请求 ID 导出 Chrome trace 文件（chrome://tracing 或 Perfetto 打开）"""
+    trace = tracing.get(request_id)
+    if trace is None:
+        return error_response('trace 不存在或已过期', 404)
+    return _chrome_trace_response([trace], f"trace-{request_id}.json")
+
+@system_bp.route('/traces/<request_id>/profile', methods=['GET'])
+def trace_profile(request_id):
+    """请求携带 X-Profile 时记录的 cProfile 结果（按累计耗时排序）"""
+    from flask import Response
+    trace = tracing.get(request_id)
+    if trace is None or trace.profile is None:
+        return error_response('没有该请求的 profile 结果', 404)
+    return Response(trace.profile, mimetype='text/plain')
+
+def _chrome_trace_response(traces, filename):
+    from flask import Response
+    return Response(
+        json.dumps(tracing.chrome_trace(traces), ensure_ascii=False),
+        mimetype='application/json',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
@@ -1,23 +1,58 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g, Response
 from flask_cors import CORS
 from flask_swagger_ui import get_swaggerui_blueprint
 from config import Config
 from utils.logger import setup_logger
 from utils.swagger_spec import SWAGGER_SPEC
+from utils.response import StaticJSON, RecordJSONProvider
+from utils.compression import compress_response
+from utils import metrics, tracing
+from services.system_monitor import get_system_sampler
+from services.janitor import janitor
+from services.health_prober import health_prober
 import os
 import sys
+import threading
+import time
 
 # 导入蓝图
 from api.harbor import harbor_bp
 from api.docker import docker_bp
 from api.system import system_bp
+from api.batch import batch_bp
 
 # 初始化日志
 logger = setup_logger('app')
 
+# 按蓝图路由统计的请求耗时（路由取规则模板，避免路径参数导致标签基数膨胀）
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'harbor_export_http_request_seconds', 'HTTP 请求处理耗时（秒）', ('blueprint', 'route', 'method', 'status')
+)
+
+_background_lock = threading.Lock()
+_background_pid = None
+
+def start_background_tasks():
+    """启动后台线程，每个进程一次
+
+    线程不会被 fork 继承：gunicorn 预加载应用时主进程不启动，由各工作进程在 post_fork 或首个请求时启动
+    """
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    # 启动系统资源后台采样，/api/system/info 直接读取快照
+    get_system_sampler()
+    # 按保留策略定期清理下载 / 上传目录及拉取的镜像
+    janitor.start()
+    # 后台探测 Docker / Harbor，健康检查接口读取缓存结果
+    health_prober.start()
+
 def create_app(config_class=Config):
     """应用工厂函数"""
     app = Flask(__name__)
+    app.json = RecordJSONProvider(app)
     app.config.from_object(config_class)
     
     # 初始化配置
@@ -28,7 +63,8 @@ def create_app(config_class=Config):
         r"/api/*": {
             "origins": config_class.CORS_ORIGINS,
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", tracing.REQUEST_ID_HEADER, tracing.PROFILE_HEADER],
+            "expose_headers": [tracing.REQUEST_ID_HEADER],
             "supports_credentials": True
         }
     })
@@ -37,6 +73,7 @@ def create_app(config_class=Config):
     app.register_blueprint(harbor_bp)
     app.register_blueprint(docker_bp)
     app.register_blueprint(system_bp)
+    app.register_blueprint(batch_bp)
     
     # Swagger UI 配置
     SWAGGER_URL = '/api/docs'  # Swagger UI 访问路径
@@ -51,27 +88,62 @@ def create_app(config_class=Config):
     )
     app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
-    # Swagger JSON 路由
+    # Swagger JSON 路由：启动时序列化一次，按 ETag 协商缓存
+    swagger_static = StaticJSON(SWAGGER_SPEC)
+
     @app.route('/api/swagger.json')
     def swagger_json():
-        return jsonify(SWAGGER_SPEC)
+        return swagger_static.response()
+    
+    # Prometheus 指标
+    if Config.METRICS_ENABLED:
+        @app.route('/metrics')
+        def prometheus_metrics():
+            return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
     
     # 请求前处理
     @app.before_request
     def before_request():
-        """记录请求信息"""
+        """记录请求信息，分配请求 ID 并开始追踪"""
+        start_background_tasks()
+        g.request_started = time.perf_counter()
+        g.request_id = tracing.request_id_from(request.headers.get(tracing.REQUEST_ID_HEADER))
+        if Config.TRACE_ENABLED:
+            g.trace, g.trace_token = tracing.start(g.request_id, f"{request.method} {request.path}")
+            if tracing.profile_requested(request.headers.get(tracing.PROFILE_HEADER)):
+                g.profile = tracing.Profile().start()
         if request.method != 'OPTIONS':  # 忽略 OPTIONS 请求
             logger.info(f"{request.method} {request.path} - {request.remote_addr}")
     
     # 请求后处理
     @app.after_request
     def after_request(response):
-        """添加响应头"""
+        """添加响应头并按 Accept-Encoding 压缩"""
+        if g.get('request_id'):
+            response.headers[tracing.REQUEST_ID_HEADER] = g.request_id
         response.headers['X-Content-Type-Options'] = 'nosniff'
         response.headers['X-Frame-Options'] = 'DENY'
         response.headers['X-XSS-Protection'] = '1; mode=block'
+        response = compress_response(response, request)
+        started = g.get('request_started')
+        if started is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(
+                request.blueprint or 'app', rule, request.method, str(response.status_code)
+            ).observe(time.perf_counter() - started)
+        g.response_status = response.status_code
         return response
     
+    @app.teardown_request
+    def teardown_request(exc):
+        """结束追踪；文件下载的发送阶段在响应迭代完成后追加到同一 trace"""
+        profile = g.pop('profile', None)
+        trace = g.pop('trace', None)
+        if profile is not None:
+            trace.profile = profile.stop()
+        if trace is not None:
+            tracing.end(trace, g.pop('trace_token'), g.get('response_status', 500))
+    
     # 首页路由
     @app.route('/')
     def index():
@@ -84,7 +156,8 @@ def create_app(config_class=Config):
             'endpoints': {
                 'harbor': '/api/harbor/*',
                 'docker': '/api/docker/*',
-                'system': '/api/system/*'
+                'system': '/api/system/*',
+                'batch': '/api/batch'
             },
             'documentation': '/api/docs',
             'health_check': '/api/system/health'
@@ -139,22 +212,6 @@ def create_app(config_class=Config):
     
     return app
 
-def check_dependencies():
-    """检查依赖项"""
-    logger.info("Checking system dependencies...")
-    
-    # 检查 Docker
-    try:
-        import docker
-        client = docker.from_env()
-        client.ping()
-        logger.info("Docker connection OK")
-        return True
-    except Exception as e:
-        logger.error(f"✗ Docker 连接失败: {str(e)}")
-        logger.error("请确保 Docker 已安装并正在运行")
-        return False
-
 def print_startup_banner():
     """打印启动横幅"""
     banner = """
@@ -174,6 +231,32 @@ def print_startup_banner():
     print(f"\n    ℹ️  按 Ctrl+C 停止服务\n")
     print("=" * 70)
 
+def run_production():
+    """生产模式：gunicorn 预加载应用后 fork 多个工作进程（配置见 gunicorn.conf.py）
+
+    未安装 gunicorn 时返回 False，由调用方回退到开发服务器
+    """
+    try:
+        from gunicorn.app.wsgiapp import WSGIApplication
+    except ImportError:
+        return False
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+    sys.argv = [sys.argv[0], '--config', config_path, 'app:app']
+    WSGIApplication('%(prog)s [OPTIONS] [APP_MODULE]').run()
+    return True
+
+def install_shutdown_handler():
+    """开发服务器的优雅退出：SIGTERM 时不再接收新的传输，等待进行中的传输完成后退出"""
+    import signal
+    from services import shutdown
+    
+    def handle_term(signum, frame):
+        shutdown.begin()
+        shutdown.wait_idle(Config.SERVER_GRACEFUL_TIMEOUT)
+        sys.exit(0)
+    
+    signal.signal(signal.SIGTERM, handle_term)
+
 # 创建应用实例
 app = create_app()
 
@@ -182,8 +265,7 @@ if __name__ == '__main__':
         should_print = (not Config.DEBUG) or (os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
         if should_print:
             print_startup_banner()
-            if not check_dependencies():
-                logger.warning("依赖检查失败，但仍尝试启动服务...")
+            # Docker 连接由后台健康探测检查，不阻塞启动；结果见 /api/system/health/ready
             import urllib3
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
             logger.info("=" * 70)
@@ -195,12 +277,21 @@ if __name__ == '__main__':
             logger.info(f"CORS origins: {Config.CORS_ORIGINS}")
             logger.info("=" * 70)
         
+        # 非调试模式优先使用多进程服务器
+        if not Config.DEBUG and run_production():
+            sys.exit(0)
+        logger.info("gunicorn 未安装或处于调试模式，使用 Werkzeug 开发服务器")
+        from services import job_journal
+        job_journal.recover()
+        install_shutdown_handler()
+        start_background_tasks()
+        
         # 启动应用
         app.run(
-            host='0.0.0.0',
-            port=5001,
+            host=Config.SERVER_HOST,
+            port=Config.SERVER_PORT,
             debug=Config.DEBUG,
-            threaded=True,
+            threaded=Config.SERVER_THREADED,
             use_reloader=Config.DEBUG
         )
         
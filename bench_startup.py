@@ -0,0 +1,95 @@
+"""
+启动耗时基准
+在独立进程中多次执行 import app（含 create_app），取中位数与启动预算比较；
+同时检查延迟导入的模块没有在启动时被加载。超出预算或违反延迟导入时退出码为 1
+
+用法：python bench_startup.py [--runs N] [--budget MS] [--top N]
+预算默认取环境变量 STARTUP_BUDGET_MS（默认 1000）
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# 只在首次使用时导入的模块（Docker 客户端、系统采样、请求 profile）
+LAZY_MODULES = ('docker', 'psutil', 'cProfile', 'pstats')
+
+_PROBE = (
+    "import sys, time\n"
+    "t = time.perf_counter()\n"
+    "import app\n"
+    "elapsed = (time.perf_counter() - t) * 1000\n"
+    "loaded = [m for m in {lazy!r} if m in sys.modules]\n"
+    "print(f'{{elapsed:.1f}}|{{\",\".join(loaded)}}')\n"
+)
+
+
+def run_once(root):
+    """返回 (耗时毫秒, 提前加载的模块, -X importtime 输出)"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(lazy=LAZY_MODULES)],
+        cwd=root, capture_output=True, text=True, timeout=120
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app 失败:\n{proc.stderr[-2000:]}")
+    line = proc.stdout.strip().splitlines()[-1]
+    elapsed, loaded = line.split('|', 1)
+    return float(elapsed), [m for m in loaded.split(',') if m], proc.stderr
+
+
+def top_imports(importtime_output, limit):
+    """按累计耗时排序的顶层导入（微秒）"""
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split(':', 1)[1].split('|')
+        # 模块名前的缩进表示嵌套层级，每层两个空格
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth <= 1:
+            rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='应用启动耗时基准')
+    parser.add_argument('--runs', type=int, default=5, help='运行次数，取中位数')
+    parser.add_argument('--budget', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', 1000)),
+                        help='启动预算（毫秒）')
+    parser.add_argument('--top', type=int, default=15, help='输出耗时最多的导入条数')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    # 第一次运行用于生成字节码缓存，不计入结果
+    run_once(root)
+    timings = []
+    importtime = ''
+    eager = set()
+    for _ in range(args.runs):
+        elapsed, loaded, importtime = run_once(root)
+        timings.append(elapsed)
+        eager.update(loaded)
+
+    median = statistics.median(timings)
+    print(f"import app: 中位数 {median:.1f} ms（{args.runs} 次: {', '.join(f'{t:.0f}' for t in timings)}），预算 {args.budget:.0f} ms")
+    print("耗时最多的导入（累计）:")
+    for cumulative_us, name in top_imports(importtime, args.top):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if eager:
+        print(f"✗ 以下模块应在首次使用时导入，但在启动时已加载: {', '.join(sorted(eager))}")
+        failed = True
+    if median > args.budget:
+        print(f"✗ 启动耗时超出预算 {median - args.budget:.1f} ms")
+        failed = True
+    if not failed:
+        print("✓ 启动耗时在预算内")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -37,15 +37,139 @@ class Config:
     LOG_FILE = os.path.join(basedir, os.environ.get('LOG_FILE', 'logs/app.log'))
     LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))  # 默认 10MB
     LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+    # 日志文件格式：text 或 json（JSON Lines）；写入队列容量
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    # 高频日志限流：同一调用位置每个窗口（秒）最多输出的条数（0 表示不限流）
+    LOG_SAMPLE_WINDOW = float(os.environ.get('LOG_SAMPLE_WINDOW', 5))
+    LOG_SAMPLE_BURST = int(os.environ.get('LOG_SAMPLE_BURST', 10))
+    # /api/system/logs 单次最多返回行数；/api/system/logs/stream 单个连接最长保持秒数（客户端会自动重连）
+    LOG_TAIL_MAX_LINES = int(os.environ.get('LOG_TAIL_MAX_LINES', 5000))
+    LOG_FOLLOW_MAX_SECONDS = int(os.environ.get('LOG_FOLLOW_MAX_SECONDS', 600))
+    # 操作日志数据库（SQLite）路径与保留天数（0 表示永久保留）
+    OPERATION_LOG_DB = os.path.join(basedir, os.environ.get('OPERATION_LOG_DB', 'logs/operations.db'))
+    OPERATION_LOG_RETENTION_DAYS = int(os.environ.get('OPERATION_LOG_RETENTION_DAYS', 365))
+    # 传输任务日志（JSON Lines），服务重启后据此续传中断的导出 / 上传
+    JOB_JOURNAL_FILE = os.path.join(basedir, os.environ.get('JOB_JOURNAL_FILE', 'logs/jobs.jsonl'))
+    # 任务日志超过该大小（字节）时由清理任务压缩
+    JOB_JOURNAL_COMPACT_BYTES = int(os.environ.get('JOB_JOURNAL_COMPACT_BYTES', 1024 * 1024))
     
     # Harbor API 配置
     HARBOR_API_VERSION = os.environ.get('HARBOR_API_VERSION', 'v2.0')
     HARBOR_REQUEST_TIMEOUT = int(os.environ.get('HARBOR_REQUEST_TIMEOUT', 30))
+    # Harbor 主机熔断与自适应超时：连续失败次数阈值、熔断冷却秒数、
+    # 自适应超时下限与 p99 放大倍数
+    HARBOR_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('HARBOR_CIRCUIT_FAILURE_THRESHOLD', 5))
+    HARBOR_CIRCUIT_COOLDOWN = int(os.environ.get('HARBOR_CIRCUIT_COOLDOWN', 30))
+    HARBOR_MIN_TIMEOUT = float(os.environ.get('HARBOR_MIN_TIMEOUT', 5))
+    HARBOR_TIMEOUT_FACTOR = float(os.environ.get('HARBOR_TIMEOUT_FACTOR', 4))
+    # 对冲读：GET 超过 p95 未返回时再发一个相同请求
+    HARBOR_HEDGED_READS = os.environ.get('HARBOR_HEDGED_READS', 'False').lower() == 'true'
+    HARBOR_HEDGE_WORKERS = int(os.environ.get('HARBOR_HEDGE_WORKERS', 32))
+    # 批量接口并发线程数（同时作为连接池大小）与单次最多仓库数
+    HARBOR_BULK_WORKERS = int(os.environ.get('HARBOR_BULK_WORKERS', 8))
+    HARBOR_BULK_MAX_REPOS = int(os.environ.get('HARBOR_BULK_MAX_REPOS', 500))
+    # 上传权限检查结果缓存时间（秒）
+    PERMISSION_CACHE_TTL = int(os.environ.get('PERMISSION_CACHE_TTL', 60))
+    # /api/batch 单次最多操作数
+    BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 20))
+    # Registry v2 Bearer token 提前刷新的秒数，以及最短缓存时间
+    REGISTRY_TOKEN_REFRESH_MARGIN = int(os.environ.get('REGISTRY_TOKEN_REFRESH_MARGIN', 30))
+    REGISTRY_TOKEN_MIN_TTL = int(os.environ.get('REGISTRY_TOKEN_MIN_TTL', 5))
+    # Registry v2 tags/list 每页数量（n 参数）
+    REGISTRY_TAGS_PAGE_SIZE = int(os.environ.get('REGISTRY_TAGS_PAGE_SIZE', 1000))
+    # 元数据目录后台增量同步间隔（秒），0 表示仅在调用同步接口时执行
+    CATALOG_SYNC_INTERVAL = int(os.environ.get('CATALOG_SYNC_INTERVAL', 0))
+    # 同步 artifact 时对未变化仓库全量对账 tag 的间隔（秒，0 为不对账），覆盖给已有镜像增删 tag 的情况
+    CATALOG_TAG_RECONCILE_INTERVAL = int(os.environ.get('CATALOG_TAG_RECONCILE_INTERVAL', 3600))
+    # 存储分析索引的最长使用时间（秒），超过后请求时在后台刷新
+    STORAGE_ANALYTICS_MAX_AGE = int(os.environ.get('STORAGE_ANALYTICS_MAX_AGE', 600))
+    
+    # Harbor Webhook：校验用的 Authorization 头取值（为空则拒绝所有 webhook 请求）
+    HARBOR_WEBHOOK_SECRET = os.environ.get('HARBOR_WEBHOOK_SECRET', '')
+    # 推送后预热导出：仓库匹配规则（逗号分隔的通配符，如 library/*）、拉取凭据、后台线程数
+    WEBHOOK_PREWARM_PATTERNS = [p.strip() for p in os.environ.get('WEBHOOK_PREWARM_PATTERNS', '').split(',') if p.strip()]
+    WEBHOOK_PREWARM_HARBOR_URL = os.environ.get('WEBHOOK_PREWARM_HARBOR_URL', '')
+    WEBHOOK_PREWARM_USERNAME = os.environ.get('WEBHOOK_PREWARM_USERNAME', '')
+    WEBHOOK_PREWARM_PASSWORD = os.environ.get('WEBHOOK_PREWARM_PASSWORD', '')
+    WEBHOOK_PREWARM_WORKERS = int(os.environ.get('WEBHOOK_PREWARM_WORKERS', 1))
+    
+    # 响应压缩：是否启用、最小压缩字节数、gzip 压缩级别、brotli 质量（需安装 brotli）
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'True').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+    
+    # 系统资源后台采样：采样间隔（秒）、保留的历史条数、下载/上传目录全量重扫间隔（秒）
+    SYSTEM_SAMPLE_INTERVAL = int(os.environ.get('SYSTEM_SAMPLE_INTERVAL', 5))
+    SYSTEM_SAMPLE_HISTORY = int(os.environ.get('SYSTEM_SAMPLE_HISTORY', 720))
+    SYSTEM_FOLDER_RESCAN_INTERVAL = int(os.environ.get('SYSTEM_FOLDER_RESCAN_INTERVAL', 600))
+    
+    # 磁盘清理任务：执行间隔（秒，0 表示不启用）、文件最长保留时间（秒）、
+    # 下载与上传目录总容量配额（字节，超出后按 LRU 淘汰，0 表示不限制）
+    JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 300))
+    JANITOR_MAX_AGE = int(os.environ.get('JANITOR_MAX_AGE', 24 * 3600))
+    JANITOR_MAX_BYTES = int(os.environ.get('JANITOR_MAX_BYTES', 0))
+    # 本服务拉取的本地镜像：最长保留时间（秒）与最多保留个数（0 表示不限制）
+    JANITOR_IMAGE_MAX_AGE = int(os.environ.get('JANITOR_IMAGE_MAX_AGE', 3600))
+    JANITOR_MAX_IMAGES = int(os.environ.get('JANITOR_MAX_IMAGES', 20))
+    
+    # 是否开放 /metrics（Prometheus 文本格式）
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    
+    # 请求追踪：是否启用、保留最近多少个 trace、无子 span 的请求超过多少毫秒才保留
+    TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'True').lower() == 'true'
+    TRACE_HISTORY = int(os.environ.get('TRACE_HISTORY', 200))
+    TRACE_MIN_DURATION_MS = int(os.environ.get('TRACE_MIN_DURATION_MS', 500))
+    # 按请求头 X-Profile 对单个请求做 cProfile 采样；配置 PROFILE_TOKEN 时请求头需与其一致
+    PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', 'False').lower() == 'true'
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+    
+    # 健康探测：间隔（秒）、单次探测超时（秒）、需探测的 Harbor 地址（逗号分隔），
+    # 以及 Harbor 不可达时是否视为未就绪
+    HEALTH_PROBE_INTERVAL = int(os.environ.get('HEALTH_PROBE_INTERVAL', 10))
+    HEALTH_PROBE_TIMEOUT = float(os.environ.get('HEALTH_PROBE_TIMEOUT', 5))
+    HEALTH_HARBOR_URLS = [u.strip() for u in os.environ.get('HEALTH_HARBOR_URLS', '').split(',') if u.strip()]
+    HEALTH_REQUIRE_HARBOR = os.environ.get('HEALTH_REQUIRE_HARBOR', 'False').lower() == 'true'
+    
+    # 调度：按 registry 主机限制镜像传输（pull / push / save）与 Harbor API 的并发数（按进程），
+    # 超出时按租户加权公平排队；租户按操作用户（user）或镜像所属项目（project）划分，
+    # 权重格式 name=2,other=0.5（默认 1）；排队超时（秒，0 为不限）
+    SCHED_ENABLED = os.environ.get('SCHED_ENABLED', 'True').lower() == 'true'
+    SCHED_TRANSFER_PER_HOST = int(os.environ.get('SCHED_TRANSFER_PER_HOST', 4))
+    SCHED_API_PER_HOST = int(os.environ.get('SCHED_API_PER_HOST', 16))
+    SCHED_TENANT_BY = os.environ.get('SCHED_TENANT_BY', 'user').lower()
+    SCHED_TENANT_WEIGHTS = os.environ.get('SCHED_TENANT_WEIGHTS', '')
+    SCHED_TRANSFER_QUEUE_TIMEOUT = float(os.environ.get('SCHED_TRANSFER_QUEUE_TIMEOUT', 600))
+    SCHED_API_QUEUE_TIMEOUT = float(os.environ.get('SCHED_API_QUEUE_TIMEOUT', 30))
+    
+    # 带宽限速（字节/秒，0 为不限）：镜像下载响应与上传请求体的全局、按客户端 IP、按任务速率，
+    # 可通过 /api/system/bandwidth 在运行时修改
+    BANDWIDTH_GLOBAL = int(os.environ.get('BANDWIDTH_GLOBAL', 0))
+    BANDWIDTH_PER_IP = int(os.environ.get('BANDWIDTH_PER_IP', 0))
+    BANDWIDTH_PER_JOB = int(os.environ.get('BANDWIDTH_PER_JOB', 0))
     
     # 服务器配置
     SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
     SERVER_PORT = int(os.environ.get('SERVER_PORT', 5001))
     SERVER_THREADED = os.environ.get('SERVER_THREADED', 'True').lower() == 'true'
+    # 生产模式（gunicorn gthread）：工作进程数（0 为 CPU 核数）、每进程线程数、keep-alive 秒数、
+    # 处理完多少请求后回收工作进程（附加随机抖动避免同时重启）、优雅退出等待时间
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 0))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+    SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE', 5))
+    SERVER_MAX_REQUESTS = int(os.environ.get('SERVER_MAX_REQUESTS', 2000))
+    SERVER_MAX_REQUESTS_JITTER = int(os.environ.get('SERVER_MAX_REQUESTS_JITTER', 200))
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 300))
+    # 多进程共享的运行时状态（文件锁等），无需持久化
+    RUN_DIR = os.path.join(basedir, os.environ.get('RUN_DIR', 'run'))
+    
+    # 镜像文件发送方式：sendfile（由 WSGI 服务器零拷贝发送）或 x-accel（交给 Nginx 发送，
+    # X_ACCEL_PREFIX 为 Nginx 中映射到 DOWNLOAD_FOLDER 的 internal location）
+    SENDFILE_MODE = os.environ.get('SENDFILE_MODE', 'sendfile').lower()
+    X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/_downloads/')
+    # x-accel 模式下 Nginx 何时读完文件不可知，临时导出文件延迟删除（秒）
+    X_ACCEL_CLEANUP_DELAY = int(os.environ.get('X_ACCEL_CLEANUP_DELAY', 300))
     
     # 会话配置
     SESSION_LIFETIME = timedelta(hours=24)
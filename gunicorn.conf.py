@@ -0,0 +1,62 @@
+"""
+gunicorn 配置（生产模式）
+gthread 工作进程：多进程利用多核，进程内多线程处理并发下载；预加载应用后 fork 工作进程，
+处理一定数量请求后回收，kill -HUP 主进程平滑重载，SIGTERM 时不再接收新的传输并等待进行中的请求完成，
+超过 graceful_timeout 被终止的任务在下次启动时由任务日志恢复
+
+用法：gunicorn -c gunicorn.conf.py app:app（FLASK_DEBUG=false 时 python app.py 自动使用）
+"""
+
+import multiprocessing
+import os
+import signal
+from config import Config
+
+bind = f"{Config.SERVER_HOST}:{Config.SERVER_PORT}"
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+workers = Config.SERVER_WORKERS or multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = Config.SERVER_THREADS
+keepalive = Config.SERVER_KEEPALIVE
+# gthread 工作进程的心跳由主循环发出，与单个请求耗时无关，长时间的镜像导出不会触发超时
+timeout = 120
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+
+preload_app = True
+# 文件响应使用 os.sendfile 零拷贝发送
+sendfile = True
+# 容器内 /tmp 可能位于 overlay 文件系统，心跳文件放在内存中
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# 访问日志输出到标准输出，应用日志仍写入 LOG_FILE
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """后台线程不会被 fork 继承，在每个工作进程中启动"""
+    from app import start_background_tasks
+    start_background_tasks()
+
+
+def on_starting(server):
+    """主进程启动时（工作进程创建前）处理上次中断的传输任务"""
+    from services import job_journal
+    stats = job_journal.recover()
+    if stats['resumable'] or stats['discarded']:
+        server.log.info(f"中断的传输任务: 可续传 {stats['resumable']} 个，已清理 {stats['discarded']} 个")
+
+
+def post_worker_init(worker):
+    """SIGTERM 时先进入停止状态（新的传输返回 503、就绪探针失败），再交给 gunicorn 等待进行中的请求"""
+    from services import shutdown
+    handle_exit = worker.handle_exit
+
+    def handle_term(sig, frame):
+        shutdown.begin()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
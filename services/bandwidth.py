@@ -0,0 +1,440 @@
+"""
+带宽限速
+令牌桶限制镜像文件下载响应与上传请求体的传输速率，分全局、按客户端 IP、按任务三级，
+每块数据需同时从各级令牌桶取得令牌（取最长等待时间）。全局与按 IP 的令牌桶状态保存在
+RUN_DIR 下的共享文件中（flock 保护），多个工作进程共同受限；任务令牌桶在进程内。
+
+限速设置（字节/秒，0 为不限）默认取自配置，可通过管理接口在运行时修改：修改写入
+RUN_DIR/bandwidth.json，各工作进程在 1 秒内生效。JSON 接口响应不限速；
+Docker 守护进程与 registry 之间的 pull / push 不经过本进程，无法在此限速
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from config import Config
+from utils import metrics
+from utils.logger import setup_logger
+
+logger = setup_logger('bandwidth')
+
+STATE_DIR = os.path.join(Config.RUN_DIR, 'bandwidth')
+SETTINGS_FILE = os.path.join(Config.RUN_DIR, 'bandwidth.json')
+# 允许的突发量：令牌桶容量为 BURST_SECONDS 秒的流量，至少一个数据块
+BURST_SECONDS = 0.25
+MIN_BURST = 64 * 1024
+# 各进程检查设置文件是否变化的间隔（秒）
+SETTINGS_CHECK_INTERVAL = 1.0
+# 超过该时间（秒）未使用的按 IP 令牌桶文件由清理任务删除
+IDLE_BUCKET_TTL = 3600
+# 累计到该字节数再取令牌，减少共享令牌桶的加锁次数（WSGI 服务器按 8KB 读取文件）
+CHARGE_SIZE = 64 * 1024
+# 单次休眠上限（秒），期间限速被调整时按新速率重新计算剩余等待
+MAX_SLEEP_SLICE = 1.0
+
+LIMIT_KEYS = ('global', 'per_ip', 'per_job')
+
+SHAPED_BYTES = metrics.counter(
+    'harbor_export_shaped_bytes_total', '经过限速的传输字节数', ('direction',)
+)
+SHAPED_WAIT = metrics.counter(
+    'harbor_export_shaped_wait_seconds_total', '因限速等待的总时间（秒）', ('direction',)
+)
+
+_STATE = struct.Struct('<dd')
+
+
+def _defaults():
+    return {
+        'global': Config.BANDWIDTH_GLOBAL,
+        'per_ip': Config.BANDWIDTH_PER_IP,
+        'per_job': Config.BANDWIDTH_PER_JOB,
+        'jobs': {}
+    }
+
+
+def validate_rate(value):
+    """速率需为 0（不限速）或不小于 CHARGE_SIZE 的整数（字节/秒）"""
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"无效的速率: {value!r}，需为非负整数（字节/秒）")
+    if 0 < value < CHARGE_SIZE:
+        raise ValueError(f"速率过低: {value}，需为 0（不限速）或至少 {CHARGE_SIZE} 字节/秒")
+    return value
+
+
+def _burst(rate):
+    return max(rate * BURST_SECONDS, MIN_BURST)
+
+
+def _refill(tokens, last, now, rate, n):
+    """补充令牌后取出 n 个，返回 (剩余令牌, 需等待的秒数)；令牌不足时记为负数，由后续请求补偿"""
+    tokens = min(_burst(rate), tokens + (now - last) * rate) - n
+    return tokens, (-tokens / rate if tokens < 0 else 0.0)
+
+
+class _LocalBucket:
+    """进程内令牌桶（按任务）"""
+
+    def __init__(self):
+        self._tokens = None
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, n, rate):
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens, self._last = _burst(rate), now
+            self._tokens, wait = _refill(self._tokens, self._last, now, rate, n)
+            self._last = now
+            return wait
+
+
+class _SharedBucket:
+    """多进程共享的令牌桶：状态（令牌数、上次更新时间）保存在文件中，读写时加排他锁
+
+    time.monotonic() 在 Linux 上为系统级单调时钟，不同进程的取值可以直接比较
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # fork 后继承的描述符与父进程共享同一把 flock，需要重新打开
+        if self._fd is not None and self._pid == os.getpid():
+            return self._fd
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._pid = os.getpid()
+        return self._fd
+
+    def reserve(self, n, rate):
+        with self._lock:
+            while True:
+                fd = self._open()
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    # 文件被清理任务删除时重新创建
+                    if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                        break
+                except FileNotFoundError:
+                    pass
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+                self._fd = None
+            try:
+                now = time.monotonic()
+                data = os.pread(fd, _STATE.size, 0)
+                tokens, last = _STATE.unpack(data) if len(data) == _STATE.size else (_burst(rate), now)
+                tokens, wait = _refill(tokens, last, now, rate, n)
+                os.pwrite(fd, _STATE.pack(tokens, now), 0)
+                return wait
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = None
+
+
+@contextmanager
+def _settings_file_lock():
+    """跨进程的设置写锁；锁文件被 reset 删除时重新打开"""
+    os.makedirs(Config.RUN_DIR, exist_ok=True)
+    path = SETTINGS_FILE + '.lock'
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+    try:
+        yield path
+    finally:
+        os.close(fd)
+
+
+class _Settings:
+    """限速设置：配置默认值叠加 RUN_DIR/bandwidth.json 中的运行时修改"""
+
+    def __init__(self):
+        # 配置的默认值与管理接口使用同样的校验，速率过低时启动失败
+        defaults = _defaults()
+        for key in LIMIT_KEYS:
+            try:
+                validate_rate(defaults[key])
+            except ValueError as e:
+                raise ValueError(f"BANDWIDTH_{key.upper()} 配置错误: {str(e)}")
+        self._values = defaults
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _reload(self, force=False):
+        # 文件以原子替换方式写入，inode 与 mtime 一起判断是否变化
+        try:
+            stat = os.stat(SETTINGS_FILE)
+            mtime = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime and not force:
+            return
+        values = _defaults()
+        if mtime is not None:
+            try:
+                with open(SETTINGS_FILE, encoding='utf-8') as f:
+                    values.update(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"[bandwidth] 读取限速设置失败: {str(e)}")
+                return
+        self._values = values
+        self._mtime = mtime
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at >= SETTINGS_CHECK_INTERVAL:
+            with self._lock:
+                if now - self._checked_at >= SETTINGS_CHECK_INTERVAL:
+                    self._reload()
+                    self._checked_at = now
+        return self._values
+
+    def _write(self, change):
+        """在文件锁内读取最新设置、应用 change 后原子替换；返回新设置"""
+        with _settings_file_lock():
+            with self._lock:
+                self._reload()
+                values = json.loads(json.dumps(self._values))
+                change(values)
+                overrides = {k: values[k] for k in LIMIT_KEYS if values[k] != _defaults()[k]}
+                overrides['jobs'] = values['jobs']
+                partial = SETTINGS_FILE + '.partial'
+                with open(partial, 'w', encoding='utf-8') as f:
+                    json.dump(overrides, f)
+                os.replace(partial, SETTINGS_FILE)
+                self._reload(force=True)
+                self._checked_at = time.monotonic()
+                return self._values
+
+    def update(self, limits=None, jobs=None):
+        def change(values):
+            values.update(limits or {})
+            for job_id, rate in (jobs or {}).items():
+                if rate is None:
+                    values['jobs'].pop(job_id, None)
+                else:
+                    values['jobs'][job_id] = rate
+        return self._write(change)
+
+    def reset(self):
+        """删除运行时修改与锁文件，恢复配置值"""
+        with _settings_file_lock() as lock_path:
+            with self._lock:
+                for path in (SETTINGS_FILE, lock_path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self._reload(force=True)
+                self._checked_at = time.monotonic()
+                return self._values
+
+
+settings = _Settings()
+
+_global_bucket = _SharedBucket(os.path.join(STATE_DIR, 'global'))
+# 进行中任务使用的按 IP 令牌桶，该 IP 的任务全部结束后关闭
+_ip_buckets = {}
+_jobs = {}
+_registry_lock = threading.Lock()
+
+
+def _ip_bucket(ip):
+    with _registry_lock:
+        bucket = _ip_buckets.get(ip)
+        if bucket is None:
+            name = hashlib.sha1(ip.encode('utf-8')).hexdigest()
+            bucket = _ip_buckets[ip] = _SharedBucket(os.path.join(STATE_DIR, 'ip', name))
+        return bucket
+
+
+def _release_ip_bucket(ip):
+    with _registry_lock:
+        if any(job.client_ip == ip for job in _jobs.values()):
+            return
+        bucket = _ip_buckets.pop(ip, None)
+    if bucket is not None:
+        bucket.close()
+
+
+class Job:
+    """一次下载或上传传输，throttle 在每块数据传输后调用
+
+    id 由服务端生成（请求 ID 加随机后缀），重复使用同一 X-Request-ID 的传输互不影响，
+    管理接口按 id 单独限速
+    """
+
+    def __init__(self, job_id, request_id, client_ip, direction):
+        self.id = job_id
+        self.request_id = request_id
+        self.client_ip = client_ip
+        self.direction = direction
+        self.bytes = 0
+        self.waited = 0.0
+        self._pending = 0
+        self.started = time.time()
+        self._bucket = _LocalBucket()
+        self._bytes = SHAPED_BYTES.labels(direction)
+        self._wait = SHAPED_WAIT.labels(direction)
+
+    def limits(self):
+        """当前生效的 (全局, 按 IP, 按任务) 速率"""
+        values = settings.get()
+        return values['global'], values['per_ip'] if self.client_ip else 0, values['jobs'].get(self.id, values['per_job'])
+
+    def limited(self):
+        return any(self.limits())
+
+    def rate(self):
+        """生效速率中最小的非零值，不限速时为 0"""
+        return min((r for r in self.limits() if r), default=0)
+
+    def throttle(self, n):
+        self.bytes += n
+        self._pending += n
+        if self._pending < CHARGE_SIZE:
+            return
+        n, self._pending = self._pending, 0
+        limits = self.limits()
+        wait = self._reserve(n, limits)
+        while wait > 0:
+            step = min(wait, MAX_SLEEP_SLICE)
+            time.sleep(step)
+            self.waited += step
+            self._wait.inc(step)
+            wait -= step
+            current = self.limits()
+            if wait > 0 and current != limits:
+                # 限速被修改（或取消），按新速率重新计算剩余欠账的等待时间
+                limits = current
+                wait = self._reserve(0, limits)
+        self._bytes.inc(n)
+
+    def _reserve(self, n, limits):
+        """从各级令牌桶取 n 字节，返回需等待的秒数（n 为 0 时只计算已有欠账）"""
+        global_rate, ip_rate, job_rate = limits
+        wait = 0.0
+        if job_rate:
+            wait = self._bucket.reserve(n, job_rate)
+        if ip_rate:
+            wait = max(wait, _ip_bucket(self.client_ip).reserve(n, ip_rate))
+        if global_rate:
+            wait = max(wait, _global_bucket.reserve(n, global_rate))
+        return wait
+
+    def finish(self):
+        with _registry_lock:
+            _jobs.pop(self.id, None)
+        if self.client_ip:
+            _release_ip_bucket(self.client_ip)
+        if self.id in settings.get()['jobs']:
+            try:
+                settings.update(jobs={self.id: None})
+            except OSError as e:
+                logger.warning(f"[bandwidth] 清除任务限速设置失败: {str(e)}")
+
+    def snapshot(self):
+        elapsed = time.time() - self.started
+        return {
+            'id': self.id,
+            'request_id': self.request_id,
+            'direction': self.direction,
+            'client_ip': self.client_ip,
+            'bytes': self.bytes,
+            'elapsed': round(elapsed, 1),
+            'avg_rate': int(self.bytes / elapsed) if elapsed > 0 else 0,
+            'limit': self.rate(),
+            'waited': round(self.waited, 2)
+        }
+
+
+def start_job(request_id, client_ip, direction):
+    """登记一次传输；direction 为 download（响应）或 upload（请求体）"""
+    job = Job(f"{request_id}-{uuid.uuid4().hex[:8]}", request_id, client_ip, direction)
+    with _registry_lock:
+        _jobs[job.id] = job
+    return job
+
+
+class ThrottledStream:
+    """按任务限速读取的请求体（包装 wsgi.input，在表单解析前替换）"""
+
+    def __init__(self, stream, job):
+        self._stream = stream
+        self._job = job
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._job.throttle(len(data))
+        return data
+
+    def readline(self, size=-1):
+        data = self._stream.readline(size)
+        self._job.throttle(len(data))
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def snapshot():
+    values = settings.get()
+    with _registry_lock:
+        jobs = list(_jobs.values())
+    return {
+        'limits': {k: values[k] for k in LIMIT_KEYS},
+        'job_overrides': dict(values['jobs']),
+        'defaults': {k: v for k, v in _defaults().items() if k in LIMIT_KEYS},
+        'pid': os.getpid(),
+        'jobs': [job.snapshot() for job in jobs]
+    }
+
+
+def prune_buckets(max_age=IDLE_BUCKET_TTL):
+    """删除长时间未使用的按 IP 令牌桶文件（由清理任务调用）"""
+    folder = os.path.join(STATE_DIR, 'ip')
+    if not os.path.isdir(folder):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if now - os.path.getmtime(path) < max_age:
+                continue
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.remove(path)
+            removed += 1
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        finally:
+            os.close(fd)
+    return removed
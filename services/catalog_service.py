@@ -0,0 +1,361 @@
+"""
+Harbor 元数据目录增量同步
+基于仓库 update_time / artifact push_time 高水位线，只拉取上次同步后发生变化的数据；
+给已有 artifact 增删 tag 不改变这两个时间，按 CATALOG_TAG_RECONCILE_INTERVAL 定期全量对账 tag
+"""
+
+import threading
+import time
+from datetime import datetime
+from config import Config
+from services.harbor_service import HarborService
+from utils.auth import credential_fingerprint
+from utils.logger import setup_logger
+
+logger = setup_logger('catalog_service')
+
+PAGE_SIZE = 100
+
+
+def _parse_time(value):
+    """将 Harbor 时间字符串转换为时间戳，便于比较"""
+    if not value:
+        return 0.0
+    text = str(value).strip().replace('Z', '+00:00')
+    # Harbor 可能返回纳秒级小数，fromisoformat 只支持到微秒
+    if '.' in text:
+        head, _, tail = text.partition('.')
+        digits = ''.join(c for c in tail if c.isdigit())
+        zone = tail[len(digits):]
+        text = f"{head}.{digits[:6]}{zone}" if digits else f"{head}{zone}"
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return 0.0
+
+
+class HarborCatalog:
+    """单个 Harbor 实例（按用户区分可见范围）的本地元数据视图"""
+
+    def __init__(self, harbor_url, username):
+        self.harbor_url = harbor_url
+        self.username = username
+        self.projects = {}        # project_name -> project
+        self.repositories = {}    # project_name -> {repo_name: repository}
+        self.artifacts = {}       # repo_name -> {digest: artifact}
+        self.project_marks = {}   # project_name -> 已同步的最大仓库 update_time
+        self.repo_marks = {}      # repo_name -> 已同步的最大 artifact push_time
+        self.repo_full_at = {}    # repo_name -> 上次全量列举 artifact 的时间
+        self.last_sync = None
+        self.last_stats = None
+        # lock 保护视图数据，只在写入同步结果时短暂持有；_sync_lock 保证同时只有一次同步
+        self.lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pending = set()     # 待失效的 (project_name, repo_name)，下次同步开始时处理
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """注册变更回调：callback(event, project_name, repo_name, payload)"""
+        self._listeners.append(callback)
+
+    def _notify(self, event, project_name, repo_name=None, payload=None):
+        for callback in list(self._listeners):
+            try:
+                callback(event, project_name, repo_name, payload)
+            except Exception as e:
+                logger.warning(f"目录变更回调失败: {str(e)}")
+
+    def sync(self, service, with_artifacts=False, full=False):
+        """执行一次同步；full=True 时忽略水位线重新抓取
+
+        网络请求不持有 self.lock，每个项目 / 仓库的结果在短临界区内写入并通知监听者，
+        快照、搜索索引构建与 webhook 失效不等待整个同步完成
+        """
+        with self._sync_lock:
+            started = time.time()
+            stats = {
+                'requests': 0,
+                'projects': 0,
+                'changed_repositories': 0,
+                'removed_repositories': 0,
+                'removed_projects': 0,
+                'changed_artifacts': 0,
+                'removed_artifacts': 0,
+                'reconciled_tags': 0,
+                'full': bool(full)
+            }
+            # 水位线只由同步线程读写
+            if full:
+                self.project_marks.clear()
+                self.repo_marks.clear()
+            with self.lock:
+                pending, self._pending = self._pending, set()
+            for project_name, repo_name in pending:
+                self.project_marks.pop(project_name, None)
+                self.repo_marks.pop(repo_name, None)
+
+            projects = self._list_all_projects(service, stats)
+            current = {p['name'] for p in projects}
+            with self.lock:
+                for name in list(self.projects):
+                    if name not in current:
+                        self._drop_project(name)
+                        stats['removed_projects'] += 1
+                for project in projects:
+                    self.projects[project['name']] = project
+
+            for project in projects:
+                name = project['name']
+                changed = self._sync_project(service, project, stats)
+                if with_artifacts:
+                    for repo_name in changed:
+                        self._sync_artifacts(service, name, repo_name, stats)
+                    for repo_name in self._tags_due(name, changed, started):
+                        self._sync_artifacts(service, name, repo_name, stats, full_listing=True)
+                        stats['reconciled_tags'] += 1
+
+            with self.lock:
+                stats['projects'] = len(self.projects)
+                stats['repositories'] = sum(len(r) for r in self.repositories.values())
+                stats['duration'] = round(time.time() - started, 3)
+                self.last_sync = time.strftime('%Y-%m-%d %H:%M:%S')
+                self.last_stats = stats
+            logger.info(
+                f"[catalog] {self.harbor_url} 同步完成: requests={stats['requests']} "
+                f"changed={stats['changed_repositories']} removed={stats['removed_repositories']} "
+                f"duration={stats['duration']}s"
+            )
+            return stats
+
+    def _list_all_projects(self, service, stats):
+        page = 1
+        result = []
+        while True:
+            items = service.get_projects(page, PAGE_SIZE)
+            stats['requests'] += 1
+            if not items:
+                break
+            result.extend(items)
+            if len(items) < PAGE_SIZE:
+                break
+            page += 1
+        return result
+
+    def _sync_project(self, service, project, stats):
+        """按 -update_time 倒序翻页，遇到不晚于水位线的仓库即停止"""
+        name = project['name']
+        mark = self.project_marks.get(name)
+        updated_repos = {}
+        changed = []
+        newest = mark or 0.0
+        page = 1
+        while True:
+            items = service.get_repositories(name, page, PAGE_SIZE, sort='-update_time')
+            stats['requests'] += 1
+            reached_mark = False
+            for repo in items:
+                updated = _parse_time(repo.get('updated'))
+                if mark is not None and updated <= mark:
+                    reached_mark = True
+                    break
+                updated_repos[repo['name']] = repo
+                changed.append(repo['name'])
+                newest = max(newest, updated)
+            if reached_mark or len(items) < PAGE_SIZE:
+                break
+            page += 1
+        self.project_marks[name] = newest
+        stats['changed_repositories'] += len(changed)
+
+        # 删除对账：全量列举时直接比对；增量时仓库数与 repo_count 一致则无需比对
+        expected = project.get('repo_count')
+        with self.lock:
+            repos = self.repositories.setdefault(name, {})
+            repos.update(updated_repos)
+            for repo_name in changed:
+                self._notify('repository_updated', name, repo_name, repos[repo_name])
+            if mark is None:
+                for repo_name in [n for n in repos if n not in updated_repos]:
+                    self._remove_repository(name, repo_name)
+                    stats['removed_repositories'] += 1
+            count = len(repos)
+        if mark is not None and expected is not None and expected != count:
+            removed = self._reconcile_repositories(service, name, stats)
+            stats['removed_repositories'] += removed
+        return changed
+
+    def _reconcile_repositories(self, service, project_name, stats):
+        """仓库数量不一致时全量列出名称，剔除 Harbor 上已删除的仓库"""
+        seen = {}
+        page = 1
+        while True:
+            items = service.get_repositories(project_name, page, PAGE_SIZE)
+            stats['requests'] += 1
+            for repo in items:
+                seen.setdefault(repo['name'], repo)
+            if len(items) < PAGE_SIZE:
+                break
+            page += 1
+        with self.lock:
+            repos = self.repositories.setdefault(project_name, {})
+            for repo_name, repo in seen.items():
+                repos.setdefault(repo_name, repo)
+            removed = [name for name in repos if name not in seen]
+            for repo_name in removed:
+                self._remove_repository(project_name, repo_name)
+        return len(removed)
+
+    def _remove_repository(self, project_name, repo_name):
+        """调用方持有 self.lock"""
+        self.repositories.get(project_name, {}).pop(repo_name, None)
+        self.artifacts.pop(repo_name, None)
+        self.repo_marks.pop(repo_name, None)
+        self.repo_full_at.pop(repo_name, None)
+        self._notify('repository_removed', project_name, repo_name)
+
+    def _tags_due(self, project_name, changed, now):
+        """已同步过 artifact、本轮未变化且超过对账间隔的仓库"""
+        interval = Config.CATALOG_TAG_RECONCILE_INTERVAL
+        if interval <= 0:
+            return []
+        skip = set(changed)
+        return [
+            repo_name for repo_name in self.repositories.get(project_name, {})
+            if repo_name not in skip and repo_name in self.artifacts
+            and now - self.repo_full_at.get(repo_name, 0.0) >= interval
+        ]
+
+    def _sync_artifacts(self, service, project_name, repo_name, stats, full_listing=False):
+        """按 -push_time 增量拉取 artifact，数量不一致时全量对账；full_listing=True 时全量列举以对账 tag"""
+        known = self.artifacts.get(repo_name)
+        mark = self.repo_marks.get(repo_name) if known is not None else None
+        repo = self.repositories.get(project_name, {}).get(repo_name) or {}
+        expected = repo.get('artifact_count')
+        items_by_digest = dict(known or {})
+        full_listing = full_listing or mark is None
+        seen = set()
+        newest = mark or 0.0
+        page = 1
+        while True:
+            items = service.get_artifacts(project_name, repo_name, page, PAGE_SIZE, sort='-push_time')
+            stats['requests'] += 1
+            reached_mark = False
+            for artifact in items:
+                pushed = _parse_time(artifact.get('push_time'))
+                if not full_listing and pushed <= mark:
+                    reached_mark = True
+                    break
+                items_by_digest[artifact['digest']] = artifact
+                seen.add(artifact['digest'])
+                newest = max(newest, pushed)
+            if reached_mark or len(items) < PAGE_SIZE:
+                break
+            page += 1
+        stats['changed_artifacts'] += len(seen)
+
+        if full_listing:
+            removed = [d for d in items_by_digest if d not in seen]
+            self.repo_full_at[repo_name] = time.time()
+        elif expected is not None and expected != len(items_by_digest):
+            # 数量对不上说明有删除，退化为一次全量列举
+            self.repo_marks.pop(repo_name, None)
+            with self.lock:
+                self.artifacts[repo_name] = items_by_digest
+            return self._sync_artifacts(service, project_name, repo_name, stats)
+        else:
+            removed = []
+        for digest in removed:
+            items_by_digest.pop(digest, None)
+        stats['removed_artifacts'] += len(removed)
+        self.repo_marks[repo_name] = newest
+        with self.lock:
+            self.artifacts[repo_name] = items_by_digest
+            self._notify('artifacts_updated', project_name, repo_name, list(items_by_digest.values()))
+
+    def _drop_project(self, name):
+        """调用方持有 self.lock"""
+        for repo_name in list(self.repositories.get(name, {})):
+            self._remove_repository(name, repo_name)
+        self.repositories.pop(name, None)
+        self.projects.pop(name, None)
+        self.project_marks.pop(name, None)
+
+    def invalidate_repository(self, project_name, repo_name):
+        """使单个仓库的缓存失效，下次同步时重新拉取；只记录待失效项，不等待进行中的同步"""
+        with self.lock:
+            self._pending.add((project_name, repo_name))
+
+    def snapshot(self, project_name=None):
+        """导出当前视图"""
+        with self.lock:
+            names = [project_name] if project_name else list(self.projects)
+            projects = []
+            for name in names:
+                if name not in self.projects:
+                    continue
+                repos = []
+                for repo in self.repositories.get(name, {}).values():
+                    item = dict(repo)
+                    artifacts = self.artifacts.get(repo['name'])
+                    if artifacts is not None:
+                        item['tags'] = sorted({t for a in artifacts.values() for t in a.get('tags', []) if t != '<none>'})
+                    repos.append(item)
+                projects.append(dict(self.projects[name], repositories=repos))
+            return {
+                'harbor_url': self.harbor_url,
+                'last_sync': self.last_sync,
+                'last_stats': self.last_stats,
+                'projects': projects
+            }
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+_auto_sync_threads = {}
+
+
+def get_catalog(harbor_url, username, password, create=True):
+    """获取（或创建）Harbor 实例对应的目录视图
+
+    按凭据指纹区分，错误的密码不会读到同名用户已同步的目录
+    """
+    key = (HarborService.normalize_url(harbor_url), credential_fingerprint(username, password))
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None and create:
+            catalog = HarborCatalog(key[0], username)
+            _catalogs[key] = catalog
+        return catalog
+
+
+def iter_catalogs(harbor_url=None):
+    """遍历已有目录视图，可按 Harbor 地址过滤"""
+    target = HarborService.normalize_url(harbor_url) if harbor_url else None
+    with _catalogs_lock:
+        catalogs = list(_catalogs.values())
+    return [c for c in catalogs if target is None or c.harbor_url == target]
+
+
+def start_auto_sync(harbor_url, username, password, with_artifacts=False):
+    """按 CATALOG_SYNC_INTERVAL 在后台周期性增量同步"""
+    interval = Config.CATALOG_SYNC_INTERVAL
+    if interval <= 0:
+        return False
+    catalog = get_catalog(harbor_url, username, password)
+    key = (catalog.harbor_url, credential_fingerprint(username, password))
+    with _catalogs_lock:
+        if key in _auto_sync_threads and _auto_sync_threads[key].is_alive():
+            return True
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    catalog.sync(HarborService(harbor_url, username, password), with_artifacts=with_artifacts)
+                except Exception as e:
+                    logger.warning(f"[catalog] 后台同步失败: {str(e)}")
+
+        thread = threading.Thread(target=_loop, name=f'catalog-sync-{catalog.harbor_url}', daemon=True)
+        _auto_sync_threads[key] = thread
+        thread.start()
+    return True
@@ -1,18 +1,54 @@
-import docker
 import os
 import tempfile
 import shutil
 import gzip
+import threading
+import time
 from urllib.parse import urlparse
 from config import Config
-from utils.logger import setup_logger
+from services.system_monitor import account_file, remove_file, remove_tree
+from services import inflight, scheduler, job_journal
+from utils import metrics, tracing
+from utils.logger import setup_logger, SAMPLED
 
 logger = setup_logger('docker_service')
 
+PHASE_SECONDS = metrics.histogram(
+    'harbor_export_phase_seconds', '镜像导出 / 上传各阶段耗时（秒）', ('operation', 'phase')
+)
+PHASE_BYTES = metrics.counter(
+    'harbor_export_phase_bytes_total', '镜像导出 / 上传各阶段处理的字节数', ('operation', 'phase')
+)
+OPERATIONS = metrics.counter(
+    'harbor_export_operations_total', '镜像导出 / 上传 / 预热操作次数', ('operation', 'result')
+)
+
+
+def record_phase(operation, phase, started, size=None, trace=None):
+    """记录一个阶段的耗时（started 为 time.perf_counter() 起点）与处理字节数，并作为 span 写入 trace
+
+    trace 默认取当前请求的 trace；请求上下文结束后执行的阶段（如文件发送）需显式传入
+    """
+    ended = time.perf_counter()
+    PHASE_SECONDS.labels(operation, phase).observe(ended - started)
+    if size:
+        PHASE_BYTES.labels(operation, phase).inc(size)
+    trace = trace or tracing.current()
+    if trace is not None:
+        if size:
+            trace.add(f"{operation}.{phase}", started, ended, bytes=size)
+        else:
+            trace.add(f"{operation}.{phase}", started, ended)
+
+# webhook 预热的导出文件目录
+PREWARM_FOLDER = os.path.join(Config.DOWNLOAD_FOLDER, 'prewarm')
+
 class DockerService:
     """Docker 服务类"""
     
     def __init__(self):
+        # docker SDK 在首次创建客户端时导入，不计入应用启动时间
+        import docker
         try:
             self.client = docker.from_env(timeout=Config.DOCKER_TIMEOUT)
             logger.info("Docker 客户端初始化成功")
@@ -44,6 +80,7 @@ class DockerService:
     
     def pull_image(self, image_name, tag='latest'):
         """拉取镜像"""
+        from docker.errors import ImageNotFound, APIError
         try:
             full_image = f"{image_name}:{tag}"
             logger.info(f"开始拉取镜像: {full_image}")
@@ -52,9 +89,9 @@ class DockerService:
             logger.info(f"镜像拉取成功: {image.tags}")
             
             return image
-        except docker.errors.ImageNotFound:
+        except ImageNotFound:
             raise Exception(f"镜像不存在: {image_name}:{tag}")
-        except docker.errors.APIError as e:
+        except APIError as e:
             logger.error(f"拉取镜像失败: {str(e)}")
             raise Exception(f"拉取镜像失败: {str(e)}")
     
@@ -63,11 +100,18 @@ class DockerService:
         try:
             logger.info(f"正在拉取并压缩镜像到: {output_gz_path}")
             
-            # 使用 gzip 打开文件进行写入
-            with gzip.open(output_gz_path, 'wb') as f_out:
+            # 使用 gzip 打开文件进行写入；分别统计读取 docker save 输出与压缩写入的耗时
+            raw_bytes = 0
+            compress_seconds = 0.0
+            with tracing.span('docker.save_compress') as span, gzip.open(output_gz_path, 'wb') as f_out:
                 for chunk in image.save(named=True):
+                    raw_bytes += len(chunk)
+                    started = time.perf_counter()
                     f_out.write(chunk)
+                    compress_seconds += time.perf_counter() - started
+                span.set(raw_bytes=raw_bytes, compress_seconds=round(compress_seconds, 3))
             
+            account_file(output_gz_path)
             file_size = os.path.getsize(output_gz_path)
             logger.info(f"镜像保存并压缩成功，大小: {file_size / 1024 / 1024:.2f} MB")
             
@@ -76,46 +120,257 @@ class DockerService:
             logger.error(f"保存压缩镜像失败: {str(e)}")
             raise Exception(f"保存压缩镜像失败: {str(e)}")
 
+    @staticmethod
+    def prewarm_path(registry, image_name, tag):
+        """预热导出文件路径"""
+        safe_name = f"{registry}_{image_name}_{tag}".replace('/', '_').replace(':', '_')
+        return os.path.join(PREWARM_FOLDER, f"{safe_name}.tar.gz")
+    
+    @staticmethod
+    def discard_prewarmed(registry, image_name, tag):
+        """删除已预热的导出文件（tag 被覆盖或删除时调用）"""
+        path = DockerService.prewarm_path(registry, image_name, tag)
+        remove_file(f"{path}.digest")
+        if os.path.exists(path):
+            remove_file(path)
+            logger.info(f"已删除预热文件: {path}")
+            return True
+        return False
+    
+    def remote_digest(self, registry, image_name, tag, username, password):
+        """查询 registry 上 tag 当前指向的 digest（同时校验凭据对该仓库有拉取权限）"""
+        data = self.client.images.get_registry_data(
+            f"{registry}/{image_name}:{tag}",
+            auth_config={'username': username, 'password': password}
+        )
+        return data.id
+    
+    def prewarm_image(self, harbor_url, username, password, image_name, tag='latest'):
+        """预先拉取并导出镜像，首次下载时直接返回该文件"""
+        parsed = urlparse(harbor_url)
+        registry = parsed.netloc or parsed.path
+        try:
+            with scheduler.slot(scheduler.KIND_TRANSFER, registry, scheduler.tenant_of(username, image_name.split('/', 1)[0])):
+                result = self._prewarm(registry, username, password, image_name, tag)
+        except Exception:
+            OPERATIONS.labels('prewarm', 'error').inc()
+            raise
+        OPERATIONS.labels('prewarm', 'success').inc()
+        return result
+    
+    def _prewarm(self, registry, username, password, image_name, tag):
+        """预热流程，返回导出文件路径"""
+        started = time.perf_counter()
+        self.login(registry, username, password)
+        record_phase('prewarm', 'login', started)
+        digest = self.remote_digest(registry, image_name, tag, username, password)
+        final_path = self.prewarm_path(registry, image_name, tag)
+        # 先写临时文件再原子替换，避免下载读到半成品
+        partial_path = f"{final_path}.partial"
+        lease = inflight.acquire(paths=[final_path, partial_path], images=[f"{registry}/{image_name}:{tag}"], operation='prewarm')
+        try:
+            started = time.perf_counter()
+            image = self.pull_image(f"{registry}/{image_name}", tag)
+            record_phase('prewarm', 'pull', started, image.attrs.get('Size'))
+            os.makedirs(PREWARM_FOLDER, exist_ok=True)
+            started = time.perf_counter()
+            self.save_and_compress_image(image, partial_path)
+            record_phase('prewarm', 'save', started, os.path.getsize(partial_path))
+            # 发布顺序：先删除旧文件，再原子替换 digest，最后发布新文件；
+            # 下载只在两者都存在时使用预热文件，不会出现新 digest 配旧文件
+            digest_path = f"{final_path}.digest"
+            remove_file(final_path)
+            with open(f"{digest_path}.partial", 'w') as f:
+                f.write(digest)
+            os.replace(f"{digest_path}.partial", digest_path)
+            account_file(digest_path)
+            os.replace(partial_path, final_path)
+        finally:
+            remove_file(partial_path)
+            remove_file(f"{final_path}.digest.partial")
+            lease.release()
+        logger.info(f"镜像预热完成: {registry}/{image_name}:{tag}")
+        return final_path
+    
+    def _lookup_prewarmed(self, registry, image_name, tag, username, password):
+        """预热文件存在且与 registry 当前 digest 一致时返回下载结果
+
+        查询 digest 需要调用方对仓库有拉取权限，因此也完成了权限校验
+        """
+        started = time.perf_counter()
+        path = self.prewarm_path(registry, image_name, tag)
+        # 先登记引用，避免校验期间被清理任务删除
+        lease = inflight.acquire(paths=[path], operation='download')
+        try:
+            if not os.path.exists(path) or not os.path.exists(f"{path}.digest"):
+                lease.release()
+                return None
+            with open(f"{path}.digest") as f:
+                expected = f.read().strip()
+            if self.remote_digest(registry, image_name, tag, username, password) != expected:
+                logger.info(f"预热文件已过期: {path}")
+                lease.release()
+                return None
+            size = os.path.getsize(path)
+            # 更新 mtime 作为最近使用时间，清理任务按 LRU 淘汰
+            os.utime(path)
+        except Exception as e:
+            logger.warning(f"校验预热文件失败，改为实时导出: {str(e)}")
+            lease.release()
+            return None
+        record_phase('download', 'prewarm_check', started)
+        logger.info(f"命中预热文件: {path}")
+        return {
+            'path': path,
+            'filename': f"{image_name.replace('/', '_')}_{tag}.tar.gz",
+            'size': size,
+            'image': f"{registry}/{image_name}:{tag}",
+            'temp_dir': None,
+            'lease': lease
+        }
+    
+    def _lookup_resumed(self, registry, image_name, tag, username, password):
+        """上次中断（如服务重启）时已打包完成的同一镜像导出文件，digest 未变化时返回下载结果
+
+        文件保留在原临时目录供后续重试继续使用（支持 Range 续传），由清理任务按保留策略删除
+        """
+        state = job_journal.find_export(f"{registry}/{image_name}:{tag}")
+        if state is None:
+            return None
+        started = time.perf_counter()
+        path = state['path']
+        lease = inflight.acquire(paths=[path], operation='download')
+        try:
+            if not os.path.exists(path):
+                lease.release()
+                return None
+            if self.remote_digest(registry, image_name, tag, username, password) != state['digest']:
+                logger.info(f"中断前的导出文件已过期: {path}")
+                lease.release()
+                return None
+            os.utime(path)
+        except Exception as e:
+            logger.warning(f"校验中断前的导出文件失败，改为实时导出: {str(e)}")
+            lease.release()
+            return None
+        record_phase('download', 'resume_check', started)
+        logger.info(f"复用中断前的导出文件: {path}（任务 {state['id']}）")
+        return {
+            'path': path,
+            'filename': os.path.basename(path),
+            'size': state['size'],
+            'image': state['image'],
+            'temp_dir': None,
+            'lease': lease
+        }
+    
+    @staticmethod
+    def _repo_digest(image, repository):
+        """镜像在 repository 中的 manifest digest（取自 RepoDigests），用于判断续传文件是否过期"""
+        for entry in image.attrs.get('RepoDigests') or []:
+            name, _, digest = entry.partition('@')
+            if name == repository:
+                return digest
+        return None
+    
     def download_image(self, harbor_url, username, password, image_name, tag='latest'):
-        """完整的镜像下载流程"""
+        """完整的镜像下载流程
+
+        返回结果中的 lease 需在文件发送完成后释放，temp_dir 不为空时一并删除；
+        job 为任务日志句柄，发送结束后标记完成
+        """
         temp_dir = None
+        lease = None
+        slot = None
+        job = None
         
         try:
             # 解析 registry 地址
             parsed = urlparse(harbor_url)
             registry = parsed.netloc or parsed.path
             
+            # 已由 webhook 预热的镜像直接返回
+            prewarmed = self._lookup_prewarmed(registry, image_name, tag, username, password)
+            if prewarmed:
+                OPERATIONS.labels('download', 'prewarmed').inc()
+                return prewarmed
+            
+            # 服务重启前已打包完成的导出直接返回
+            resumed = self._lookup_resumed(registry, image_name, tag, username, password)
+            if resumed:
+                OPERATIONS.labels('download', 'resumed').inc()
+                return resumed
+            
+            # 按 registry 主机限制同时进行的拉取 / 导出，文件发送阶段不占用槽位
+            slot = scheduler.slot(scheduler.KIND_TRANSFER, registry, scheduler.tenant_of(username, image_name.split('/', 1)[0]))
+            
+            job = job_journal.start(
+                job_journal.KIND_DOWNLOAD,
+                image=f"{registry}/{image_name}:{tag}",
+                image_name=image_name,
+                tag=tag,
+                registry=registry,
+                harbor_url=harbor_url,
+                operator=username
+            )
+            
             # 登录
+            started = time.perf_counter()
             self.login(registry, username, password)
+            record_phase('download', 'login', started)
             
             # 构建完整镜像名
             full_image_name = f"{registry}/{image_name}"
             
+            # 导出完成前镜像与临时目录都不能被清理任务删除，下载响应发送完毕后由调用方释放
+            lease = inflight.acquire(images=[f"{full_image_name}:{tag}"], operation='download')
+            
             # 拉取镜像
+            started = time.perf_counter()
             image = self.pull_image(full_image_name, tag)
+            record_phase('download', 'pull', started, image.attrs.get('Size'))
+            job.phase('pulled', digest=self._repo_digest(image, full_image_name))
             
             # 创建临时目录
             temp_dir = tempfile.mkdtemp(dir=Config.DOWNLOAD_FOLDER)
+            lease.add_path(temp_dir)
             
             # 生成文件名
             safe_name = f"{image_name.replace('/', '_')}_{tag}"
             gz_path = os.path.join(temp_dir, f"{safe_name}.tar.gz")
+            job.phase('saving', temp_dir=temp_dir, path=gz_path)
             
             # 保存并压缩镜像
+            started = time.perf_counter()
             final_path = self.save_and_compress_image(image, gz_path)
+            size = os.path.getsize(final_path)
+            record_phase('download', 'save', started, size)
+            job.phase('saved', size=size)
+            OPERATIONS.labels('download', 'success').inc()
             
             return {
                 'path': final_path,
                 'filename': os.path.basename(final_path),
-                'size': os.path.getsize(final_path),
-                'image': f"{full_image_name}:{tag}"
+                'size': size,
+                'image': f"{full_image_name}:{tag}",
+                'temp_dir': temp_dir,
+                'lease': lease,
+                'job': job
             }
             
         except Exception as e:
+            OPERATIONS.labels('download', 'error').inc()
+            if job is not None:
+                job.failed(e)
             # 清理临时文件
             if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
+                remove_tree(temp_dir)
+            if lease is not None:
+                lease.release()
             raise e
+        finally:
+            if slot is not None:
+                slot.release()
     
     def get_local_images(self):
         """获取本地镜像列表"""
@@ -141,21 +396,30 @@ class DockerService:
             logger.error(f"删除镜像失败: {str(e)}")
             raise Exception(f"删除镜像失败: {str(e)}")
     
-    def upload_image(self, harbor_url, username, password, target_project, tar_file_path):
-        """上传镜像到 Harbor"""
+    def upload_image(self, harbor_url, username, password, target_project, tar_file_path, job=None, skip=()):
+        """上传镜像到 Harbor
+
+        job 为任务日志句柄，每推送完一个镜像记录一次；skip 为已推送的目标标签（续传时跳过）
+        """
         temp_dir = None
+        slot = None
         
         try:
             parsed = urlparse(harbor_url)
             registry = parsed.netloc or parsed.path
             
+            slot = scheduler.slot(scheduler.KIND_TRANSFER, registry, scheduler.tenant_of(username, target_project))
             logger.info(f"开始上传镜像: {tar_file_path} 到 {registry}/{target_project}")
             
+            started = time.perf_counter()
             self.login(registry, username, password)
+            record_phase('upload', 'login', started)
             
             logger.info(f"正在加载镜像文件: {tar_file_path}")
+            started = time.perf_counter()
             with open(tar_file_path, 'rb') as f:
                 images = self.client.images.load(f)
+            record_phase('upload', 'load', started, os.path.getsize(tar_file_path))
             
             if not images:
                 raise Exception("无法从文件中加载镜像，请检查文件格式")
@@ -180,11 +444,22 @@ class DockerService:
                     raise Exception("无法解析镜像名称，请检查镜像文件")
                 
                 new_tag = f"{registry}/{target_project}/{image_name}:{tag}"
+                if new_tag in skip:
+                    logger.info(f"中断前已推送，跳过: {new_tag}")
+                    uploaded_images.append({
+                        'original': original_tag,
+                        'uploaded': new_tag,
+                        'image_name': image_name,
+                        'tag': tag,
+                        'already_exists': True
+                    })
+                    continue
                 logger.info(f"重新标记镜像: {original_tag} -> {new_tag}")
                 
                 image.tag(new_tag)
                 
                 logger.info(f"开始推送镜像: {new_tag}")
+                started = time.perf_counter()
                 push_result = self.client.images.push(new_tag, stream=True, decode=True)
                 
                 image_already_exists = False
@@ -215,12 +490,15 @@ class DockerService:
                         if 'Layer already exists' in status_msg or 'Mounted from' in status_msg:
                             image_already_exists = True
                         try:
-                            logger.info(f"推送进度: {status_msg}")
+                            logger.info(f"推送进度: {status_msg}", extra=SAMPLED)
                         except UnicodeEncodeError:
-                            logger.info(f"推送进度: [编码错误]")
+                            logger.info(f"推送进度: [编码错误]", extra=SAMPLED)
                 
                 if push_error and not image_already_exists:
                     raise Exception(f"推送镜像失败: {push_error}")
+                record_phase('upload', 'push', started, image.attrs.get('Size'))
+                if job is not None:
+                    job.pushed(new_tag)
                 
                 if image_already_exists:
                     logger.info(f"镜像已存在或部分层已存在: {new_tag}")
@@ -240,6 +518,7 @@ class DockerService:
                 except Exception as e:
                     logger.warning(f"清理本地镜像失败: {str(e)}")
             
+            OPERATIONS.labels('upload', 'success').inc()
             return {
                 'success': True,
                 'uploaded_images': uploaded_images,
@@ -248,8 +527,23 @@ class DockerService:
             }
             
         except Exception as e:
+            OPERATIONS.labels('upload', 'error').inc()
             logger.error(f"上传镜像失败: {str(e)}")
             raise e
         finally:
+            if slot is not None:
+                slot.release()
             if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
\ No newline at end of file
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+# 全局 Docker 服务实例
+_docker_service = None
+_docker_service_lock = threading.Lock()
+
+def get_docker_service():
+    """获取共享的 Docker 服务实例"""
+    global _docker_service
+    with _docker_service_lock:
+        if _docker_service is None:
+            _docker_service = DockerService()
+        return _docker_service
@@ -1,10 +1,19 @@
+import threading
+import time
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from urllib.parse import urlparse, quote
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, quote, parse_qs
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from config import Config
-from utils.auth import get_auth_header
+from utils.auth import get_auth_header, credential_fingerprint
+from utils.cache import TTLCache
+from services.registry_auth import token_manager, repository_scope
+from services.host_health import get_host_health, call_hedged, CircuitOpenError
+from services import scheduler
+from services.models import Project, Repository, Artifact
+from utils import metrics, tracing
 from utils.logger import setup_logger
 
 # 禁用 SSL 警告
@@ -12,36 +21,152 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logger = setup_logger('harbor_service')
 
+# 可推送镜像的项目角色：1 项目管理员，2 开发者，4 维护人员（3 访客、5 受限访客只读）
+PUSH_ROLES = (1, 2, 4)
+
+# 上传权限检查结果缓存，键为 (Harbor 地址, 凭据指纹, 项目名)
+_permission_cache = TTLCache(ttl=Config.PERMISSION_CACHE_TTL)
+
+HARBOR_REQUEST_SECONDS = metrics.histogram(
+    'harbor_export_harbor_request_seconds', 'Harbor API 请求耗时（秒）', ('host', 'endpoint', 'method')
+)
+HARBOR_REQUEST_ERRORS = metrics.counter(
+    'harbor_export_harbor_request_errors_total', 'Harbor API 请求失败次数', ('host', 'endpoint', 'reason')
+)
+
+# 这些集合名之后的一段路径是资源标识，统计时替换为占位符，避免标签基数随项目 / 仓库数增长
+_ID_SEGMENTS = frozenset(('projects', 'repositories', 'artifacts'))
+
+
+def endpoint_template(endpoint):
+    """/projects/library/repositories/nginx/artifacts -> /projects/{id}/repositories/{id}/artifacts"""
+    parts = endpoint.split('?', 1)[0].strip('/').split('/')
+    for i in range(1, len(parts)):
+        if parts[i - 1] in _ID_SEGMENTS:
+            parts[i] = '{id}'
+    return '/' + '/'.join(parts)
+
+
+MANIFEST_ACCEPT = ', '.join([
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v2+json'
+])
+
 class HarborService:
     """Harbor 服务类"""
     
     def __init__(self, harbor_url, username, password):
-        # 允许传入不带协议的地址，默认 https
-        url = (harbor_url or '').strip()
-        if not url.startswith('http://') and not url.startswith('https://'):
-            url = 'https://' + url
-        self.harbor_url = url.rstrip('/')
+        self.harbor_url = self.normalize_url(harbor_url)
         self.username = username
         self.password = password
         self.headers = get_auth_header(username, password)
         self.api_base = f"{self.harbor_url}/api/{Config.HARBOR_API_VERSION}"
-        self.session = requests.Session()
-        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "POST"])
-        adapter = HTTPAdapter(max_retries=retry)
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
+        self.health = get_host_health(urlparse(self.harbor_url).netloc)
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+    
+    @staticmethod
+    def _new_session(retries):
+        session = requests.Session()
+        # 429 不重试，由调度器暂停派发
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], allowed_methods=["GET", "POST"])
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=Config.HARBOR_BULK_WORKERS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    def _session(self, hedge=False):
+        """按主机当前健康状态选择会话：近期出现失败时使用不重试的会话，由熔断器快速失败
+
+        重试次数在每个请求发出时计算；对冲请求使用独立的会话，不与主请求并发共用同一个 Session
+        """
+        key = (self.health.retry_total(), hedge)
+        with self._sessions_lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self._new_session(key[0])
+            return session
+    
+    @staticmethod
+    def normalize_url(harbor_url):
+        """规范化 Harbor 地址：允许传入不带协议的地址，默认 https"""
+        url = (harbor_url or '').strip()
+        if not url.startswith('http://') and not url.startswith('https://'):
+            url = 'https://' + url
+        return url.rstrip('/')
+    
+    def _guarded(self, method, send, endpoint):
+        """按主机并发上限排队后经过熔断器执行请求，记录延迟与失败；慢于 p95 的 GET 可对冲重发
+
+        endpoint 为去掉资源标识后的路径模板，用作监控指标标签
+        """
+        host = self.health.host
+        try:
+            slot = scheduler.slot(scheduler.KIND_API, host, scheduler.tenant_of(self.username))
+        except scheduler.QueueTimeoutError:
+            HARBOR_REQUEST_ERRORS.labels(host, endpoint, 'queue_timeout').inc()
+            raise
+        with slot:
+            return self._send_guarded(method, send, endpoint)
+    
+    def _send_guarded(self, method, send, endpoint):
+        host = self.health.host
+        if not self.health.allow_request():
+            HARBOR_REQUEST_ERRORS.labels(host, endpoint, 'circuit_open').inc()
+            raise CircuitOpenError(f"Harbor {self.health.host} 暂时不可用（熔断中），请稍后重试")
+        started = time.monotonic()
+        try:
+            delay = self.health.hedge_delay() if method.upper() == 'GET' else None
+            with tracing.span('harbor.request', host=host, endpoint=endpoint, method=method.upper()):
+                if delay:
+                    response = call_hedged(lambda: send(self._session()), delay, lambda: send(self._session(hedge=True)))
+                else:
+                    response = send(self._session())
+        except requests.exceptions.HTTPError as e:
+            elapsed = time.monotonic() - started
+            status = e.response.status_code if e.response is not None else 0
+            HARBOR_REQUEST_SECONDS.labels(host, endpoint, method.upper()).observe(elapsed)
+            HARBOR_REQUEST_ERRORS.labels(host, endpoint, str(status)).inc()
+            if status == 429:
+                # 被限流时不重试，暂停向该主机派发新的 API 请求
+                scheduler.throttled(host, e.response)
+            # 4xx 说明主机可用，只有 5xx 计入失败
+            if e.response is not None and e.response.status_code < 500:
+                self.health.record_success(elapsed)
+            else:
+                self.health.record_failure()
+            raise
+        except Exception:
+            HARBOR_REQUEST_ERRORS.labels(host, endpoint, 'network').inc()
+            self.health.record_failure()
+            raise
+        elapsed = time.monotonic() - started
+        HARBOR_REQUEST_SECONDS.labels(host, endpoint, method.upper()).observe(elapsed)
+        self.health.record_success(elapsed)
+        return response
     
     def _request(self, method, endpoint, **kwargs):
         """统一请求方法"""
         url = f"{self.api_base}/{endpoint.lstrip('/')}"
-        kwargs.setdefault('headers', {}).update(self.headers)
+        headers = kwargs.setdefault('headers', {})
+        headers.update(self.headers)
+        request_id = tracing.current_request_id()
+        if request_id:
+            # Harbor 会在自身日志中记录该请求 ID，便于两侧对照
+            headers[tracing.REQUEST_ID_HEADER] = request_id
         kwargs.setdefault('verify', False)
-        kwargs.setdefault('timeout', Config.HARBOR_REQUEST_TIMEOUT)
+        kwargs.setdefault('timeout', self.health.timeout())
+        
+        def send(session):
+            response = session.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
         
         try:
             logger.info(f"{method.upper()} {url}")
-            response = self.session.request(method, url, **kwargs)
-            response.raise_for_status()
+            response = self._guarded(method, send, endpoint_template(endpoint))
             return response.json() if response.content else None
         except requests.exceptions.HTTPError as e:
             logger.error(f"HTTP Error: {e.response.status_code} - {e.response.text}")
@@ -64,14 +189,7 @@ class HarborService:
         params = {'page': page, 'page_size': page_size}
         projects = self._request('GET', '/projects', params=params)
         
-        return [{
-            'project_id': p.get('project_id'),
-            'name': p.get('name'),
-            'public': p.get('metadata', {}).get('public') == 'true',
-            'repo_count': p.get('repo_count', 0),
-            'created': p.get('creation_time'),
-            'updated': p.get('update_time')
-        } for p in projects]
+        return [Project.from_harbor(p) for p in projects]
     
     def get_project_detail(self, project_name):
         """获取项目详情"""
@@ -89,10 +207,12 @@ class HarborService:
             'updated': project.get('update_time')
         }
     
-    def get_repositories(self, project_name, page=1, page_size=100):
-        """获取仓库列表"""
+    def get_repositories(self, project_name, page=1, page_size=100, sort=None):
+        """获取仓库列表，sort 透传 Harbor 排序参数（如 -update_time）"""
         from urllib.parse import quote
         params = {'page': page, 'page_size': page_size}
+        if sort:
+            params['sort'] = sort
         encoded_project = quote(project_name, safe='')
         try:
             repos = self._request('GET', f'/projects/{encoded_project}/repositories', params=params)
@@ -104,18 +224,12 @@ class HarborService:
                 repos = self._request('GET', f'/projects/{pid}/repositories', params=params)
             else:
                 raise
-        return [{
-            'id': r.get('id'),
-            'name': r.get('name'),
-            'project_name': project_name,
-            'artifact_count': r.get('artifact_count', 0),
-            'pull_count': r.get('pull_count', 0),
-            'created': r.get('creation_time'),
-            'updated': r.get('update_time')
-        } for r in repos]
+        return [Repository.from_harbor(r, project_name) for r in repos]
     
-    def get_artifacts(self, project_name, repo_name, page=1, page_size=100):
+    def get_artifacts(self, project_name, repo_name, page=1, page_size=100, sort=None):
         params = {'page': page, 'page_size': page_size, 'with_tag': 'true'}
+        if sort:
+            params['sort'] = sort
         encoded_project = quote(project_name, safe='')
         encoded_repo = quote(repo_name, safe='/')
         # 1) 优先使用项目名 + 完整仓库路径
@@ -163,18 +277,7 @@ class HarborService:
                 except Exception:
                     artifacts = []
 
-        result = []
-        for artifact in artifacts:
-            tags = [tag['name'] for tag in artifact.get('tags', [])] or ['<none>']
-            result.append({
-                'digest': artifact.get('digest'),
-                'tags': tags,
-                'size': artifact.get('size', 0),
-                'push_time': artifact.get('push_time'),
-                'pull_time': artifact.get('pull_time')
-            })
-        
-        return result
+        return [Artifact.from_harbor(a) for a in artifacts]
 
     def get_all_artifacts(self, project_name, repo_name, page_size=100):
         """分页获取所有 artifacts 并聚合标签"""
@@ -190,6 +293,43 @@ class HarborService:
             page += 1
         return all_items
     
+    @staticmethod
+    def strip_project_prefix(repo_name):
+        """去掉仓库路径中的项目名前缀，如 library/nginx -> nginx"""
+        parts = repo_name.split('/')
+        return '/'.join(parts[1:]) if len(parts) > 1 else parts[0]
+    
+    def resolve_tags(self, project_name, repo_name):
+        """按 Registry -> Artifact API 的顺序回退获取标签
+
+        返回 (tags, artifacts_count, errors)，errors 记录每个失败来源的错误信息
+        """
+        repo_path = self.strip_project_prefix(repo_name)
+        errors = []
+        tags = []
+        for candidate in (repo_name, repo_path):
+            try:
+                tags = self.get_registry_tags(candidate)
+            except Exception as e:
+                errors.append(str(e))
+                tags = []
+            if tags:
+                return tags, 0, errors
+        
+        artifacts_count = 0
+        for candidate in (repo_name, repo_path):
+            try:
+                artifacts = self.get_all_artifacts(project_name, candidate)
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            artifacts_count = max(artifacts_count, len(artifacts))
+            for a in artifacts:
+                tags.extend(a.get('tags', []))
+            if tags:
+                break
+        return list(set(tags)), artifacts_count, errors
+    
     def search_repositories(self, query, page=1, page_size=50):
         """搜索仓库"""
         params = {'q': query, 'page': page, 'page_size': page_size}
@@ -217,16 +357,27 @@ class HarborService:
             'project_creation_restriction': info.get('project_creation_restriction')
         }
     
-    def get_registry_tags(self, repo_name):
-        """直接通过 Registry v2 接口获取 tags 列表，作为 API 失败时的回退"""
-        url = f"{self.harbor_url}/v2/{repo_name}/tags/list"
-        try:
-            logger.info(f"GET {url}")
-            resp = self.session.get(url, headers=self.headers, verify=False, timeout=Config.HARBOR_REQUEST_TIMEOUT)
+    def _registry_request(self, method, repo_name, path, action='pull', **kwargs):
+        """Registry v2 请求统一入口，使用缓存的 Bearer token 代替每次 Basic 认证"""
+        url = f"{self.harbor_url}/v2/{repo_name}/{path.lstrip('/')}"
+        kwargs.setdefault('timeout', self.health.timeout())
+        request_id = tracing.current_request_id()
+        if request_id:
+            kwargs.setdefault('headers', {})[tracing.REQUEST_ID_HEADER] = request_id
+        
+        def send(session):
+            resp = token_manager.request(
+                session, method, url,
+                self.username, self.password,
+                repository_scope(repo_name, action),
+                **kwargs
+            )
             resp.raise_for_status()
-            data = resp.json() or {}
-            tags = data.get('tags') or []
-            return tags
+            return resp
+        
+        try:
+            logger.info(f"{method.upper()} {url}")
+            return self._guarded(method, send, f"/v2/{{repository}}/{path.lstrip('/').split('/', 1)[0]}")
         except requests.exceptions.HTTPError as e:
             logger.error(f"Registry HTTP Error: {e.response.status_code} - {e.response.text}")
             raise Exception(f"Harbor Registry 错误: {e.response.status_code}")
@@ -234,6 +385,46 @@ class HarborService:
             logger.error(f"Registry Request Error: {str(e)}")
             raise Exception(f"网络请求失败: {str(e)}")
     
+    def get_registry_tags_page(self, repo_name, page_size=None, last=None):
+        """获取一页 tags，返回 (tags, 下一页的 last 游标)；没有下一页时游标为 None"""
+        params = {}
+        if page_size:
+            params['n'] = page_size
+        if last:
+            params['last'] = last
+        resp = self._registry_request('GET', repo_name, 'tags/list', params=params)
+        data = resp.json() or {}
+        tags = data.get('tags') or []
+        next_link = resp.links.get('next', {}).get('url')
+        next_last = None
+        if next_link:
+            # Link: </v2/<repo>/tags/list?n=100&last=v1.2>; rel="next"
+            query = parse_qs(urlparse(next_link).query)
+            next_last = (query.get('last') or [None])[0]
+        elif page_size and len(tags) >= page_size:
+            # 部分 registry 不返回 Link 头，按页满判断是否还有下一页
+            next_last = tags[-1]
+        return tags, next_last
+    
+    def iter_registry_tags(self, repo_name, page_size=None, last=None):
+        """跟随 Link 头逐页产出 tags，内存占用与单页大小成正比；last 为起始游标"""
+        page_size = page_size or Config.REGISTRY_TAGS_PAGE_SIZE
+        while True:
+            tags, next_last = self.get_registry_tags_page(repo_name, page_size, last)
+            yield from tags
+            if not next_last or next_last == last or not tags:
+                break
+            last = next_last
+    
+    def get_registry_tags(self, repo_name):
+        """直接通过 Registry v2 接口获取 tags 列表，作为 API 失败时的回退"""
+        return list(self.iter_registry_tags(repo_name))
+    
+    def get_manifest(self, repo_name, reference):
+        """通过 Registry v2 接口获取 manifest（兼容 OCI 与 Docker v2 格式）"""
+        resp = self._registry_request('GET', repo_name, f'manifests/{reference}', headers={'Accept': MANIFEST_ACCEPT})
+        return resp.json()
+    
     def get_statistics(self):
         """获取统计信息"""
         stats = self._request('GET', '/statistics')
@@ -245,69 +436,118 @@ class HarborService:
             'total_storage_consumption': stats.get('total_storage_consumption', 0)
         }
     
+    def get_current_user(self):
+        """获取当前登录用户信息"""
+        return self._request('GET', '/users/current') or {}
+    
+    def get_project_members(self, project_ref, page_size=100):
+        """分页获取项目全部成员，返回 {(entity_type, entity_name): role_id}
+
+        entity_type 为 u（用户）或 g（用户组），同名的用户与用户组分别记录
+        """
+        members = {}
+        page = 1
+        while True:
+            items = self._request('GET', f'/projects/{project_ref}/members', params={'page': page, 'page_size': page_size}) or []
+            for member in items:
+                members[(member.get('entity_type'), member.get('entity_name'))] = member.get('role_id')
+            if len(items) < page_size:
+                break
+            page += 1
+        return members
+    
+    def get_project_permissions(self, project_id):
+        """通过 /users/current/permissions 获取当前用户在项目内的权限列表"""
+        params = {'scope': f'/project/{project_id}', 'relative': 'true'}
+        return self._request('GET', '/users/current/permissions', params=params) or []
+    
     def check_upload_permission(self, project_name):
-        """检查用户是否有上传镜像的权限"""
+        """检查用户是否有上传镜像的权限（结果按 Harbor/用户/项目短时缓存）"""
+        cache_key = (self.harbor_url, credential_fingerprint(self.username, self.password), project_name)
+        cached = _permission_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
         try:
-            encoded_project = quote(project_name, safe='')
-            project = self._request('GET', f'/projects/{encoded_project}')
-            
-            current_user_url = f"{self.api_base}/users/current"
+            result = self._check_upload_permission(project_name)
+        except Exception as e:
+            logger.error(f"检查上传权限失败: {str(e)}")
+            raise Exception(f"检查上传权限失败: {str(e)}")
+        _permission_cache.set(cache_key, result)
+        return dict(result)
+    
+    def _check_upload_permission(self, project_name):
+        encoded_project = quote(project_name, safe='')
+        # 项目详情与当前用户互不依赖，并发获取
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            project_future = pool.submit(tracing.propagate(self._request), 'GET', f'/projects/{encoded_project}')
+            user_future = pool.submit(tracing.propagate(self.get_current_user))
+            project = project_future.result()
             try:
-                response = self.session.get(
-                    current_user_url,
-                    headers=self.headers,
-                    verify=False,
-                    timeout=Config.HARBOR_REQUEST_TIMEOUT
-                )
-                response.raise_for_status()
-                current_user = response.json()
-                username = current_user.get('username')
+                current_user = user_future.result()
             except Exception as e:
                 logger.warning(f"无法获取当前用户信息: {str(e)}")
-                username = self.username
-            
-            members_url = f'/projects/{encoded_project}/members'
-            try:
-                members = self._request('GET', members_url)
-            except Exception as e:
-                if '404' in str(e):
-                    pid = project.get('project_id')
-                    members = self._request('GET', f'/projects/{pid}/members')
-                else:
-                    raise
-            
-            user_role = None
-            for member in members:
-                member_name = member.get('entity_name')
-                if member_name == username:
-                    user_role = member.get('role_id')
-                    break
-            
-            if user_role is None:
-                is_public = project.get('metadata', {}).get('public') == 'true'
-                if not is_public:
-                    return {
-                        'has_permission': False,
-                        'message': f'您不是项目 {project_name} 的成员，无法上传镜像'
-                    }
-                else:
-                    return {
-                        'has_permission': False,
-                        'message': f'您不是项目 {project_name} 的成员，公开项目也需要成员权限才能上传镜像'
-                    }
-            
-            if user_role in [1, 2, 3]:
+                current_user = {}
+        username = current_user.get('username') or self.username
+        pid = project.get('project_id')
+        
+        if current_user.get('sysadmin_flag'):
+            return {
+                'has_permission': True,
+                'message': '您有权限上传镜像到此项目',
+                'source': 'sysadmin'
+            }
+        
+        # 优先使用 Harbor 的权限接口，覆盖用户组成员等按用户名无法匹配的情况
+        try:
+            permissions = self.get_project_permissions(pid)
+        except Exception as e:
+            logger.info(f"权限接口不可用，回退到成员列表判断: {str(e)}")
+            permissions = None
+        if permissions is not None:
+            can_push = any(
+                p.get('resource') == 'repository' and p.get('action') == 'push'
+                for p in permissions
+            )
+            if can_push:
                 return {
                     'has_permission': True,
                     'message': '您有权限上传镜像到此项目',
-                    'role_id': user_role
+                    'source': 'permissions'
                 }
-            else:
-                return {
-                    'has_permission': False,
-                    'message': f'您的角色权限不足，无法上传镜像到项目 {project_name}'
-                }
-                
+            return {
+                'has_permission': False,
+                'message': f'您没有项目 {project_name} 的推送权限，无法上传镜像',
+                'source': 'permissions'
+            }
+        
+        try:
+            members = self.get_project_members(encoded_project)
         except Exception as e:
-            logger.error(f"检查上传权限失败: {str(e)}")
-            raise Exception(f"检查上传权限失败: {str(e)}")
+            if '404' in str(e):
+                members = self.get_project_members(pid)
+            else:
+                raise
+        
+        # 只匹配用户成员；同名用户组不代表当前用户，所属用户组的权限由上面的权限接口覆盖
+        user_role = members.get(('u', username))
+        if user_role is None:
+            is_public = project.get('metadata', {}).get('public') == 'true'
+            if not is_public:
+                message = f'您不是项目 {project_name} 的成员，无法上传镜像'
+            else:
+                message = f'您不是项目 {project_name} 的成员，公开项目也需要成员权限才能上传镜像'
+            return {'has_permission': False, 'message': message, 'source': 'members'}
+        
+        if user_role in PUSH_ROLES:
+            return {
+                'has_permission': True,
+                'message': '您有权限上传镜像到此项目',
+                'role_id': user_role,
+                'source': 'members'
+            }
+        return {
+            'has_permission': False,
+            'message': f'您的角色权限不足，无法上传镜像到项目 {project_name}',
+            'role_id': user_role,
+            'source': 'members'
+        }
@@ -0,0 +1,167 @@
+"""
+健康探测
+后台线程复用长期存在的 Docker 客户端定期 ping，并可选探测配置的 Harbor 地址；
+健康检查接口只读取缓存结果，区分存活（liveness）与就绪（readiness）
+"""
+
+import threading
+import time
+import requests
+from config import Config
+from services import shutdown
+from services.harbor_service import HarborService
+from utils.logger import setup_logger
+
+logger = setup_logger('health_prober')
+
+STATUS_UP = 'up'
+STATUS_DOWN = 'down'
+STATUS_UNKNOWN = 'unknown'
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class CheckResult:
+    """单项探测的最近结果"""
+
+    def __init__(self, name):
+        self.name = name
+        self.status = STATUS_UNKNOWN
+        self.latency_ms = None
+        self.error = None
+        self.checked_at = None
+        self.last_up_at = None
+        self.consecutive_failures = 0
+
+    def record(self, ok, latency, error=None):
+        self.status = STATUS_UP if ok else STATUS_DOWN
+        self.latency_ms = round(latency * 1000, 2)
+        self.error = error
+        self.checked_at = _now()
+        if ok:
+            self.last_up_at = self.checked_at
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+
+    def snapshot(self):
+        return {
+            'status': self.status,
+            'latency_ms': self.latency_ms,
+            'error': self.error,
+            'checked_at': self.checked_at,
+            'last_up_at': self.last_up_at,
+            'consecutive_failures': self.consecutive_failures
+        }
+
+
+class HealthProber:
+    """后台健康探测"""
+
+    def __init__(self, interval, harbor_urls):
+        self.interval = interval
+        self.harbor_urls = [HarborService.normalize_url(u) for u in harbor_urls]
+        self.docker = CheckResult('docker')
+        self.harbor = {url: CheckResult(url) for url in self.harbor_urls}
+        self.rounds = 0
+        self.last_round_at = None
+        self.started_at = time.time()
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _probe_docker(self):
+        from services.docker_service import get_docker_service
+        started = time.monotonic()
+        try:
+            # 直接请求 /_ping 并使用探测超时（客户端默认超时为 DOCKER_TIMEOUT），
+            # 失败原因由探测结果记录，避免每轮写错误日志
+            api = get_docker_service().client.api
+            resp = api._get(api._url('/_ping'), timeout=Config.HEALTH_PROBE_TIMEOUT)
+            ok = resp.status_code == 200
+            self.docker.record(ok, time.monotonic() - started, None if ok else 'ping 失败')
+        except Exception as e:
+            self.docker.record(False, time.monotonic() - started, str(e))
+
+    def _probe_harbor(self, url):
+        """/api/v2.0/ping 无需认证，仅判断可达"""
+        started = time.monotonic()
+        try:
+            resp = self._session.get(
+                f"{url}/api/{Config.HARBOR_API_VERSION}/ping",
+                timeout=Config.HEALTH_PROBE_TIMEOUT,
+                verify=False
+            )
+            ok = resp.status_code < 500
+            self.harbor[url].record(ok, time.monotonic() - started, None if ok else f"HTTP {resp.status_code}")
+        except Exception as e:
+            self.harbor[url].record(False, time.monotonic() - started, str(e))
+
+    def probe(self):
+        """执行一轮探测"""
+        self._probe_docker()
+        for url in self.harbor_urls:
+            self._probe_harbor(url)
+        with self._lock:
+            self.rounds += 1
+            self.last_round_at = time.time()
+        for name, check in [('docker', self.docker)] + list(self.harbor.items()):
+            if check.status == STATUS_DOWN and check.consecutive_failures == 1:
+                logger.warning(f"[health] {name} 不可用: {check.error}")
+
+    def _run(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"[health] 探测失败: {str(e)}")
+            time.sleep(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+        logger.info(f"[health] 后台健康探测已启动，间隔 {self.interval}s")
+        return True
+
+    def is_stale(self):
+        """超过 3 个周期没有完成探测，说明探测线程卡住（如 Docker 无响应）"""
+        last = self.last_round_at or self.started_at
+        return time.time() - last > self.interval * 3 + Config.HEALTH_PROBE_TIMEOUT
+
+    def readiness(self):
+        """就绪条件：Docker 可用；配置 HEALTH_REQUIRE_HARBOR 时所有 Harbor 地址均可达"""
+        reasons = []
+        if shutdown.draining():
+            reasons.append('服务正在停止')
+        if self.rounds == 0:
+            reasons.append('首次探测尚未完成')
+        elif self.is_stale():
+            reasons.append('健康探测超时')
+        if self.docker.status != STATUS_UP:
+            reasons.append('Docker 不可用')
+        if Config.HEALTH_REQUIRE_HARBOR:
+            reasons.extend(f"Harbor 不可达: {url}" for url, c in self.harbor.items() if c.status != STATUS_UP)
+        return not reasons, reasons
+
+    def snapshot(self):
+        ready, reasons = self.readiness()
+        return {
+            'status': 'healthy' if ready else ('starting' if self.rounds == 0 else 'degraded'),
+            'docker': 'connected' if self.docker.status == STATUS_UP else 'disconnected',
+            'ready': ready,
+            'reasons': reasons,
+            'checked_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_round_at)) if self.last_round_at else None,
+            'uptime': round(time.time() - self.started_at, 1),
+            'checks': {
+                'docker': self.docker.snapshot(),
+                'harbor': {url: c.snapshot() for url, c in self.harbor.items()}
+            }
+        }
+
+
+health_prober = HealthProber(Config.HEALTH_PROBE_INTERVAL, Config.HEALTH_HARBOR_URLS)
@@ -0,0 +1,181 @@
+"""
+Harbor 主机健康状态
+按主机共享的熔断器、基于延迟分位数的自适应超时，以及幂等读请求的对冲（hedged）重发
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from config import Config
+from utils import tracing
+from utils.logger import setup_logger
+
+logger = setup_logger('host_health')
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# 至少积累这么多样本后才启用自适应超时和对冲
+MIN_SAMPLES = 20
+WINDOW_SIZE = 200
+# 对冲等待的下限，避免对毫秒级请求也重复发送
+HEDGE_MIN_DELAY = 0.05
+
+
+class CircuitOpenError(Exception):
+    """熔断期间快速失败"""
+
+
+class HostHealth:
+    """单个 Harbor 主机的健康状态"""
+
+    def __init__(self, host):
+        self.host = host
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=WINDOW_SIZE)
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """熔断打开时拒绝请求；冷却结束后只放行一个探测请求"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.time() - self.opened_at >= Config.HARBOR_CIRCUIT_COOLDOWN:
+                self.state = STATE_HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == STATE_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self, latency):
+        with self._lock:
+            self.total_requests += 1
+            self._latencies.append(latency)
+            self.failures = 0
+            if self.state != STATE_CLOSED:
+                logger.info(f"[health] {self.host} 恢复，熔断关闭")
+            self.state = STATE_CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.total_requests += 1
+            self.total_failures += 1
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or self.failures >= Config.HARBOR_CIRCUIT_FAILURE_THRESHOLD:
+                if self.state != STATE_OPEN:
+                    logger.warning(f"[health] {self.host} 连续失败 {self.failures} 次，熔断打开")
+                self.state = STATE_OPEN
+                self.opened_at = time.time()
+                self._probe_in_flight = False
+
+    def percentile(self, q):
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def timeout(self):
+        """按 p99 延迟放大后的超时，上限为 HARBOR_REQUEST_TIMEOUT"""
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return Config.HARBOR_REQUEST_TIMEOUT
+        adaptive = max(Config.HARBOR_MIN_TIMEOUT, p99 * Config.HARBOR_TIMEOUT_FACTOR)
+        return min(Config.HARBOR_REQUEST_TIMEOUT, adaptive)
+
+    def retry_total(self):
+        """健康时允许 3 次重试；近期出现失败时不再重试，避免线程堆积"""
+        return 3 if self.state == STATE_CLOSED and self.failures == 0 else 0
+
+    def hedge_delay(self):
+        """超过 p95 仍未返回时发出对冲请求；样本不足时不对冲"""
+        if not Config.HARBOR_HEDGED_READS or self.state != STATE_CLOSED:
+            return None
+        p95 = self.percentile(0.95)
+        return max(p95, HEDGE_MIN_DELAY) if p95 is not None else None
+
+    def snapshot(self):
+        return {
+            'host': self.host,
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'timeout': self.timeout()
+        }
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+_hedge_pool = None
+
+
+def get_host_health(host):
+    """获取主机共享的健康状态对象"""
+    with _hosts_lock:
+        health = _hosts.get(host)
+        if health is None:
+            health = _hosts[host] = HostHealth(host)
+        return health
+
+
+def all_host_health():
+    with _hosts_lock:
+        hosts = list(_hosts.values())
+    return [h.snapshot() for h in hosts]
+
+
+def _get_hedge_pool():
+    global _hedge_pool
+    with _hosts_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=Config.HARBOR_HEDGE_WORKERS, thread_name_prefix='harbor-hedge')
+        return _hedge_pool
+
+
+def _close_response(future):
+    """关闭落选请求的响应，把连接归还连接池"""
+    if not future.cancelled() and future.exception() is None:
+        try:
+            future.result().close()
+        except Exception:
+            pass
+
+
+def call_hedged(send, delay, backup_send=None):
+    """先发主请求，delay 秒后仍未完成则再发一个（backup_send，默认与主请求相同），返回先成功的结果
+
+    两个请求在线程池中执行，带入当前 trace；落选请求完成后关闭其响应
+    """
+    pool = _get_hedge_pool()
+    primary = pool.submit(tracing.propagate(send))
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    backup = pool.submit(tracing.propagate(backup_send or send))
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            for other in (done | pending) - {future}:
+                other.add_done_callback(_close_response)
+            return result
+    raise error
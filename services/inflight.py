@@ -0,0 +1,233 @@
+"""
+进行中操作登记
+导出、上传、预热过程中使用的文件与镜像在此登记，清理任务跳过被引用的条目；
+同时记录本服务拉取过的镜像及最近使用时间，供清理任务按 LRU 淘汰；
+按操作类型统计进行中的数量，作为监控指标
+
+多进程部署时，每个引用同时对 RUN_DIR 下的锁文件加共享锁（flock），其他进程中的清理任务
+通过尝试加排他锁判断是否被占用；进程退出时锁由内核自动释放。镜像锁文件的 mtime 记录最近使用时间
+"""
+
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+from config import Config
+from utils import metrics
+
+LOCK_DIR = os.path.join(Config.RUN_DIR, 'inflight')
+
+_lock = threading.Lock()
+_paths = Counter()
+_images = Counter()
+_operations = Counter()
+
+
+def _lock_file(kind, key):
+    return os.path.join(LOCK_DIR, kind, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def _hold(kind, key):
+    """对锁文件加共享锁并返回文件描述符；锁文件在加锁前被清理任务删除时重新创建"""
+    path = _lock_file(kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+    if kind == 'images':
+        os.pwrite(fd, key.encode('utf-8'), 0)
+        os.ftruncate(fd, len(key.encode('utf-8')))
+        os.utime(path)
+    return fd
+
+
+def _held_elsewhere(kind, key):
+    """锁文件被任一进程（包括本进程）持有共享锁时返回 True"""
+    try:
+        fd = os.open(_lock_file(kind, key), os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return False
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+
+
+class Lease:
+    """一次操作对文件 / 镜像的引用，release 可重复调用"""
+
+    def __init__(self, operation=None):
+        self.paths = []
+        self.images = []
+        self.operation = operation
+        self._fds = []
+        self._released = False
+        if operation:
+            with _lock:
+                _operations[operation] += 1
+
+    def add_path(self, path):
+        path = os.path.abspath(path)
+        self._fds.append(_hold('paths', path))
+        with _lock:
+            _paths[path] += 1
+        self.paths.append(path)
+        return self
+
+    def add_image(self, ref):
+        self._fds.append(_hold('images', ref))
+        with _lock:
+            _images[ref] += 1
+        self.images.append(ref)
+        return self
+
+    def release(self):
+        with _lock:
+            if self._released:
+                return
+            self._released = True
+            if self.operation:
+                _operations[self.operation] -= 1
+            for path in self.paths:
+                _paths[path] -= 1
+                if _paths[path] <= 0:
+                    del _paths[path]
+            for ref in self.images:
+                _images[ref] -= 1
+                if _images[ref] <= 0:
+                    del _images[ref]
+        for ref in self.images:
+            # 释放时更新最近使用时间
+            try:
+                os.utime(_lock_file('images', ref))
+            except OSError:
+                pass
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def acquire(paths=(), images=(), operation=None):
+    """operation 为操作类型（download / upload / prewarm），用于统计进行中的操作数"""
+    lease = Lease(operation)
+    for path in paths:
+        lease.add_path(path)
+    for ref in images:
+        lease.add_image(ref)
+    return lease
+
+
+def is_path_busy(path):
+    """path 本身、其上级目录或其下任一文件被本进程引用，或 path 被其他进程引用时视为占用"""
+    path = os.path.abspath(path)
+    prefix = path + os.sep
+    with _lock:
+        if any(p == path or p.startswith(prefix) or path.startswith(p + os.sep) for p in _paths):
+            return True
+    return _held_elsewhere('paths', path)
+
+
+def is_image_busy(ref):
+    with _lock:
+        if ref in _images:
+            return True
+    return _held_elsewhere('images', ref)
+
+
+def image_usage():
+    """本服务（所有工作进程）使用过的镜像及最近使用时间"""
+    usage = {}
+    folder = os.path.join(LOCK_DIR, 'images')
+    if not os.path.isdir(folder):
+        return usage
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                ref = f.read().strip()
+            if ref:
+                usage[ref] = os.path.getmtime(path)
+        except OSError:
+            continue
+    return usage
+
+
+def forget_image(ref):
+    """删除镜像的使用记录；仍被引用时保留"""
+    path = _lock_file('images', ref)
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.remove(path)
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    finally:
+        os.close(fd)
+
+
+def prune_locks():
+    """删除未被持有的路径锁文件（由清理任务调用）"""
+    folder = os.path.join(LOCK_DIR, 'paths')
+    if not os.path.isdir(folder):
+        return 0
+    removed = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.remove(path)
+            removed += 1
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        finally:
+            os.close(fd)
+    return removed
+
+
+def snapshot():
+    """本进程的引用情况"""
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'paths': sorted(_paths),
+            'images': sorted(_images),
+            'operations': {k: v for k, v in _operations.items() if v}
+        }
+
+
+def _collect_operations():
+    with _lock:
+        return [((op,), count) for op, count in sorted(_operations.items())]
+
+
+def _collect_counts():
+    with _lock:
+        return [(('paths',), len(_paths)), (('images',), len(_images))]
+
+
+metrics.gauge('harbor_export_operations_in_progress', '进行中的导出 / 上传 / 预热操作数', ('operation',), _collect_operations)
+metrics.gauge('harbor_export_inflight_refs', '被进行中操作引用的文件与镜像数', ('kind',), _collect_counts)
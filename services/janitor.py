@@ -0,0 +1,245 @@
+"""
+磁盘清理任务
+按最长保留时间、总容量配额（LRU 淘汰）清理 DOWNLOAD_FOLDER / UPLOAD_FOLDER，
+并清理本服务拉取到 Docker 本地的镜像；进行中操作引用的文件与镜像一律跳过。
+多个工作进程时只有持有 RUN_DIR/janitor.lock 的进程执行定期清理
+"""
+
+import fcntl
+import os
+import threading
+import time
+from config import Config
+from services import inflight, bandwidth, job_journal
+from services.system_monitor import remove_file, remove_tree
+from utils.logger import setup_logger
+
+logger = setup_logger('janitor')
+
+# 预热导出文件及其 digest 附属文件
+PREWARM_DIRNAME = 'prewarm'
+SIDECAR_SUFFIXES = ('.digest',)
+
+
+def _last_used(path):
+    """文件取 mtime；目录取其下最新文件的 mtime（空目录取目录自身 mtime）"""
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    latest = None
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                mtime = os.path.getmtime(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            latest = mtime if latest is None else max(latest, mtime)
+    return latest if latest is not None else os.path.getmtime(path)
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _units(folder):
+    """列出可清理单元：顶层文件 / 目录；预热目录按文件展开，附属文件随主文件一起处理"""
+    units = []
+    if not os.path.isdir(folder):
+        return units
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name == PREWARM_DIRNAME and os.path.isdir(path):
+            for child in os.listdir(path):
+                if child.endswith(SIDECAR_SUFFIXES):
+                    continue
+                units.append(os.path.join(path, child))
+        else:
+            units.append(path)
+    result = []
+    for path in units:
+        try:
+            result.append({'path': path, 'size': _size(path), 'last_used': _last_used(path)})
+        except OSError:
+            continue
+    return result
+
+
+def _remove_unit(path):
+    freed = remove_tree(path) if os.path.isdir(path) else remove_file(path)
+    for suffix in SIDECAR_SUFFIXES:
+        freed += remove_file(path + suffix)
+    return freed
+
+
+class Janitor:
+    """后台定期执行清理"""
+
+    def __init__(self):
+        self.last_run = None
+        self.last_stats = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._leader_fd = None
+
+    def _is_leader(self):
+        """尝试成为执行定期清理的进程；持有锁的进程退出后由其他进程接替"""
+        if self._leader_fd is not None:
+            return True
+        os.makedirs(Config.RUN_DIR, exist_ok=True)
+        fd = os.open(os.path.join(Config.RUN_DIR, 'janitor.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._leader_fd = fd
+        logger.info(f"[janitor] 进程 {os.getpid()} 负责定期清理")
+        return True
+
+    def _clean_files(self, stats, now):
+        units = []
+        for folder in (Config.DOWNLOAD_FOLDER, Config.UPLOAD_FOLDER):
+            units.extend(_units(folder))
+        total = sum(u['size'] for u in units)
+        removed = set()
+        skipped = set()
+
+        def remove(unit, reason):
+            if inflight.is_path_busy(unit['path']):
+                skipped.add(unit['path'])
+                return False
+            try:
+                freed = _remove_unit(unit['path'])
+            except OSError as e:
+                logger.warning(f"[janitor] 删除失败 {unit['path']}: {str(e)}")
+                return False
+            removed.add(unit['path'])
+            stats['files_removed'] += 1
+            stats['bytes_freed'] += freed
+            logger.info(f"[janitor] 已删除 {unit['path']} ({reason}, {freed / 1024 / 1024:.2f} MB)")
+            return True
+
+        if Config.JANITOR_MAX_AGE:
+            for unit in units:
+                if now - unit['last_used'] > Config.JANITOR_MAX_AGE and remove(unit, 'expired'):
+                    total -= unit['size']
+
+        if Config.JANITOR_MAX_BYTES and total > Config.JANITOR_MAX_BYTES:
+            # 超出配额时按最近使用时间由旧到新淘汰
+            for unit in sorted(units, key=lambda u: u['last_used']):
+                if total <= Config.JANITOR_MAX_BYTES:
+                    break
+                if unit['path'] not in removed and remove(unit, 'quota'):
+                    total -= unit['size']
+        stats['skipped_in_flight'] += len(skipped)
+        stats['bytes_in_use'] = total
+
+    def _clean_images(self, stats, now):
+        usage = inflight.image_usage()
+        if not usage or not (Config.JANITOR_IMAGE_MAX_AGE or Config.JANITOR_MAX_IMAGES):
+            return
+        from services.docker_service import get_docker_service
+        client = get_docker_service().client
+        present = []
+        for ref, last_used in usage.items():
+            try:
+                client.images.get(ref)
+            except Exception:
+                # 镜像已不存在（被手动删除或上传流程已清理）
+                inflight.forget_image(ref)
+                continue
+            present.append((last_used, ref))
+        present.sort()
+
+        expired = [ref for last_used, ref in present if Config.JANITOR_IMAGE_MAX_AGE and now - last_used > Config.JANITOR_IMAGE_MAX_AGE]
+        overflow = len(present) - len(expired) - Config.JANITOR_MAX_IMAGES if Config.JANITOR_MAX_IMAGES else 0
+        victims = list(expired)
+        if overflow > 0:
+            victims.extend([ref for _, ref in present if ref not in expired][:overflow])
+
+        for ref in victims:
+            if inflight.is_image_busy(ref):
+                stats['skipped_in_flight'] += 1
+                continue
+            try:
+                # 不强制删除：仍被容器或其他标签引用的镜像由 Docker 拒绝
+                client.images.remove(ref)
+                inflight.forget_image(ref)
+                stats['images_removed'] += 1
+                logger.info(f"[janitor] 已删除本地镜像 {ref}")
+            except Exception as e:
+                logger.warning(f"[janitor] 删除镜像失败 {ref}: {str(e)}")
+
+    def run_once(self):
+        """执行一次清理，返回统计"""
+        with self._lock:
+            started = time.time()
+            stats = {
+                'files_removed': 0,
+                'bytes_freed': 0,
+                'bytes_in_use': 0,
+                'images_removed': 0,
+                'skipped_in_flight': 0
+            }
+            self._clean_files(stats, started)
+            try:
+                self._clean_images(stats, started)
+            except Exception as e:
+                logger.warning(f"[janitor] 清理镜像失败: {str(e)}")
+            inflight.prune_locks()
+            bandwidth.prune_buckets()
+            # 工作进程异常退出（如被 OOM 终止）后遗留的任务
+            try:
+                job_journal.recover(startup=False)
+            except Exception as e:
+                logger.warning(f"[janitor] 恢复中断任务失败: {str(e)}")
+            stats['duration'] = round(time.time() - started, 3)
+            self.last_run = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.last_stats = stats
+            return stats
+
+    def _run(self):
+        while True:
+            time.sleep(Config.JANITOR_INTERVAL)
+            try:
+                if not self._is_leader():
+                    continue
+                self.run_once()
+            except Exception as e:
+                logger.error(f"[janitor] 清理失败: {str(e)}")
+
+    def start(self):
+        if not Config.JANITOR_INTERVAL:
+            return False
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, name='janitor', daemon=True)
+            self._thread.start()
+        logger.info(f"[janitor] 后台清理已启动，间隔 {Config.JANITOR_INTERVAL}s")
+        return True
+
+    def status(self):
+        return {
+            'enabled': bool(Config.JANITOR_INTERVAL),
+            'leader': self._leader_fd is not None,
+            'interval': Config.JANITOR_INTERVAL,
+            'max_age': Config.JANITOR_MAX_AGE,
+            'max_bytes': Config.JANITOR_MAX_BYTES,
+            'image_max_age': Config.JANITOR_IMAGE_MAX_AGE,
+            'max_images': Config.JANITOR_MAX_IMAGES,
+            'last_run': self.last_run,
+            'last_stats': self.last_stats,
+            'in_flight': inflight.snapshot()
+        }
+
+
+janitor = Janitor()
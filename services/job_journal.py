@@ -0,0 +1,351 @@
+"""
+传输任务日志（journal）
+导出与上传任务的各阶段以 JSON Lines 追加写入 JOB_JOURNAL_FILE，每条写入后 fsync，
+进程在任意时刻被终止（包括优雅退出超时后的 SIGKILL）都能从日志恢复任务状态；日志中不记录密码。
+
+服务启动时 recover() 处理上次未完成的任务：已打包完成的导出文件、已完整接收的上传文件保留为
+可续传任务，其余的临时文件删除。客户端再次下载同一镜像（digest 未变化）时直接发送保留的导出文件
+（支持 Range 断点续传）；续传上传跳过已推送的镜像，其余镜像层由 registry 按已存在的层跳过。
+拉取中断的导出重新执行时，已拉取的镜像层由 Docker 本地缓存复用
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from config import Config
+from services.system_monitor import remove_file, remove_tree
+from utils import tracing
+from utils.logger import setup_logger
+
+logger = setup_logger('job_journal')
+
+KIND_DOWNLOAD = 'download'
+KIND_UPLOAD = 'upload'
+
+STATUS_RUNNING = 'running'
+STATUS_RESUMABLE = 'resumable'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_DISCARDED = 'discarded'
+
+# 事件 -> 任务状态；phase 事件只合并字段
+_EVENT_STATUS = {
+    'start': STATUS_RUNNING,
+    'resumed': STATUS_RUNNING,
+    'interrupted': STATUS_RESUMABLE,
+    'done': STATUS_DONE,
+    'failed': STATUS_FAILED,
+    'discarded': STATUS_DISCARDED
+}
+TERMINAL = (STATUS_DONE, STATUS_FAILED, STATUS_DISCARDED)
+
+# 保留的上传文件改名为该前缀，避免与新上传的同名文件冲突
+RESUME_PREFIX = 'resume_'
+
+# 已合并的日志状态：文件只追加，按读取位置增量合并；文件被压缩替换（inode 变化）时重新读取
+_cache_lock = threading.Lock()
+_cache_inode = None
+_cache_offset = 0
+_cache_jobs = {}
+_cache_exports = {}     # 镜像 -> 可续传导出任务 ID 集合
+
+
+class JobConflictError(Exception):
+    """任务不存在或不处于可续传状态"""
+
+
+def _lock_path():
+    return Config.JOB_JOURNAL_FILE + '.lock'
+
+
+class _FileLock:
+    """跨进程的日志写锁"""
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(Config.JOB_JOURNAL_FILE), exist_ok=True)
+        self._fd = os.open(_lock_path(), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
+
+def _append(record, locked=False):
+    """追加一条记录并落盘"""
+    line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+    def write():
+        fd = os.open(Config.JOB_JOURNAL_FILE, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            # 上次写入中途被终止时补齐换行，避免与不完整的行合并
+            os.write(fd, line if not size or os.pread(fd, 1, size - 1) == b'\n' else b'\n' + line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    if locked:
+        write()
+    else:
+        with _FileLock():
+            write()
+
+
+def _fold(records, jobs):
+    """按任务 ID 将事件合并到 jobs（任务状态按记录整体替换，已返回给调用方的状态不会被修改），返回变化的任务 ID"""
+    touched = set()
+    for record in records:
+        job_id = record.get('job')
+        if not job_id:
+            continue
+        touched.add(job_id)
+        event = record.get('event')
+        if event == 'snapshot':
+            jobs[job_id] = dict(record['state'])
+            continue
+        state = dict(jobs.get(job_id) or {'id': job_id, 'pushed': []})
+        for key, value in record.items():
+            if key in ('job', 'event', 'pushed_image'):
+                continue
+            state[key] = value
+        if record.get('pushed_image'):
+            state['pushed'] = state.get('pushed', []) + [record['pushed_image']]
+        if event in _EVENT_STATUS:
+            state['status'] = _EVENT_STATUS[event]
+        if event == 'start':
+            state['started_at'] = record['ts']
+        state['updated_at'] = record['ts']
+        jobs[job_id] = state
+    return touched
+
+
+def _index_exports(touched):
+    """更新按镜像索引的可续传导出（调用方持有 _cache_lock）"""
+    for job_id in touched:
+        state = _cache_jobs.get(job_id) or {}
+        image = state.get('image')
+        if not image or state.get('kind') != KIND_DOWNLOAD:
+            continue
+        ids = _cache_exports.setdefault(image, set())
+        if state.get('status') == STATUS_RESUMABLE:
+            ids.add(job_id)
+        else:
+            ids.discard(job_id)
+            if not ids:
+                del _cache_exports[image]
+
+
+def _refresh():
+    """读取上次位置之后追加的记录（调用方持有 _cache_lock）"""
+    global _cache_inode, _cache_offset, _cache_jobs, _cache_exports
+    try:
+        f = open(Config.JOB_JOURNAL_FILE, 'rb')
+    except FileNotFoundError:
+        _cache_inode, _cache_offset, _cache_jobs, _cache_exports = None, 0, {}, {}
+        return
+    with f:
+        stat = os.fstat(f.fileno())
+        if stat.st_ino != _cache_inode or stat.st_size < _cache_offset:
+            _cache_inode, _cache_offset, _cache_jobs, _cache_exports = stat.st_ino, 0, {}, {}
+        if stat.st_size == _cache_offset:
+            return
+        f.seek(_cache_offset)
+        data = f.read(stat.st_size - _cache_offset)
+    # 只合并完整的行，写入中的最后一行留到下次读取
+    end = data.rfind(b'\n') + 1
+    records = []
+    for line in data[:end].splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # 进程在写入中途被终止时留下的不完整行
+            continue
+    _cache_offset += end
+    _cache_jobs = dict(_cache_jobs)
+    _index_exports(_fold(records, _cache_jobs))
+
+
+def load():
+    """合并后的任务状态 {job_id: state}；只读取新追加的记录"""
+    with _cache_lock:
+        _refresh()
+        return _cache_jobs
+
+
+def get(job_id):
+    return load().get(job_id)
+
+
+class JournalJob:
+    """一个传输任务的日志写入句柄"""
+
+    def __init__(self, job_id, kind):
+        self.id = job_id
+        self.kind = kind
+
+    def _record(self, event, **fields):
+        record = {'ts': round(time.time(), 3), 'job': self.id, 'event': event, 'pid': os.getpid()}
+        record.update(fields)
+        try:
+            _append(record)
+        except OSError as e:
+            # 日志写入失败不影响传输本身，只是无法续传
+            logger.warning(f"[journal] 写入任务日志失败: {str(e)}")
+
+    def phase(self, name, **fields):
+        self._record('phase', phase=name, **fields)
+
+    def pushed(self, image):
+        self._record('phase', phase='pushing', pushed_image=image)
+
+    def done(self):
+        self._record('done')
+
+    def failed(self, error):
+        self._record('failed', error=str(error)[:500])
+
+    def release(self, **fields):
+        """续传失败时退回可续传状态，可再次续传"""
+        self._record('interrupted', **fields)
+
+
+def start(kind, **fields):
+    """登记新任务，fields 为镜像、项目、文件路径等（不得包含密码）"""
+    job = JournalJob(uuid.uuid4().hex, kind)
+    job._record('start', kind=kind, request_id=tracing.current_request_id(), **fields)
+    return job
+
+
+def claim(job_id, kind):
+    """将可续传任务标记为续传中并返回日志句柄；并发续传同一任务时只有一个成功"""
+    with _FileLock():
+        state = load().get(job_id)
+        if state is None or state.get('kind') != kind:
+            raise JobConflictError(f"任务不存在: {job_id}")
+        if state.get('status') != STATUS_RESUMABLE:
+            raise JobConflictError(f"任务当前状态为 {state.get('status')}，无法续传")
+        _append({'ts': round(time.time(), 3), 'job': job_id, 'event': 'resumed', 'pid': os.getpid()}, locked=True)
+    return JournalJob(job_id, kind), dict(state)
+
+
+def _file_intact(path, size):
+    try:
+        return path is not None and size is not None and os.path.getsize(path) == size
+    except OSError:
+        return False
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _interrupt(state):
+    """处理一个中断的任务，返回写入日志的事件"""
+    job_id = state['id']
+    now = round(time.time(), 3)
+    if state.get('kind') == KIND_DOWNLOAD:
+        if state.get('phase') == 'saved' and state.get('digest') and _file_intact(state.get('path'), state.get('size')):
+            return {'ts': now, 'job': job_id, 'event': 'interrupted'}
+        if state.get('temp_dir'):
+            remove_tree(state['temp_dir'])
+        return {'ts': now, 'job': job_id, 'event': 'discarded'}
+    path = state.get('path')
+    if state.get('received') and _file_intact(path, state.get('size')):
+        folder, name = os.path.split(path)
+        if not name.startswith(RESUME_PREFIX):
+            kept = os.path.join(folder, f"{RESUME_PREFIX}{job_id[:12]}_{name}")
+            os.replace(path, kept)
+            path = kept
+        return {'ts': now, 'job': job_id, 'event': 'interrupted', 'path': path}
+    if path:
+        remove_file(path)
+    return {'ts': now, 'job': job_id, 'event': 'discarded'}
+
+
+def recover(startup=True):
+    """处理中断的任务并压缩日志
+
+    startup=True 在服务启动时（工作进程创建前）调用，所有进行中的任务都视为中断；
+    否则（清理任务定期调用）只处理所属进程已退出的任务，如被 OOM 终止的工作进程，
+    日志超过 JOB_JOURNAL_COMPACT_BYTES 时一并压缩
+    """
+    if not os.path.exists(Config.JOB_JOURNAL_FILE):
+        return {'resumable': 0, 'discarded': 0}
+    stats = {'resumable': 0, 'discarded': 0}
+    with _FileLock():
+        jobs = load()
+        changed = False
+        for state in list(jobs.values()):
+            if state.get('status') != STATUS_RUNNING:
+                continue
+            if not startup and _pid_alive(state.get('pid')):
+                continue
+            try:
+                record = _interrupt(state)
+            except OSError as e:
+                logger.warning(f"[journal] 处理中断任务 {state['id']} 失败: {str(e)}")
+                continue
+            _append(record, locked=True)
+            changed = True
+            if record['event'] == 'interrupted':
+                stats['resumable'] += 1
+                logger.info(f"[journal] 任务 {state['id']}（{state.get('kind')}）已中断，可续传")
+            else:
+                stats['discarded'] += 1
+                logger.info(f"[journal] 任务 {state['id']}（{state.get('kind')}）已中断，临时文件已删除")
+        if startup or changed or os.path.getsize(Config.JOB_JOURNAL_FILE) >= Config.JOB_JOURNAL_COMPACT_BYTES:
+            _compact()
+    return stats
+
+
+def _compact():
+    """只保留进行中与可续传（文件仍存在）的任务，每个任务一条快照（调用方持有写锁）"""
+    keep = []
+    for state in load().values():
+        status = state.get('status')
+        if status in TERMINAL:
+            continue
+        if status == STATUS_RESUMABLE and not os.path.exists(state.get('path') or ''):
+            continue
+        keep.append({'ts': state.get('updated_at'), 'job': state['id'], 'event': 'snapshot', 'state': state})
+    partial = Config.JOB_JOURNAL_FILE + '.partial'
+    with open(partial, 'w', encoding='utf-8') as f:
+        for record in keep:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, Config.JOB_JOURNAL_FILE)
+
+
+def find_export(image_ref):
+    """查找同一镜像的可续传导出（文件仍完整）"""
+    with _cache_lock:
+        _refresh()
+        candidates = [_cache_jobs[job_id] for job_id in _cache_exports.get(image_ref, ())]
+    candidates = [s for s in candidates if _file_intact(s.get('path'), s.get('size'))]
+    return max(candidates, key=lambda s: s.get('updated_at', 0), default=None)
+
+
+def resumable_jobs(operator, registry):
+    """指定用户在指定 registry 上可续传与进行中的任务（不含密码等敏感信息）"""
+    fields = ('id', 'kind', 'status', 'image', 'registry', 'project', 'filename', 'size',
+              'phase', 'pushed', 'operator', 'request_id', 'started_at', 'updated_at')
+    jobs = [
+        s for s in load().values()
+        if s.get('status') not in TERMINAL and s.get('operator') == operator and s.get('registry') == registry
+    ]
+    jobs.sort(key=lambda s: s.get('updated_at', 0), reverse=True)
+    return [{k: s.get(k) for k in fields} for s in jobs]
@@ -0,0 +1,113 @@
+"""
+Harbor 列表记录类型
+使用 __slots__ 存储字段，避免每条记录一个 dict；名称、tag、digest 通过 sys.intern 共享同一份字符串
+记录兼容 dict 的只读访问（record['name']、record.get('name')、dict(record)），序列化时才转换为 dict
+"""
+
+import sys
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Record:
+    """只读字段访问与序列化的公共实现"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f'{n}={getattr(self, n)!r}' for n in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class Project(Record):
+    __slots__ = ('project_id', 'name', 'public', 'repo_count', 'created', 'updated')
+
+    def __init__(self, project_id, name, public, repo_count, created, updated):
+        self.project_id = project_id
+        self.name = _intern(name)
+        self.public = public
+        self.repo_count = repo_count
+        self.created = created
+        self.updated = updated
+
+    @classmethod
+    def from_harbor(cls, p):
+        return cls(
+            p.get('project_id'),
+            p.get('name'),
+            p.get('metadata', {}).get('public') == 'true',
+            p.get('repo_count', 0),
+            p.get('creation_time'),
+            p.get('update_time')
+        )
+
+
+class Repository(Record):
+    __slots__ = ('id', 'name', 'project_name', 'artifact_count', 'pull_count', 'created', 'updated')
+
+    def __init__(self, id, name, project_name, artifact_count, pull_count, created, updated):
+        self.id = id
+        self.name = _intern(name)
+        self.project_name = _intern(project_name)
+        self.artifact_count = artifact_count
+        self.pull_count = pull_count
+        self.created = created
+        self.updated = updated
+
+    @classmethod
+    def from_harbor(cls, r, project_name):
+        return cls(
+            r.get('id'),
+            r.get('name'),
+            project_name,
+            r.get('artifact_count', 0),
+            r.get('pull_count', 0),
+            r.get('creation_time'),
+            r.get('update_time')
+        )
+
+
+class Artifact(Record):
+    __slots__ = ('digest', 'tags', 'size', 'push_time', 'pull_time')
+
+    def __init__(self, digest, tags, size, push_time, pull_time):
+        self.digest = _intern(digest)
+        # tag 名在仓库间大量重复（latest、v1 等），以 interned 元组保存
+        self.tags = tuple(_intern(t) for t in tags)
+        self.size = size
+        self.push_time = push_time
+        self.pull_time = pull_time
+
+    @classmethod
+    def from_harbor(cls, a):
+        return cls(
+            a.get('digest'),
+            [tag['name'] for tag in a.get('tags') or []] or ['<none>'],
+            a.get('size', 0),
+            a.get('push_time'),
+            a.get('pull_time')
+        )
@@ -0,0 +1,128 @@
+"""
+Registry v2 Bearer Token 管理
+处理 WWW-Authenticate 质询，按 (registry, 凭据, scope) 缓存 token（过期或超出容量时淘汰），过期前在锁内刷新
+"""
+
+import re
+import threading
+import time
+from urllib.parse import urlparse
+from config import Config
+from utils.auth import get_auth_header, credential_fingerprint
+from utils.cache import TTLCache
+from utils.logger import setup_logger
+
+logger = setup_logger('registry_auth')
+
+_CHALLENGE_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+# token 缓存条目上限（每个仓库 scope 一条）与刷新锁分段数
+TOKEN_CACHE_SIZE = 4096
+LOCK_STRIPES = 64
+
+
+def parse_challenge(header):
+    """解析 WWW-Authenticate 头，返回 {'scheme': ..., 'realm': ..., 'service': ..., 'scope': ...}"""
+    if not header:
+        return None
+    scheme, _, params = header.strip().partition(' ')
+    challenge = {'scheme': scheme.lower()}
+    challenge.update({k.lower(): v for k, v in _CHALLENGE_PARAM.findall(params)})
+    return challenge
+
+
+def repository_scope(repo_name, action='pull'):
+    """构造仓库级 scope，例如 repository:library/nginx:pull"""
+    return f"repository:{repo_name}:{action}"
+
+
+class RegistryTokenManager:
+    """按 registry 主机缓存质询信息和 Bearer token"""
+
+    def __init__(self):
+        self._challenges = {}   # host -> challenge
+        # (host, 凭据指纹, scope) -> token，条目按 token 有效期过期
+        self._tokens = TTLCache(ttl=Config.REGISTRY_TOKEN_MIN_TTL, maxsize=TOKEN_CACHE_SIZE)
+        # 刷新锁按 key 哈希分段，数量固定，不随 scope 增长
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        return self._locks[hash(key) % LOCK_STRIPES]
+
+    def get_token(self, session, host, username, password, scope, stale=None):
+        """获取（必要时刷新）指定 scope 的 token；registry 未要求 Bearer 时返回 None
+
+        stale 为被 registry 拒绝的旧 token，缓存中仍是它时强制刷新
+        """
+        challenge = self._challenges.get(host)
+        if not challenge or challenge.get('scheme') != 'bearer':
+            return None
+        key = (host, credential_fingerprint(username, password), scope)
+
+        cached = self._tokens.get(key)
+        if cached and cached != stale:
+            return cached
+        with self._key_lock(key):
+            # 双重检查：等待锁期间其他线程可能已经刷新
+            cached = self._tokens.get(key)
+            if cached and cached != stale:
+                return cached
+            token, expires_at = self._fetch_token(session, challenge, username, password, scope)
+            self._tokens.set(key, token, ttl=expires_at - time.time())
+            return token
+
+    def _fetch_token(self, session, challenge, username, password, scope):
+        params = {'service': challenge.get('service')}
+        if scope:
+            params['scope'] = scope
+        logger.info(f"GET {challenge['realm']} scope={scope}")
+        resp = session.get(
+            challenge['realm'],
+            params=params,
+            headers=get_auth_header(username, password),
+            verify=False,
+            timeout=Config.HARBOR_REQUEST_TIMEOUT
+        )
+        resp.raise_for_status()
+        data = resp.json() or {}
+        token = data.get('token') or data.get('access_token')
+        if not token:
+            raise Exception("Registry token 服务未返回 token")
+        expires_in = int(data.get('expires_in') or 60)
+        # 提前 REGISTRY_TOKEN_REFRESH_MARGIN 秒视为过期，避免请求途中失效
+        ttl = max(expires_in - Config.REGISTRY_TOKEN_REFRESH_MARGIN, Config.REGISTRY_TOKEN_MIN_TTL)
+        return token, time.time() + ttl
+
+    def request(self, session, method, url, username, password, scope, **kwargs):
+        """发送 v2 请求：优先使用缓存 token，遇到 401 质询时换取 token 后重试一次"""
+        host = urlparse(url).netloc
+        headers = dict(kwargs.pop('headers', None) or {})
+        kwargs.setdefault('verify', False)
+        kwargs.setdefault('timeout', Config.HARBOR_REQUEST_TIMEOUT)
+
+        token = self.get_token(session, host, username, password, scope)
+        challenge = self._challenges.get(host)
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        elif challenge and challenge.get('scheme') == 'basic':
+            headers.update(get_auth_header(username, password))
+        resp = session.request(method, url, headers=headers, **kwargs)
+        if resp.status_code != 401:
+            return resp
+
+        challenge = parse_challenge(resp.headers.get('WWW-Authenticate'))
+        if not challenge:
+            return resp
+        with self._lock:
+            self._challenges[host] = challenge
+        if challenge['scheme'] == 'bearer' and challenge.get('realm'):
+            token = self.get_token(session, host, username, password, scope, stale=token)
+            headers['Authorization'] = f"Bearer {token}"
+        else:
+            headers.update(get_auth_header(username, password))
+        return session.request(method, url, headers=headers, **kwargs)
+
+
+# 进程内共享，跨请求复用 token
+token_manager = RegistryTokenManager()
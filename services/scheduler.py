@@ -0,0 +1,326 @@
+"""
+按 registry 主机限流的公平调度
+镜像传输（pull / push / save）与 Harbor API 调用分别按主机限制并发数；超出上限的请求排队，
+按租户（操作用户或项目）加权公平排队（SCFQ：每个请求的虚拟完成时间 = max(当前虚拟时间,
+该租户上一个请求的完成时间) + 1 / 权重，空出槽位时放行完成时间最小的请求），
+一个租户提交大量任务不会饿死其他租户。Harbor 返回 429 时暂停向该主机派发 API 请求
+
+并发上限按进程生效，多进程部署时总并发为 上限 × 工作进程数
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from config import Config
+from utils import metrics, tracing
+from utils.logger import setup_logger
+
+logger = setup_logger('scheduler')
+
+KIND_TRANSFER = 'transfer'
+KIND_API = 'api'
+
+# 429 未给出 Retry-After 时的暂停时间与上限（秒）
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+
+WAIT_SECONDS = metrics.histogram(
+    'harbor_export_scheduler_wait_seconds', '调度排队等待时间（秒）', ('kind', 'host')
+)
+REJECTED = metrics.counter(
+    'harbor_export_scheduler_timeouts_total', '排队超时被拒绝的请求数', ('kind', 'host')
+)
+THROTTLED = metrics.counter(
+    'harbor_export_scheduler_throttled_total', 'Harbor 返回 429 的次数', ('host',)
+)
+
+
+class QueueTimeoutError(Exception):
+    """排队超时仍未获得执行槽位"""
+
+
+def _parse_weights(spec):
+    """'team-a=2,ci=0.5' -> {'team-a': 2.0, 'ci': 0.5}"""
+    weights = {}
+    for item in spec.split(','):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip():
+            try:
+                weights[name.strip()] = max(float(value), 0.01)
+            except ValueError:
+                logger.warning(f"忽略无效的租户权重: {item}")
+    return weights
+
+
+_weights = _parse_weights(Config.SCHED_TENANT_WEIGHTS)
+
+
+def tenant_of(username, project=None):
+    """按 SCHED_TENANT_BY 取租户：user 为操作用户，project 为镜像所属项目（未知时退回用户）"""
+    if Config.SCHED_TENANT_BY == 'project' and project:
+        return f"project:{project}"
+    return username or 'anonymous'
+
+
+def weight_of(tenant):
+    return _weights.get(tenant, _weights.get(tenant.split(':', 1)[-1], 1.0))
+
+
+class _Ticket:
+    __slots__ = ('tenant', 'finish', 'seq', 'granted', 'cancelled', 'enqueued_at')
+
+    def __init__(self, tenant, finish, seq):
+        self.tenant = tenant
+        self.finish = finish
+        self.seq = seq
+        self.granted = False
+        self.cancelled = False
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+
+class _Slot:
+    """持有中的执行槽位，release 可重复调用"""
+
+    __slots__ = ('pool', 'tenant', '_released')
+
+    def __init__(self, pool, tenant):
+        self.pool = pool
+        self.tenant = tenant
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.pool._release(self.tenant)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class HostPool:
+    """单个主机、单类操作的并发槽位与加权公平队列"""
+
+    def __init__(self, kind, host, limit, timeout):
+        self.kind = kind
+        self.host = host
+        self.limit = limit
+        self.timeout = timeout
+        self.active = 0
+        self.paused_until = 0.0
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._active_by_tenant = Counter()
+        self._queued_by_tenant = Counter()
+        self._served_by_tenant = Counter()
+        self._wait_total = 0.0
+        self._served = 0
+        self._cond = threading.Condition()
+        self._wait_seconds = WAIT_SECONDS.labels(kind, host)
+
+    def _paused(self):
+        return self.kind == KIND_API and time.monotonic() < self.paused_until
+
+    def _grant(self, tenant):
+        self.active += 1
+        self._active_by_tenant[tenant] += 1
+        self._served_by_tenant[tenant] += 1
+
+    def _dispatch(self):
+        """空出槽位时按虚拟完成时间放行排队请求（调用方持有 _cond）"""
+        granted = False
+        while self._heap and self.active < self.limit and not self._paused():
+            ticket = heapq.heappop(self._heap)
+            if ticket.cancelled:
+                continue
+            self._virtual_time = ticket.finish
+            self._queued_by_tenant[ticket.tenant] -= 1
+            if self._queued_by_tenant[ticket.tenant] <= 0:
+                del self._queued_by_tenant[ticket.tenant]
+            ticket.granted = True
+            self._grant(ticket.tenant)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, tenant, timeout=None):
+        """获取执行槽位；排队超过 timeout 秒（默认按操作类型配置，0 为不限）抛出 QueueTimeoutError"""
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            if not self._heap and self.active < self.limit and not self._paused():
+                self._grant(tenant)
+                self._served += 1
+                return _Slot(self, tenant)
+            start = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+            ticket = _Ticket(tenant, start + 1.0 / weight_of(tenant), next(self._seq))
+            self._last_finish[tenant] = ticket.finish
+            self._queued_by_tenant[tenant] += 1
+            heapq.heappush(self._heap, ticket)
+            deadline = ticket.enqueued_at + timeout if timeout else None
+            # 队列中可能只剩已取消的请求，先尝试派发，有空闲槽位时不必等待
+            self._dispatch()
+            while not ticket.granted:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                if self._paused():
+                    pause = self.paused_until - time.monotonic()
+                    remaining = pause if remaining is None else min(remaining, pause)
+                self._cond.wait(remaining)
+                self._dispatch()
+            waited = time.monotonic() - ticket.enqueued_at
+            if not ticket.granted:
+                ticket.cancelled = True
+                # 清理堆顶已取消的请求，空队列时新请求可直接走快速路径
+                while self._heap and self._heap[0].cancelled:
+                    heapq.heappop(self._heap)
+                self._queued_by_tenant[tenant] -= 1
+                if self._queued_by_tenant[tenant] <= 0:
+                    del self._queued_by_tenant[tenant]
+                REJECTED.labels(self.kind, self.host).inc()
+                raise QueueTimeoutError(f"{self.host} 排队超过 {timeout}s，请稍后重试")
+            self._wait_total += waited
+            self._served += 1
+        self._wait_seconds.observe(waited)
+        tracing.record('scheduler.wait', time.perf_counter() - waited, kind=self.kind, host=self.host, tenant=tenant)
+        return _Slot(self, tenant)
+
+    def _release(self, tenant):
+        with self._cond:
+            self.active -= 1
+            self._active_by_tenant[tenant] -= 1
+            if self._active_by_tenant[tenant] <= 0:
+                del self._active_by_tenant[tenant]
+            if not self._heap and not self.active:
+                # 空闲时重置虚拟时间，避免长期运行后数值无限增长
+                self._virtual_time = 0.0
+                self._last_finish.clear()
+            self._dispatch()
+
+    def backoff(self, seconds):
+        """Harbor 限流时暂停派发新的 API 请求，进行中的请求不受影响"""
+        with self._cond:
+            until = time.monotonic() + min(max(seconds, DEFAULT_BACKOFF), MAX_BACKOFF)
+            if until > self.paused_until:
+                self.paused_until = until
+                logger.warning(f"[scheduler] {self.host} 返回 429，暂停派发 API 请求 {until - time.monotonic():.1f}s")
+
+    def snapshot(self):
+        with self._cond:
+            queued = sum(self._queued_by_tenant.values())
+            oldest = min((t.enqueued_at for t in self._heap if not t.cancelled), default=None)
+            return {
+                'kind': self.kind,
+                'host': self.host,
+                'limit': self.limit,
+                'active': self.active,
+                'queued': queued,
+                'oldest_wait': round(time.monotonic() - oldest, 3) if oldest is not None else 0,
+                'avg_wait': round(self._wait_total / self._served, 4) if self._served else 0,
+                'served': self._served,
+                'paused_for': round(max(0.0, self.paused_until - time.monotonic()), 2),
+                'tenants': {
+                    tenant: {
+                        'weight': weight_of(tenant),
+                        'active': self._active_by_tenant.get(tenant, 0),
+                        'queued': self._queued_by_tenant.get(tenant, 0),
+                        'served': self._served_by_tenant.get(tenant, 0)
+                    }
+                    for tenant in set(self._queued_by_tenant) | set(self._active_by_tenant)
+                    | {t for t, _ in self._served_by_tenant.most_common(50)}
+                }
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(kind, host):
+    """获取主机共享的槽位池"""
+    key = (kind, host)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if kind == KIND_TRANSFER:
+                pool = HostPool(kind, host, max(1, Config.SCHED_TRANSFER_PER_HOST), Config.SCHED_TRANSFER_QUEUE_TIMEOUT)
+            else:
+                pool = HostPool(kind, host, max(1, Config.SCHED_API_PER_HOST), Config.SCHED_API_QUEUE_TIMEOUT)
+            _pools[key] = pool
+        return pool
+
+
+def slot(kind, host, tenant):
+    """with slot(KIND_TRANSFER, registry, tenant): ...；未启用调度时为空操作"""
+    if not Config.SCHED_ENABLED:
+        return _NOOP
+    return get_pool(kind, host).acquire(tenant)
+
+
+def retry_after(response):
+    """解析 429 响应的 Retry-After（秒），只支持秒数形式"""
+    try:
+        return float(response.headers.get('Retry-After', DEFAULT_BACKOFF))
+    except (TypeError, ValueError):
+        return DEFAULT_BACKOFF
+
+
+def throttled(host, response):
+    """记录 Harbor 返回的 429 并暂停向该主机派发 API 请求"""
+    THROTTLED.labels(host).inc()
+    if Config.SCHED_ENABLED:
+        get_pool(KIND_API, host).backoff(retry_after(response))
+
+
+def snapshot():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {
+        'enabled': Config.SCHED_ENABLED,
+        'tenant_by': Config.SCHED_TENANT_BY,
+        'pools': [p.snapshot() for p in sorted(pools, key=lambda p: (p.kind, p.host))]
+    }
+
+
+class _NoopSlot:
+    __slots__ = ()
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSlot()
+
+
+def _collect(field):
+    def collect():
+        with _pools_lock:
+            pools = list(_pools.values())
+        rows = []
+        for pool in pools:
+            with pool._cond:
+                value = pool.active if field == 'active' else sum(pool._queued_by_tenant.values())
+            rows.append(((pool.kind, pool.host), value))
+        return rows
+    return collect
+
+
+metrics.gauge('harbor_export_scheduler_active', '占用中的执行槽位数', ('kind', 'host'), _collect('active'))
+metrics.gauge('harbor_export_scheduler_queue_depth', '排队等待的请求数', ('kind', 'host'), _collect('queued'))
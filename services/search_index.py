@@ -0,0 +1,287 @@
+"""
+仓库 / 标签名称的内存搜索索引
+三元组（trigram）倒排 + 前缀有序表，倒排表使用 array 存储以节省内存
+"""
+
+import threading
+from array import array
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from services.catalog_service import get_catalog
+from utils.logger import setup_logger
+
+logger = setup_logger('search_index')
+
+KIND_REPOSITORY = 0
+KIND_TAG = 1
+# 墓碑比例超过该值时重建倒排表
+COMPACT_RATIO = 0.25
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """仓库和标签名称的 trigram / 前缀索引"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # 批量构建时前缀表只追加，结束后统一排序
+        self._bulk = False
+        self._reset()
+
+    def _reset(self):
+        self._kinds = bytearray()
+        self._alive = bytearray()
+        self._names = []          # doc_id -> 小写检索名（仓库全名或 tag）
+        self._repos = []          # doc_id -> 仓库全名
+        self._projects = []       # doc_id -> 项目名
+        self._tags = []           # doc_id -> tag（仓库文档为 None）
+        self._postings = {}       # trigram -> array('I') 有序 doc_id
+        self._prefixes = []       # 有序 (key, doc_id)
+        self._repo_docs = {}      # repo_name -> doc_id
+        self._tag_docs = {}       # repo_name -> {tag: doc_id}
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._names) - self._dead
+
+    def _add_doc(self, kind, name, project_name, repo_name, tag=None):
+        doc_id = len(self._names)
+        key = name.lower()
+        self._kinds.append(kind)
+        self._alive.append(1)
+        self._names.append(key)
+        self._repos.append(repo_name)
+        self._projects.append(project_name)
+        self._tags.append(tag)
+        grams = _trigrams(key)
+        if kind == KIND_REPOSITORY:
+            # 每段路径单独补齐边界，使 "ngix" 也能模糊命中 library/nginx
+            for segment in key.split('/'):
+                grams |= _trigrams(segment)
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('I')
+            # doc_id 单调递增，追加即可保持有序
+            postings.append(doc_id)
+        segments = {key}
+        if kind == KIND_REPOSITORY:
+            segments.update(s for s in key.split('/') if s)
+        for segment in segments:
+            if self._bulk:
+                self._prefixes.append((segment, doc_id))
+            else:
+                insort(self._prefixes, (segment, doc_id))
+        return doc_id
+
+    @contextmanager
+    def bulk(self):
+        """批量添加文档（初次构建），避免逐条有序插入的平方复杂度"""
+        with self.lock:
+            bulk, self._bulk = self._bulk, True
+            try:
+                yield self
+            finally:
+                self._bulk = bulk
+                if not bulk:
+                    self._prefixes.sort()
+
+    def _kill(self, doc_id):
+        if self._alive[doc_id]:
+            self._alive[doc_id] = 0
+            self._dead += 1
+
+    def add_repository(self, project_name, repo_name):
+        """添加或保留仓库文档"""
+        with self.lock:
+            if repo_name in self._repo_docs:
+                return
+            self._repo_docs[repo_name] = self._add_doc(KIND_REPOSITORY, repo_name, project_name, repo_name)
+
+    def set_tags(self, project_name, repo_name, tags):
+        """以增量方式替换仓库的 tag 集合"""
+        with self.lock:
+            self.add_repository(project_name, repo_name)
+            docs = self._tag_docs.setdefault(repo_name, {})
+            wanted = {t for t in tags if t and t != '<none>'}
+            for tag in [t for t in docs if t not in wanted]:
+                self._kill(docs.pop(tag))
+            for tag in wanted:
+                if tag not in docs:
+                    docs[tag] = self._add_doc(KIND_TAG, tag, project_name, repo_name, tag)
+            self._maybe_compact()
+
+    def add_tags(self, project_name, repo_name, tags):
+        """追加单个或多个 tag（webhook 推送事件）"""
+        with self.lock:
+            self.add_repository(project_name, repo_name)
+            docs = self._tag_docs.setdefault(repo_name, {})
+            for tag in tags:
+                if tag and tag != '<none>' and tag not in docs:
+                    docs[tag] = self._add_doc(KIND_TAG, tag, project_name, repo_name, tag)
+
+    def remove_tags(self, repo_name, tags):
+        """移除指定 tag（webhook 删除事件）"""
+        with self.lock:
+            docs = self._tag_docs.get(repo_name, {})
+            for tag in tags:
+                doc_id = docs.pop(tag, None)
+                if doc_id is not None:
+                    self._kill(doc_id)
+            self._maybe_compact()
+
+    def remove_repository(self, repo_name):
+        """删除仓库及其全部 tag"""
+        with self.lock:
+            doc_id = self._repo_docs.pop(repo_name, None)
+            if doc_id is not None:
+                self._kill(doc_id)
+            for tag_doc in self._tag_docs.pop(repo_name, {}).values():
+                self._kill(tag_doc)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._names and self._dead / len(self._names) > COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        """丢弃墓碑文档并重建倒排表"""
+        live = [
+            (self._kinds[i], self._names[i], self._projects[i], self._repos[i], self._tags[i])
+            for i in range(len(self._names)) if self._alive[i]
+        ]
+        self._reset()
+        with self.bulk():
+            for kind, _, project_name, repo_name, tag in live:
+                if kind == KIND_REPOSITORY:
+                    self._repo_docs[repo_name] = self._add_doc(kind, repo_name, project_name, repo_name)
+                else:
+                    self._tag_docs.setdefault(repo_name, {})[tag] = self._add_doc(kind, tag, project_name, repo_name, tag)
+
+    def _accepts(self, doc_id, kind, project_name):
+        if not self._alive[doc_id]:
+            return False
+        if kind is not None and self._kinds[doc_id] != kind:
+            return False
+        return not project_name or self._projects[doc_id] == project_name
+
+    def _prefix_candidates(self, query, limit, kind=None, project_name=None):
+        """前缀命中的文档，在截断前按类型 / 项目过滤"""
+        start = bisect_left(self._prefixes, (query, -1))
+        hits = {}
+        for key, doc_id in self._prefixes[start:]:
+            if not key.startswith(query):
+                break
+            if self._accepts(doc_id, kind, project_name):
+                hits[doc_id] = 0.0
+                if len(hits) >= limit:
+                    break
+        return hits
+
+    def _trigram_candidates(self, query, min_ratio, kind=None, project_name=None):
+        grams = _trigrams(query)
+        need = max(1, int(len(grams) * min_ratio))
+        # 从最稀有的 trigram 开始累计；剩余 trigram 不足以让新文档达标后，
+        # 只对已有候选在倒排表中二分查找，避免扫描高频长倒排表
+        lists = sorted((self._postings.get(g, ()) for g in grams), key=len)
+        counts = {}
+        for i, postings in enumerate(lists):
+            if len(lists) - i >= need:
+                for doc_id in postings:
+                    counts[doc_id] = counts.get(doc_id, 0) + 1
+            else:
+                size = len(postings)
+                for doc_id in counts:
+                    pos = bisect_left(postings, doc_id)
+                    if pos < size and postings[pos] == doc_id:
+                        counts[doc_id] += 1
+        return {
+            doc_id: count / len(grams)
+            for doc_id, count in counts.items()
+            if count >= need and self._accepts(doc_id, kind, project_name)
+        }
+
+    def search(self, query, limit=20, kind=None, project_name=None, min_ratio=0.5):
+        """返回按相关度排序的匹配结果"""
+        q = (query or '').strip().lower()
+        if not q:
+            return []
+        with self.lock:
+            if len(q) < 3:
+                candidates = self._prefix_candidates(q, limit * 20, kind, project_name)
+            else:
+                candidates = self._trigram_candidates(q, min_ratio, kind, project_name)
+                prefixed = self._prefix_candidates(q, limit * 5, kind, project_name)
+                candidates.update({d: candidates.get(d, 0.0) for d in prefixed})
+            results = []
+            for doc_id, score in candidates.items():
+                name = self._names[doc_id]
+                last = name.rsplit('/', 1)[-1]
+                if name == q or last == q:
+                    score += 3
+                elif name.startswith(q) or last.startswith(q):
+                    score += 2
+                elif q in name:
+                    score += 1
+                # 同等相关度下偏向更短的名称
+                score -= len(name) / 1000.0
+                results.append((score, doc_id))
+            results.sort(key=lambda item: (-item[0], self._names[item[1]]))
+            return [self._format(doc_id, score) for score, doc_id in results[:limit]]
+
+    def _format(self, doc_id, score):
+        is_tag = self._kinds[doc_id] == KIND_TAG
+        return {
+            'type': 'tag' if is_tag else 'repository',
+            'name': self._repos[doc_id],
+            'project_name': self._projects[doc_id],
+            'tag': self._tags[doc_id] if is_tag else None,
+            'score': round(score, 3)
+        }
+
+    def on_catalog_change(self, event, project_name, repo_name, payload):
+        """目录同步回调，保持索引增量更新"""
+        if event == 'repository_updated':
+            self.add_repository(project_name, repo_name)
+        elif event == 'repository_removed':
+            self.remove_repository(repo_name)
+        elif event == 'artifacts_updated':
+            self.set_tags(project_name, repo_name, [t for a in payload or [] for t in a.get('tags', [])])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_for_catalog(catalog):
+    """返回目录视图上已构建的索引，未构建时为 None"""
+    with _indexes_lock:
+        return _indexes.get(id(catalog))
+
+
+def get_search_index(harbor_url, username, password):
+    """获取挂接在目录视图上的搜索索引；目录尚未同步时返回 None"""
+    catalog = get_catalog(harbor_url, username, password, create=False)
+    if catalog is None or catalog.last_sync is None:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(id(catalog))
+        if index is not None:
+            return index
+        index = SearchIndex()
+        # 持有目录锁构建，避免与同步回调交错
+        with catalog.lock, index.bulk():
+            for project_name, repos in catalog.repositories.items():
+                for repo_name in repos:
+                    index.add_repository(project_name, repo_name)
+                    artifacts = catalog.artifacts.get(repo_name)
+                    if artifacts:
+                        index.set_tags(project_name, repo_name, [t for a in artifacts.values() for t in a.get('tags', [])])
+            catalog.add_listener(index.on_catalog_change)
+        _indexes[id(catalog)] = index
+        logger.info(f"[search] 已为 {catalog.harbor_url} 构建索引: {len(index)} 条")
+        return index
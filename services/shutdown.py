@@ -0,0 +1,57 @@
+"""
+优雅退出
+收到 SIGTERM 后进入停止状态：就绪探针返回 503，新的导出 / 上传请求返回 503，
+进行中的传输继续执行直到完成或超过 SERVER_GRACEFUL_TIMEOUT。
+超时仍未完成的任务由任务日志（services.job_journal）在下次启动时恢复
+"""
+
+import threading
+import time
+from services import inflight
+from utils.logger import setup_logger
+
+logger = setup_logger('shutdown')
+
+_draining = threading.Event()
+_started_at = None
+
+
+def begin(reason='SIGTERM'):
+    """进入停止状态（可重复调用）"""
+    global _started_at
+    if _draining.is_set():
+        return
+    _started_at = time.time()
+    _draining.set()
+    logger.info(f"[shutdown] 收到 {reason}，停止接收新的传输，等待 {active_transfers()} 个进行中的传输完成")
+
+
+def draining():
+    return _draining.is_set()
+
+
+def active_transfers():
+    """本进程进行中的导出 / 上传 / 预热数"""
+    return sum(inflight.snapshot()['operations'].values())
+
+
+def wait_idle(timeout, poll=1.0):
+    """等待进行中的传输完成，返回超时后仍未完成的数量"""
+    deadline = time.monotonic() + timeout
+    remaining = active_transfers()
+    while remaining and time.monotonic() < deadline:
+        time.sleep(min(poll, max(0.0, deadline - time.monotonic())))
+        remaining = active_transfers()
+    if remaining:
+        logger.warning(f"[shutdown] 等待 {timeout}s 后仍有 {remaining} 个传输未完成，将在下次启动时恢复")
+    else:
+        logger.info("[shutdown] 进行中的传输已全部完成")
+    return remaining
+
+
+def status():
+    return {
+        'draining': draining(),
+        'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(_started_at)) if _started_at else None,
+        'active_transfers': active_transfers()
+    }
@@ -0,0 +1,359 @@
+"""
+存储分析：按层（layer digest）去重统计项目 / 仓库的真实占用
+digest 统一映射为整数 id，大小与引用关系使用 array 存储，manifest 按 digest 永久缓存。
+索引在后台线程中刷新（大型 registry 需要数分钟），接口返回最近一次刷新的结果并报告刷新状态
+"""
+
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config
+from services.harbor_service import HarborService
+from utils.auth import credential_fingerprint
+from utils.logger import setup_logger
+
+logger = setup_logger('storage_analytics')
+
+PAGE_SIZE = 100
+# 多个仓库 / 项目共同引用的层
+OWNER_NONE = -1
+OWNER_SHARED = -2
+
+INDEX_MEDIA_TYPES = (
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json'
+)
+
+
+class StorageAnalytics:
+    """单个 Harbor 实例的层引用索引"""
+
+    def __init__(self, harbor_url):
+        self.harbor_url = harbor_url
+        self.lock = threading.Lock()
+        self._digest_ids = {}          # digest -> id
+        self._digests = []             # id -> digest
+        self._sizes = array('Q')       # id -> 字节数
+        self._manifests = {}           # manifest id -> array('I') 层 id（含 config）
+        self._repo_marks = {}          # repo_name -> 上次列举时的 update_time
+        self._repo_projects = {}       # repo_name -> project_name
+        self._artifacts = {}           # repo_name -> {manifest id: (tags, size)}
+        self._invalidated = set()      # 本次刷新开始后失效的仓库
+        self._refresh_thread = None
+        self.refreshed_at = None       # 最近一次完成刷新的时间戳
+        self.last_stats = None
+        self.last_error = None
+
+    def _intern(self, digest, size=0):
+        digest_id = self._digest_ids.get(digest)
+        if digest_id is None:
+            digest_id = len(self._sizes)
+            digest = sys.intern(digest)
+            self._digest_ids[digest] = digest_id
+            self._digests.append(digest)
+            self._sizes.append(int(size or 0))
+        elif size and not self._sizes[digest_id]:
+            self._sizes[digest_id] = int(size)
+        return digest_id
+
+    def _load_layers(self, service, repo_name, digest):
+        """获取 manifest 的全部层；多架构索引会展开所有子 manifest"""
+        manifest = service.get_manifest(repo_name, digest)
+        media_type = manifest.get('mediaType')
+        if media_type in INDEX_MEDIA_TYPES or 'manifests' in manifest:
+            layers = []
+            for child in manifest.get('manifests', []):
+                layers.extend(self._load_layers(service, repo_name, child['digest']))
+            return layers
+        layers = []
+        config = manifest.get('config') or {}
+        if config.get('digest'):
+            layers.append((config['digest'], config.get('size', 0)))
+        for layer in manifest.get('layers', []):
+            layers.append((layer['digest'], layer.get('size', 0)))
+        return layers
+
+    def _list_repositories(self, service, project_name, stats):
+        page = 1
+        repos = []
+        while True:
+            items = service.get_repositories(project_name, page, PAGE_SIZE)
+            stats['requests'] += 1
+            repos.extend(items)
+            if len(items) < PAGE_SIZE:
+                break
+            page += 1
+        return repos
+
+    def refresh(self, service, projects=None):
+        """增量刷新引用索引：只重新列举 update_time 变化的仓库，只拉取未缓存的 manifest"""
+        stats = {'requests': 0, 'repositories_listed': 0, 'manifests_fetched': 0, 'manifest_errors': 0}
+        all_projects = projects is None
+        if all_projects:
+            projects = []
+            page = 1
+            while True:
+                items = service.get_projects(page, PAGE_SIZE)
+                stats['requests'] += 1
+                projects.extend(p['name'] for p in items)
+                if len(items) < PAGE_SIZE:
+                    break
+                page += 1
+
+        # 网络请求在锁外完成，报告与 webhook 失效不等待刷新；结果最后在短临界区内合并
+        with self.lock:
+            marks = dict(self._repo_marks)
+            known = set(self._artifacts)
+            self._invalidated = set()
+        listed = {}                    # repo_name -> project_name
+        fetched = {}                   # repo_name -> (update_time, artifacts)
+        for project_name in projects:
+            for repo in self._list_repositories(service, project_name, stats):
+                repo_name = repo['name']
+                listed[repo_name] = project_name
+                if marks.get(repo_name) == repo.get('updated') and repo_name in known:
+                    continue
+                fetched[repo_name] = (repo.get('updated'), service.get_all_artifacts(project_name, repo_name))
+                stats['repositories_listed'] += 1
+
+        with self.lock:
+            self._repo_projects.update(listed)
+            for repo_name, (updated, artifacts) in fetched.items():
+                entries = {}
+                for artifact in artifacts:
+                    manifest_id = self._intern(artifact['digest'])
+                    tags = tuple(sys.intern(t) for t in artifact.get('tags', []) if t != '<none>')
+                    entries[manifest_id] = (tags, artifact.get('size', 0))
+                self._artifacts[repo_name] = entries
+                # 列举期间收到 webhook 的仓库不记录 update_time，下次刷新重新列举
+                if repo_name not in self._invalidated:
+                    self._repo_marks[repo_name] = updated
+            # 已在 Harbor 删除的仓库（全量刷新时也包括已删除项目下的仓库）
+            scope = set(projects)
+            stale = [
+                r for r, p in self._repo_projects.items()
+                if r not in listed and (p in scope or all_projects)
+            ]
+            for repo_name in stale:
+                self._repo_projects.pop(repo_name, None)
+                self._artifacts.pop(repo_name, None)
+                self._repo_marks.pop(repo_name, None)
+            # 包含上次拉取失败的 manifest，下次刷新自动重试
+            pending = {
+                self._digests[manifest_id]: repo_name
+                for repo_name, entries in self._artifacts.items()
+                for manifest_id in entries
+                if manifest_id not in self._manifests
+            }
+
+        # manifest 内容按 digest 不可变，拉取一次即可永久复用
+        with ThreadPoolExecutor(max_workers=Config.HARBOR_BULK_WORKERS) as pool:
+            futures = {pool.submit(self._load_layers, service, repo, digest): digest for digest, repo in pending.items()}
+            for future in as_completed(futures):
+                digest = futures[future]
+                try:
+                    layers = future.result()
+                except Exception as e:
+                    stats['manifest_errors'] += 1
+                    logger.warning(f"[analytics] 获取 manifest 失败 {digest}: {str(e)}")
+                    continue
+                with self.lock:
+                    ids = array('I', sorted({self._intern(d, size) for d, size in layers}))
+                    self._manifests[self._intern(digest)] = ids
+                stats['manifests_fetched'] += 1
+        return stats
+
+    def start_refresh(self, service):
+        """在后台线程中全量刷新（已有刷新在进行时不重复启动），返回是否启动了新的刷新"""
+        with self.lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return False
+            self._refresh_thread = threading.Thread(
+                target=self._run_refresh, args=(service,),
+                name=f'storage-analytics-{self.harbor_url}', daemon=True
+            )
+            self._refresh_thread.start()
+            return True
+
+    def _run_refresh(self, service):
+        started = time.time()
+        try:
+            stats = self.refresh(service)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"[analytics] {self.harbor_url} 刷新失败: {str(e)}")
+            return
+        stats['duration'] = round(time.time() - started, 3)
+        self.last_stats = stats
+        self.last_error = None
+        self.refreshed_at = time.time()
+        logger.info(f"[analytics] {self.harbor_url} 刷新完成: {stats}")
+
+    def status(self):
+        thread = self._refresh_thread
+        return {
+            'refreshing': thread is not None and thread.is_alive(),
+            'refreshed_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.refreshed_at)) if self.refreshed_at else None,
+            'last_stats': self.last_stats,
+            'last_error': self.last_error
+        }
+
+    def invalidate_repository(self, repo_name):
+        """下次刷新时重新列举该仓库的 artifact"""
+        with self.lock:
+            self._repo_marks.pop(repo_name, None)
+            self._invalidated.add(repo_name)
+
+    def report(self, projects=None, candidates=None):
+        """计算去重后的占用；candidates 为待删除的 [{'repo':..., 'tag':...}]
+
+        引用计数与独占判断基于全部已知仓库，projects 只筛选输出的行，
+        范围外项目也引用的层不会被算作独占或可释放
+        """
+        with self.lock:
+            all_repos = list(self._repo_projects)
+            project_names = sorted(set(self._repo_projects.values()))
+            project_index = {name: i for i, name in enumerate(project_names)}
+            count = len(self._sizes)
+            repo_owner = array('i', [OWNER_NONE]) * count
+            project_owner = array('i', [OWNER_NONE]) * count
+            refcount = array('I', [0]) * count
+            repo_layers = []
+
+            for repo_idx, repo_name in enumerate(all_repos):
+                proj_idx = project_index[self._repo_projects[repo_name]]
+                layers = set()
+                for manifest_id in self._artifacts.get(repo_name, {}):
+                    for layer_id in self._manifests.get(manifest_id, ()):
+                        refcount[layer_id] += 1
+                        layers.add(layer_id)
+                for layer_id in layers:
+                    owner = repo_owner[layer_id]
+                    repo_owner[layer_id] = repo_idx if owner == OWNER_NONE else (owner if owner == repo_idx else OWNER_SHARED)
+                    owner = project_owner[layer_id]
+                    project_owner[layer_id] = proj_idx if owner == OWNER_NONE else (owner if owner == proj_idx else OWNER_SHARED)
+                repo_layers.append(layers)
+
+            def in_scope(repo_name):
+                return not projects or self._repo_projects[repo_name] in projects
+
+            repositories = []
+            scope_projects = sorted({self._repo_projects[r] for r in all_repos if in_scope(r)})
+            project_totals = {name: {'name': name, 'unique_bytes': 0, 'shared_bytes': 0, 'referenced_bytes': 0} for name in scope_projects}
+            project_layers = {name: set() for name in scope_projects}
+            scope_layers = set()
+            outside_layers = set()
+            logical = 0
+            for repo_idx, repo_name in enumerate(all_repos):
+                if not in_scope(repo_name):
+                    outside_layers.update(repo_layers[repo_idx])
+                    continue
+                scope_layers.update(repo_layers[repo_idx])
+                logical += sum(size or 0 for _, size in self._artifacts.get(repo_name, {}).values())
+                unique = shared = referenced = 0
+                for layer_id in repo_layers[repo_idx]:
+                    size = self._sizes[layer_id]
+                    referenced += size
+                    if repo_owner[layer_id] == repo_idx:
+                        unique += size
+                    else:
+                        shared += size
+                project_name = self._repo_projects[repo_name]
+                project_layers[project_name].update(repo_layers[repo_idx])
+                repositories.append({
+                    'name': repo_name,
+                    'project': project_name,
+                    'artifacts': len(self._artifacts.get(repo_name, {})),
+                    'unique_bytes': unique,
+                    'shared_bytes': shared,
+                    'referenced_bytes': referenced
+                })
+            for project_name, layers in project_layers.items():
+                totals = project_totals[project_name]
+                proj_idx = project_index[project_name]
+                for layer_id in layers:
+                    size = self._sizes[layer_id]
+                    totals['referenced_bytes'] += size
+                    if project_owner[layer_id] == proj_idx:
+                        totals['unique_bytes'] += size
+                    else:
+                        totals['shared_bytes'] += size
+
+            result = {
+                'logical_bytes': logical,
+                # 范围内仓库引用的去重字节数，以及其中只被范围内仓库引用（删除范围内全部仓库可释放）的部分
+                'referenced_bytes': sum(self._sizes[i] for i in scope_layers),
+                'unique_bytes': sum(self._sizes[i] for i in scope_layers if i not in outside_layers),
+                'shared_bytes': sum(self._sizes[i] for i in scope_layers if repo_owner[i] == OWNER_SHARED),
+                'layers': len(scope_layers),
+                'projects': sorted(project_totals.values(), key=lambda p: -p['unique_bytes']),
+                'repositories': sorted(repositories, key=lambda r: -r['unique_bytes'])
+            }
+            if candidates:
+                result['candidates'] = self._freed_by(candidates, refcount)
+            return result
+
+    def _freed_by(self, candidates, refcount):
+        """删除候选 tag 后可释放的字节：artifact 的全部 tag 都被删除时才视为移除"""
+        wanted = {}
+        for item in candidates:
+            wanted.setdefault(item.get('repo'), set()).add(item.get('tag'))
+        removed = []
+        remaining = array('I', refcount)
+        for repo_name, tags in wanted.items():
+            for manifest_id, (artifact_tags, _) in self._artifacts.get(repo_name, {}).items():
+                if artifact_tags and set(artifact_tags) <= tags:
+                    removed.append((repo_name, manifest_id, artifact_tags))
+                    for layer_id in self._manifests.get(manifest_id, ()):
+                        remaining[layer_id] -= 1
+        freed_layers = {
+            layer_id
+            for _, manifest_id, _ in removed
+            for layer_id in self._manifests.get(manifest_id, ())
+            if remaining[layer_id] == 0
+        }
+        return {
+            'freed_bytes': sum(self._sizes[i] for i in freed_layers),
+            'freed_layers': len(freed_layers),
+            'removed_artifacts': [
+                {'repo': repo_name, 'digest': self._digests[manifest_id], 'tags': list(tags)}
+                for repo_name, manifest_id, tags in removed
+            ]
+        }
+
+
+_analytics = {}
+_analytics_lock = threading.Lock()
+
+
+def get_storage_analytics(harbor_url, username, password):
+    """按 Harbor 地址与凭据获取常驻的分析索引"""
+    key = (HarborService.normalize_url(harbor_url), credential_fingerprint(username, password))
+    with _analytics_lock:
+        analytics = _analytics.get(key)
+        if analytics is None:
+            analytics = _analytics[key] = StorageAnalytics(key[0])
+        return analytics
+
+
+def iter_storage_analytics(harbor_url=None):
+    """遍历已有的分析索引，可按 Harbor 地址过滤"""
+    target = HarborService.normalize_url(harbor_url) if harbor_url else None
+    with _analytics_lock:
+        items = list(_analytics.values())
+    return [a for a in items if target is None or a.harbor_url == target]
+
+
+def analyze_storage(service, projects=None, candidates=None, refresh=False):
+    """返回最近一次刷新的报告，索引过期（STORAGE_ANALYTICS_MAX_AGE）或 refresh=True 时在后台刷新
+
+    尚未完成过刷新时 report 为 None，调用方稍后轮询
+    """
+    analytics = get_storage_analytics(service.harbor_url, service.username, service.password)
+    refreshed_at = analytics.refreshed_at
+    if refresh or refreshed_at is None or time.time() - refreshed_at >= Config.STORAGE_ANALYTICS_MAX_AGE:
+        analytics.start_refresh(service)
+    report = analytics.report(projects, candidates) if analytics.refreshed_at is not None else None
+    return report, analytics.status()
@@ -0,0 +1,238 @@
+"""
+系统资源采样
+后台线程定期采集 CPU / 内存 / 磁盘并保留历史；下载与上传目录的占用在文件创建、删除时增量记账，
+采样线程按较长周期全量重扫一次以纠正外部改动造成的偏差
+"""
+
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from config import Config
+from utils import metrics
+from utils.logger import setup_logger
+
+logger = setup_logger('system_monitor')
+
+
+def _tree_size(path):
+    total = 0
+    files = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+                files += 1
+            except OSError:
+                pass
+    return total, files
+
+
+class FolderUsage:
+    """单个目录的占用统计"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.size = 0
+        self.files = 0
+        self.scanned_at = None
+        self._lock = threading.Lock()
+
+    def contains(self, path):
+        return os.path.abspath(path).startswith(self.path + os.sep)
+
+    def rescan(self):
+        size, files = _tree_size(self.path) if os.path.isdir(self.path) else (0, 0)
+        with self._lock:
+            self.size = size
+            self.files = files
+            self.scanned_at = time.time()
+
+    def adjust(self, size, files):
+        with self._lock:
+            self.size = max(0, self.size + size)
+            self.files = max(0, self.files + files)
+
+    def snapshot(self):
+        with self._lock:
+            return {'path': self.path, 'size': self.size, 'files': self.files}
+
+
+_folders = {
+    'download_folder': FolderUsage(Config.DOWNLOAD_FOLDER),
+    'upload_folder': FolderUsage(Config.UPLOAD_FOLDER)
+}
+
+
+def _folder_of(path):
+    for usage in _folders.values():
+        if usage.contains(path):
+            return usage
+    return None
+
+
+def account_file(path):
+    """记录新建完成的文件"""
+    usage = _folder_of(path)
+    if usage is not None:
+        try:
+            usage.adjust(os.path.getsize(path), 1)
+        except OSError:
+            pass
+
+
+def remove_file(path):
+    """删除文件并记账，返回释放的字节数（文件不存在时为 0）"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    usage = _folder_of(path)
+    if usage is not None:
+        usage.adjust(-size, -1)
+    return size
+
+
+def remove_tree(path):
+    """删除目录并记账，返回释放的字节数"""
+    if not os.path.isdir(path):
+        return 0
+    size, files = _tree_size(path)
+    shutil.rmtree(path, ignore_errors=True)
+    usage = _folder_of(path)
+    if usage is not None:
+        usage.adjust(-size, -files)
+    return size
+
+
+class SystemSampler:
+    """后台采样线程，请求只读取最近一次快照"""
+
+    def __init__(self, interval, history_size, rescan_interval):
+        self.interval = interval
+        self.rescan_interval = rescan_interval
+        self.history = deque(maxlen=history_size)
+        self.latest = None
+        self.cpu_count = os.cpu_count()
+        self._last_rescan = 0.0
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return False
+            import psutil
+            # interval=None 返回距上次调用的平均值，先调用一次建立基准
+            psutil.cpu_percent(interval=None)
+            self.sample()
+            self._thread = threading.Thread(target=self._run, name='system-sampler', daemon=True)
+            self._thread.start()
+            logger.info(f"系统采样已启动，间隔 {self.interval}s")
+            return True
+
+    def _rescan_folders(self):
+        for usage in _folders.values():
+            usage.rescan()
+        self._last_rescan = time.time()
+
+    def sample(self):
+        import psutil
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        snapshot = {
+            'time': time.time(),
+            'cpu': {'percent': psutil.cpu_percent(interval=None), 'count': self.cpu_count},
+            'memory': {
+                'total': memory.total,
+                'available': memory.available,
+                'percent': memory.percent,
+                'used': memory.used
+            },
+            'disk': {
+                'total': disk.total,
+                'used': disk.used,
+                'free': disk.free,
+                'percent': disk.percent
+            }
+        }
+        with self._lock:
+            self.latest = snapshot
+            self.history.append((
+                round(snapshot['time'], 3),
+                snapshot['cpu']['percent'],
+                memory.percent,
+                disk.percent
+            ))
+        return snapshot
+
+    def _run(self):
+        # 目录全量扫描在后台线程中进行，不阻塞进程启动
+        try:
+            self._rescan_folders()
+        except Exception as e:
+            logger.warning(f"目录扫描失败: {str(e)}")
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self.rescan_interval and time.time() - self._last_rescan >= self.rescan_interval:
+                    self._rescan_folders()
+                self.sample()
+            except Exception as e:
+                logger.warning(f"系统采样失败: {str(e)}")
+
+    def snapshot(self, with_history=False):
+        with self._lock:
+            latest = dict(self.latest or {})
+            history = list(self.history) if with_history else None
+        for name, usage in _folders.items():
+            latest[name] = usage.snapshot()
+        if history is not None:
+            latest['history'] = {
+                'fields': ['time', 'cpu_percent', 'memory_percent', 'disk_percent'],
+                'interval': self.interval,
+                'samples': history
+            }
+        return latest
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _collect_folders():
+    result = []
+    for name, usage in _folders.items():
+        snap = usage.snapshot()
+        result.append(((name, 'bytes'), snap['size']))
+        result.append(((name, 'files'), snap['files']))
+    return result
+
+
+def _collect_disk():
+    """取采样线程最近一次结果，抓取时不做磁盘调用"""
+    latest = _sampler.latest if _sampler is not None else None
+    if not latest:
+        return []
+    return [((key,), latest['disk'][key]) for key in ('total', 'used', 'free')]
+
+
+metrics.gauge('harbor_export_folder_usage', '下载 / 上传目录占用（字节数与文件数）', ('folder', 'unit'), _collect_folders)
+metrics.gauge('harbor_export_disk_bytes', '根分区磁盘容量', ('kind',), _collect_disk)
+
+
+def get_system_sampler():
+    """获取并按需启动全局采样器"""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = SystemSampler(
+                Config.SYSTEM_SAMPLE_INTERVAL,
+                Config.SYSTEM_SAMPLE_HISTORY,
+                Config.SYSTEM_FOLDER_RESCAN_INTERVAL
+            )
+    _sampler.start()
+    return _sampler
@@ -0,0 +1,164 @@
+"""
+Harbor Webhook 事件处理
+推送 / 删除 artifact 时使本地目录、搜索索引、存储分析失效，并按规则在后台预热导出
+"""
+
+import fnmatch
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from config import Config
+from services.catalog_service import iter_catalogs
+from services.search_index import index_for_catalog
+from services.storage_analytics import iter_storage_analytics
+from services.docker_service import DockerService, get_docker_service
+from utils.logger import setup_logger
+
+logger = setup_logger('webhook_service')
+
+EVENT_PUSH = 'PUSH_ARTIFACT'
+EVENT_DELETE = 'DELETE_ARTIFACT'
+
+_prewarm_pool = None
+# (harbor_url, repo, tag) -> 状态：已排队 / 执行中 / 执行中且期间又有推送（结束后再执行一次）
+_PREWARM_QUEUED = 'queued'
+_PREWARM_RUNNING = 'running'
+_PREWARM_RERUN = 'rerun'
+_prewarm_pending = {}
+_prewarm_lock = threading.Lock()
+
+
+def verify_secret(auth_header):
+    """校验 Harbor 发送的 Authorization 头；未配置密钥时拒绝所有请求"""
+    secret = Config.HARBOR_WEBHOOK_SECRET
+    if not secret or not auth_header:
+        return False
+    return hmac.compare_digest(auth_header.encode(), secret.encode())
+
+
+def _host_of(url):
+    return urlparse(url if '://' in url else 'https://' + url).netloc
+
+
+def _matches_prewarm(repo_full_name):
+    return any(fnmatch.fnmatch(repo_full_name, p) for p in Config.WEBHOOK_PREWARM_PATTERNS)
+
+
+def _get_prewarm_pool():
+    global _prewarm_pool
+    with _prewarm_lock:
+        if _prewarm_pool is None:
+            _prewarm_pool = ThreadPoolExecutor(max_workers=Config.WEBHOOK_PREWARM_WORKERS, thread_name_prefix='prewarm')
+        return _prewarm_pool
+
+
+def _run_prewarm(harbor_url, repo_full_name, tag):
+    key = (harbor_url, repo_full_name, tag)
+    with _prewarm_lock:
+        _prewarm_pending[key] = _PREWARM_RUNNING
+    try:
+        get_docker_service().prewarm_image(
+            harbor_url,
+            Config.WEBHOOK_PREWARM_USERNAME,
+            Config.WEBHOOK_PREWARM_PASSWORD,
+            repo_full_name,
+            tag
+        )
+    except Exception as e:
+        logger.error(f"[webhook] 预热失败 {repo_full_name}:{tag}: {str(e)}")
+    finally:
+        with _prewarm_lock:
+            rerun = _prewarm_pending.pop(key, None) == _PREWARM_RERUN
+            if rerun:
+                _prewarm_pending[key] = _PREWARM_QUEUED
+        if rerun:
+            # 预热期间 tag 又被推送，本次导出的可能是旧 digest，再执行一次
+            logger.info(f"[webhook] 预热期间 {repo_full_name}:{tag} 被再次推送，重新预热")
+            _get_prewarm_pool().submit(_run_prewarm, harbor_url, repo_full_name, tag)
+
+
+def queue_prewarm(harbor_url, repo_full_name, tag):
+    """排队后台预热；同一镜像已在排队时合并，正在预热时在结束后再执行一次"""
+    key = (harbor_url, repo_full_name, tag)
+    with _prewarm_lock:
+        state = _prewarm_pending.get(key)
+        if state == _PREWARM_RUNNING:
+            _prewarm_pending[key] = _PREWARM_RERUN
+            return True
+        if state is not None:
+            return False
+        _prewarm_pending[key] = _PREWARM_QUEUED
+    _get_prewarm_pool().submit(_run_prewarm, harbor_url, repo_full_name, tag)
+    return True
+
+
+def handle_event(payload):
+    """处理一条 webhook 事件，返回处理摘要"""
+    event_type = payload.get('type')
+    event_data = payload.get('event_data') or {}
+    repository = event_data.get('repository') or {}
+    repo_full_name = repository.get('repo_full_name')
+    project_name = repository.get('namespace') or (repo_full_name or '').split('/')[0]
+    resources = event_data.get('resources') or []
+    summary = {
+        'type': event_type,
+        'repository': repo_full_name,
+        'invalidated': 0,
+        'prewarm_queued': [],
+        'prewarm_discarded': []
+    }
+    if event_type not in (EVENT_PUSH, EVENT_DELETE) or not repo_full_name:
+        summary['ignored'] = True
+        return summary
+
+    tags = [r.get('tag') for r in resources if r.get('tag')]
+    # resource_url 形如 harbor.example.com/library/nginx:v1，据此定位 Harbor 实例；
+    # 缺少 resource_url 时无法区分实例，使所有实例上的该仓库失效
+    hosts = {r['resource_url'].split('/')[0] for r in resources if r.get('resource_url')}
+
+    def _targets(items):
+        return [i for i in items if not hosts or _host_of(i.harbor_url) in hosts]
+
+    for catalog in _targets(iter_catalogs()):
+        catalog.invalidate_repository(project_name, repo_full_name)
+        summary['invalidated'] += 1
+        index = index_for_catalog(catalog)
+        if index is not None:
+            if event_type == EVENT_PUSH:
+                index.add_tags(project_name, repo_full_name, tags)
+            else:
+                index.remove_tags(repo_full_name, tags)
+            summary['invalidated'] += 1
+    for analytics in _targets(iter_storage_analytics()):
+        analytics.invalidate_repository(repo_full_name)
+        summary['invalidated'] += 1
+
+    # 预热与作废预热文件需要 tag 和 Harbor 地址（resource_url 或 WEBHOOK_PREWARM_HARBOR_URL），缺少时只跳过这一步
+    prewarm_targets = {}
+    for resource in resources:
+        tag = resource.get('tag')
+        host = resource['resource_url'].split('/')[0] if resource.get('resource_url') else None
+        harbor_url = Config.WEBHOOK_PREWARM_HARBOR_URL or (f"https://{host}" if host else None)
+        if not tag or not harbor_url:
+            logger.info(f"[webhook] {repo_full_name} 的资源缺少 tag 或地址，跳过预热: {resource.get('digest')}")
+            continue
+        prewarm_targets[(harbor_url, tag)] = True
+
+    for harbor_url, tag in prewarm_targets:
+        registry = _host_of(harbor_url)
+        # tag 被覆盖或删除后，旧的预热文件立即作废
+        try:
+            if DockerService.discard_prewarmed(registry, repo_full_name, tag):
+                summary['prewarm_discarded'].append(f"{repo_full_name}:{tag}")
+        except Exception as e:
+            logger.warning(f"[webhook] 清理预热文件失败: {str(e)}")
+        if event_type == EVENT_PUSH and Config.WEBHOOK_PREWARM_USERNAME and _matches_prewarm(repo_full_name):
+            if queue_prewarm(harbor_url, repo_full_name, tag):
+                summary['prewarm_queued'].append(f"{repo_full_name}:{tag}")
+
+    logger.info(
+        f"[webhook] {event_type} {repo_full_name} tags={tags} invalidated={summary['invalidated']} "
+        f"prewarm={len(summary['prewarm_queued'])}"
+    )
+    return summary
@@ -2,12 +2,13 @@
 
 from .logger import setup_logger
 from .response import success_response, error_response
-from .auth import get_auth_header, require_harbor_config
+from .auth import get_auth_header, credential_fingerprint, require_harbor_config
 
 __all__ = [
     'setup_logger',
     'success_response',
     'error_response',
     'get_auth_header',
+    'credential_fingerprint',
     'require_harbor_config'
 ]
\ No newline at end of file
@@ -1,4 +1,5 @@
 import base64
+import hashlib
 from functools import wraps
 from flask import request
 from utils.response import error_response
@@ -10,6 +11,10 @@ def get_auth_header(username, password):
     encoded = base64.b64encode(credentials.encode()).decode()
     return {"Authorization": f"Basic {encoded}"}
 
+def credential_fingerprint(username, password):
+    """凭据指纹，用作缓存键的一部分，避免错误密码命中他人的缓存结果"""
+    return hashlib.sha256(f"{username}:{password}".encode()).hexdigest()
+
 def require_harbor_config(f):
     """装饰器：要求请求包含 Harbor 配置"""
     @wraps(f)
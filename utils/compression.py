@@ -0,0 +1,103 @@
+"""
+响应压缩
+按 Accept-Encoding 协商 br / gzip，小于阈值的响应不压缩；流式响应逐块增量压缩
+"""
+
+import gzip
+import zlib
+from config import Config
+from utils.cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/event-stream'
+)
+
+# 带 ETag 的静态响应（如 swagger.json）压缩结果按 (ETag, 编码) 复用
+_static_cache = TTLCache(ttl=24 * 3600, maxsize=64)
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=Config.COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=Config.COMPRESS_LEVEL)
+
+
+def _stream_compressor(encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=Config.COMPRESS_BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(Config.COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+        lambda: compressor.flush(zlib.Z_FINISH)
+    )
+
+
+def _compress_iter(iterable, encoding):
+    """逐块压缩并在每块后 flush，客户端可以边收边解析"""
+    process, flush, finish = _stream_compressor(encoding)
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response, request):
+    """after_request 钩子中调用：满足条件时原地压缩响应"""
+    if not Config.COMPRESS_ENABLED:
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304) or request.method == 'HEAD':
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    encoding = request.accept_encodings.best_match(supported_encodings())
+    response.vary.add('Accept-Encoding')
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_iter(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    etag, _ = response.get_etag()
+    cache_key = (etag, encoding) if etag else None
+    body = _static_cache.get(cache_key) if cache_key else None
+    if body is None:
+        data = response.get_data()
+        if len(data) < Config.COMPRESS_MIN_SIZE:
+            return response
+        body = _compress(data, encoding)
+        if cache_key:
+            _static_cache.set(cache_key, body)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
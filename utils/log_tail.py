@@ -0,0 +1,189 @@
+"""
+日志读取
+从文件末尾按块反向读取最近的日志，支持按级别 / 日志器过滤；
+实时跟随基于文件偏移量，遇到轮转（inode 变化）或截断时自动切换到新文件
+"""
+
+import json
+import logging
+import os
+import re
+import time
+
+BLOCK_SIZE = 8192
+# 多行记录（如异常堆栈）最多合并的行数
+MAX_RECORD_LINES = 200
+
+# 与 setup_logger 的文本格式对应：时间 - 日志器 - 级别 - [文件:行号] - 消息（JSON 格式按字段解析）
+HEADER_RE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - (?P<name>\S+) - (?P<level>[A-Z]+) - ')
+
+
+def parse_cursor(cursor):
+    """游标格式为 inode:offset"""
+    try:
+        inode, offset = cursor.split(':', 1)
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _parse_header(line):
+    """解析记录首行的 (日志器, 级别)，兼容文本格式与 JSON Lines 格式"""
+    if line.startswith('{'):
+        try:
+            data = json.loads(line)
+            return data['name'], data['level']
+        except (ValueError, KeyError, TypeError):
+            return None
+    m = HEADER_RE.match(line)
+    return (m.group('name'), m.group('level')) if m else None
+
+
+def _make_filter(level=None, names=None):
+    min_level = logging.getLevelName(level.upper()) if level else None
+    if not isinstance(min_level, int):
+        min_level = None
+    names = set(names) if names else None
+
+    def match(line):
+        """返回 True / False；非记录首行返回 None"""
+        header = _parse_header(line)
+        if header is None:
+            return None
+        name, level_name = header
+        if names is not None and name not in names:
+            return False
+        if min_level is not None:
+            record_level = logging.getLevelName(level_name)
+            if not isinstance(record_level, int) or record_level < min_level:
+                return False
+        return True
+
+    return match, (min_level is not None or names is not None)
+
+
+def _reverse_lines(f, end, block_size=BLOCK_SIZE):
+    """从 end 位置向前逐行产出（bytes，不含换行符）"""
+    pos = end
+    buffer = b''
+    while pos > 0:
+        size = min(block_size, pos)
+        pos -= size
+        f.seek(pos)
+        buffer = f.read(size) + buffer
+        parts = buffer.split(b'\n')
+        buffer = parts[0]
+        for line in reversed(parts[1:]):
+            yield line
+    yield buffer
+
+
+def tail(path, lines=100, level=None, names=None):
+    """读取最后 lines 条日志；指定过滤条件时多行记录合并为一条
+
+    返回 (records, cursor)，cursor 可作为实时跟随的起点
+    """
+    if not os.path.exists(path):
+        return [], None
+    match, filtered = _make_filter(level, names)
+    records = []
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        end = st.st_size
+        cursor = f"{st.st_ino}:{end}"
+        pending = []
+        skip_trailing = True
+        for raw in _reverse_lines(f, end):
+            if skip_trailing and not raw:
+                continue
+            skip_trailing = False
+            line = raw.decode('utf-8', errors='replace')
+            if not filtered:
+                records.append(line + '\n')
+            else:
+                pending.append(line)
+                ok = match(line)
+                if ok is None and len(pending) < MAX_RECORD_LINES:
+                    continue
+                if ok:
+                    records.append('\n'.join(reversed(pending)) + '\n')
+                pending = []
+            if len(records) >= lines:
+                break
+    records.reverse()
+    return records, cursor
+
+
+def _open_at(path, cursor):
+    """按游标打开文件；游标指向已轮转的文件时，从 path.1 中继续读取"""
+    parsed = parse_cursor(cursor) if cursor else None
+    f = open(path, 'rb')
+    st = os.fstat(f.fileno())
+    if parsed is None:
+        f.seek(st.st_size)
+        return f
+    inode, offset = parsed
+    if st.st_ino == inode:
+        f.seek(min(offset, st.st_size))
+        return f
+    rotated = f"{path}.1"
+    try:
+        if os.stat(rotated).st_ino == inode:
+            f.close()
+            f = open(rotated, 'rb')
+            f.seek(offset)
+            return f
+    except OSError:
+        pass
+    # 游标对应的文件已不存在，从当前文件开头读取
+    return f
+
+
+def follow(path, cursor=None, level=None, names=None, poll_interval=0.5, max_seconds=None):
+    """持续产出 (record_line, cursor)；无新内容时产出 (None, cursor) 作为心跳"""
+    match, filtered = _make_filter(level, names)
+    deadline = time.time() + max_seconds if max_seconds else None
+    f = _open_at(path, cursor)
+    buffer = b''
+    current_ok = not filtered
+    try:
+        while deadline is None or time.time() < deadline:
+            chunk = f.read(65536)
+            inode = os.fstat(f.fileno()).st_ino
+            if chunk:
+                buffer += chunk
+                parts = buffer.split(b'\n')
+                buffer = parts.pop()
+                position = f.tell() - len(buffer)
+                consumed = position - sum(len(p) + 1 for p in parts)
+                for raw in parts:
+                    consumed += len(raw) + 1
+                    line = raw.decode('utf-8', errors='replace')
+                    if filtered:
+                        ok = match(line)
+                        if ok is not None:
+                            current_ok = ok
+                    if current_ok:
+                        yield line, f"{inode}:{consumed}"
+                continue
+
+            # 到达文件末尾：检查是否已轮转或被截断
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                time.sleep(poll_interval)
+                continue
+            if st.st_ino != inode:
+                # 旧文件已读完，切换到新文件从头读取
+                f.close()
+                f = open(path, 'rb')
+                buffer = b''
+                continue
+            if st.st_size < f.tell():
+                f.seek(0)
+                buffer = b''
+                continue
+            yield None, f"{inode}:{f.tell() - len(buffer)}"
+            time.sleep(poll_interval)
+    finally:
+        f.close()
@@ -1,10 +1,207 @@
+import atexit
+import copy
+import fcntl
+import json
 import logging
 import os
 import sys
-import io
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from config import Config
 
+# 高频日志（如推送进度）传入 extra=SAMPLED，按调用位置限流
+SAMPLED = {'sampled': True}
+
+_pipeline_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+_console_configured = False
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON Lines 格式，每条记录一行"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'name': record.name,
+            'level': record.levelname,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage()
+        }
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """标记为 sampled 的 INFO 及以下日志，同一调用位置每个窗口最多输出 burst 条
+
+    被省略的条数附加在窗口后第一条输出的日志上
+    """
+
+    def __init__(self, window, burst):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or record.levelno > logging.INFO or self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, count, dropped = self._sites.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.burst:
+                self._sites[key] = (started, count, dropped + 1)
+                return False
+            self._sites[key] = (started, count + 1, 0)
+        if dropped:
+            record.msg = f"{record.getMessage()} (同一位置已省略 {dropped} 条)"
+            record.args = None
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """在调用线程中只做消息格式化，异常堆栈保存在 exc_text 中交给写入线程的格式化器
+
+    队列满时丢弃 INFO 及以下的日志，WARNING 及以上等待写入
+    """
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """多个工作进程写同一日志文件时使用
+
+    轮转前加文件锁，避免多个进程重复轮转；发现文件已被其他进程轮转（inode 变化）时只重新打开
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._lock_path = f"{self.baseFilename}.lock"
+
+    def _rotated_elsewhere(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except OSError:
+            return True
+
+    def _reopen(self):
+        if self.stream:
+            self.stream.close()
+        self.stream = self._open()
+
+    def shouldRollover(self, record):
+        if self.stream is not None and self._rotated_elsewhere():
+            self._reopen()
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # 等锁期间其他进程可能已完成轮转
+                if self._rotated_elsewhere():
+                    self._reopen()
+                    return
+                super().doRollover()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _start_listener(handler, file_handler):
+    global _listener
+    handler.queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+    _listener = QueueListener(handler.queue, file_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _after_fork_in_child():
+    """fork 出的子进程中没有写入线程，且继承的队列状态不可用，重新创建队列与写入线程"""
+    if _queue_handler is None:
+        return
+    file_handler = _listener.handlers[0]
+    file_handler.acquire()
+    try:
+        file_handler._reopen()
+    finally:
+        file_handler.release()
+    _start_listener(_queue_handler, file_handler)
+
+
+def _get_queue_handler():
+    """所有日志器共用一个队列处理器；由单个写入线程、单个轮转文件处理器落盘"""
+    global _queue_handler
+    with _pipeline_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+        try:
+            os.makedirs(os.path.dirname(Config.LOG_FILE), exist_ok=True)
+        except Exception:
+            pass
+        file_handler = SharedRotatingFileHandler(
+            Config.LOG_FILE,
+            maxBytes=Config.LOG_MAX_BYTES,
+            backupCount=Config.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+        file_handler.setLevel(logging.DEBUG)
+        if Config.LOG_FORMAT == 'json':
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+            ))
+        handler = _QueueHandler(None)
+        handler.addFilter(SamplingFilter(Config.LOG_SAMPLE_WINDOW, Config.LOG_SAMPLE_BURST))
+        _start_listener(handler, file_handler)
+        # 退出前把队列中剩余的日志写完
+        atexit.register(lambda: _listener.stop())
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+        _queue_handler = handler
+        return handler
+
+
+def _configure_console():
+    """将控制台编码设置为 UTF-8（进程内只执行一次），不可用时保持原样由输出端替换不可编码字符"""
+    global _console_configured
+    with _pipeline_lock:
+        if _console_configured:
+            return
+        _console_configured = True
+    try:
+        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+        sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+    except Exception:
+        pass
+
+
 def setup_logger(name='harbor-backend'):
     """配置日志器"""
     logger = logging.getLogger(name)
@@ -14,51 +211,10 @@ def setup_logger(name='harbor-backend'):
         logger.handlers.clear()
     except Exception:
         logger.handlers = []
-    
-    class SafeConsoleHandler(logging.StreamHandler):
-        def emit(self, record):
-            try:
-                super().emit(record)
-            except UnicodeEncodeError:
-                try:
-                    msg = self.format(record)
-                    safe = msg.encode('ascii', 'replace').decode('ascii')
-                    self.stream.write(safe + self.terminator)
-                    self.flush()
-                except Exception:
-                    pass
-
-    # 尝试将控制台编码设置为 UTF-8，不可用时自动降级为 ASCII 替换
-    try:
-        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-        sys.stderr.reconfigure(encoding='utf-8', errors='replace')
-        stdout_stream = sys.stdout
-    except Exception:
-        try:
-            stdout_stream = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-        except Exception:
-            stdout_stream = sys.stdout
-    console_handler = None
-    
-    # 文件处理器
-    try:
-      os.makedirs(os.path.dirname(Config.LOG_FILE), exist_ok=True)
-    except Exception:
-      pass
-    file_handler = RotatingFileHandler(
-        Config.LOG_FILE,
-        maxBytes=Config.LOG_MAX_BYTES,
-        backupCount=Config.LOG_BACKUP_COUNT
-    )
-    file_handler.setLevel(logging.DEBUG)
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-    )
-    file_handler.setFormatter(file_formatter)
-    
-    if not logger.handlers:
-        if console_handler:
-            logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
-    
+
+    _configure_console()
+
+    # 文件输出经由共享队列，由后台线程写入
+    logger.addHandler(_get_queue_handler())
+
     return logger
@@ -0,0 +1,243 @@
+"""
+Prometheus 指标
+计数器与直方图按线程分片：每个线程只写自己的分片，记录时不加锁、不分配对象；
+抓取时汇总各分片，已退出线程的分片并入累计值后释放。
+仪表可按线程分片增减，也可由回调在抓取时计算
+"""
+
+import bisect
+import math
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 延迟直方图默认分桶（秒），覆盖普通接口到大镜像导出
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class _Shards:
+    """一组标签值对应的序列，每个线程持有一个定长 list 作为分片"""
+
+    __slots__ = ('_size', '_local', '_cells', '_retired', '_lock')
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._cells = []
+        self._retired = [0] * size
+        self._lock = threading.Lock()
+
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            # 每个线程首次写入时分配一次
+            cell = [0] * self._size
+            with self._lock:
+                self._cells.append((threading.current_thread(), cell))
+            self._local.cell = cell
+            return cell
+
+    def totals(self):
+        with self._lock:
+            totals = list(self._retired)
+            alive = []
+            for thread, cell in self._cells:
+                for i, value in enumerate(cell):
+                    totals[i] += value
+                if thread.is_alive():
+                    alive.append((thread, cell))
+                else:
+                    for i, value in enumerate(cell):
+                        self._retired[i] += value
+            self._cells = alive
+        return totals
+
+
+class _CounterChild:
+    __slots__ = ('_shards',)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.cell()[0] += amount
+
+    def value(self):
+        return self._shards.totals()[0]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self._shards.cell()[0] -= amount
+
+
+class _HistogramChild:
+    """分片布局：各分桶（最后一个为 +Inf）计数，末尾为观测值总和"""
+
+    __slots__ = ('_shards', '_bounds')
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._shards = _Shards(len(bounds) + 2)
+
+    def observe(self, value):
+        cell = self._shards.cell()
+        cell[bisect.bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """按位置传入标签值；子序列创建后缓存，热点路径可在模块级预先绑定"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def collect(self, lines):
+        for values, child in self._items():
+            lines.append(f'{self.name}{_labels(self.labelnames, values)} {_number(child.value())}')
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """callback 返回 [(标签值元组, 数值), ...] 时在抓取时计算，否则按 inc / dec 累计"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def collect(self, lines):
+        if self.callback is None:
+            return super().collect(lines)
+        for values, value in self.callback():
+            lines.append(f'{self.name}{_labels(self.labelnames, values)} {_number(value)}')
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def collect(self, lines):
+        bounds = ['le="%s"' % _number(float(b)) for b in self.buckets] + ['le="+Inf"']
+        for values, child in self._items():
+            totals = child._shards.totals()
+            cumulative = 0
+            for bound, count in zip(bounds, totals):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, values, bound)} {cumulative}')
+            labels = _labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {_number(float(totals[-1]))}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+
+
+def _register(metric):
+    with _registry_lock:
+        for existing in _registry:
+            if existing.name == metric.name:
+                return existing
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), callback=None):
+    return _register(Gauge(name, documentation, labelnames, callback))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    """输出 Prometheus 文本格式"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        try:
+            metric.collect(lines)
+        except Exception as e:
+            lines.append(f'# {metric.name} 采集失败: {_escape(e)}')
+    return '\n'.join(lines) + '\n'
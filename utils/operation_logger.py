@@ -1,28 +1,176 @@
+"""
+操作日志存储
+使用 SQLite（WAL 模式）按时间、操作人、操作类型建立索引，支持游标分页查询；
+首次启动时自动导入旧版 operations.log（JSON Lines）
+"""
+
+import itertools
 import json
 import os
+import sqlite3
+import threading
 import time
-from typing import Any, Dict, Iterable
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from config import Config
 
-LOG_PATH = os.path.join(os.path.dirname(__file__), 'logs', 'operations.log')
+DB_PATH = Config.OPERATION_LOG_DB
+# 旧版 JSON Lines 文件
+LEGACY_LOG_PATH = os.path.join(os.path.dirname(__file__), 'logs', 'operations.log')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 每写入这么多条检查一次保留期限
+PRUNE_EVERY = 500
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+# 写入计数；count() 的 next 在 CPython 中是原子操作，多线程写入时不会漏计
+_writes = itertools.count(1)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    operator TEXT,
+    action TEXT,
+    success INTEGER,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_operations_ts ON operations (ts);
+CREATE INDEX IF NOT EXISTS idx_operations_operator ON operations (operator, id);
+CREATE INDEX IF NOT EXISTS idx_operations_action ON operations (action, id);
+"""
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+    _ensure_schema(conn)
+    return conn
+
+
+def _ensure_schema(conn):
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        conn.executescript(SCHEMA)
+        _migrate_legacy(conn)
+        _initialized = True
+
+
+def parse_time(value) -> Optional[float]:
+    """接受时间戳或 'YYYY-MM-DD HH:MM:SS'（也可只给日期）"""
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    for fmt in (TIME_FORMAT, '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(str(value), fmt))
+        except ValueError:
+            continue
+    raise ValueError(f'无法解析时间: {value}')
+
+
+def _row(rec: Dict[str, Any]):
+    ts = parse_time(rec.get('timestamp')) or time.time()
+    success = rec.get('success')
+    return (
+        ts,
+        rec.get('operator'),
+        rec.get('action'),
+        None if success is None else int(bool(success)),
+        json.dumps(rec, ensure_ascii=False)
+    )
+
+
+def _migrate_legacy(conn):
+    if not os.path.exists(LEGACY_LOG_PATH):
+        return
+    # 多个工作进程同时启动时，由写锁保证只导入一次
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not os.path.exists(LEGACY_LOG_PATH):
+            conn.rollback()
+            return
+        rows = []
+        with open(LEGACY_LOG_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rows.append(_row(json.loads(line)))
+                except (ValueError, AttributeError):
+                    continue
+        conn.executemany('INSERT INTO operations (ts, operator, action, success, record) VALUES (?, ?, ?, ?, ?)', rows)
+        os.replace(LEGACY_LOG_PATH, LEGACY_LOG_PATH + '.migrated')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _prune(conn):
+    if not Config.OPERATION_LOG_RETENTION_DAYS:
+        return
+    cutoff = time.time() - Config.OPERATION_LOG_RETENTION_DAYS * 86400
+    with conn:
+        conn.execute('DELETE FROM operations WHERE ts < ?', (cutoff,))
 
-os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
 
 def append(record: Dict[str, Any]):
     rec = dict(record)
-    rec.setdefault('timestamp', time.strftime('%Y-%m-%d %H:%M:%S'))
-    with open(LOG_PATH, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+    rec.setdefault('timestamp', time.strftime(TIME_FORMAT))
+    conn = _connect()
+    with conn:
+        conn.execute('INSERT INTO operations (ts, operator, action, success, record) VALUES (?, ?, ?, ?, ?)', _row(rec))
+    if next(_writes) % PRUNE_EVERY == 0:
+        _prune(conn)
 
-def read_lines(limit: int = 2000) -> Iterable[Dict[str, Any]]:
-    if not os.path.exists(LOG_PATH):
-        return []
-    lines = []
-    with open(LOG_PATH, 'r', encoding='utf-8') as f:
-        for line in f.readlines()[-limit:]:
-            try:
-                lines.append(json.loads(line))
-            except:
-                pass
-    return lines
 
+def query(operator: Optional[str] = None, action: Optional[str] = None,
+          since=None, until=None, cursor: Optional[int] = None,
+          limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """按条件倒序查询（最新在前），返回 (records, next_cursor)；next_cursor 为空表示没有更多"""
+    clauses = []
+    params: List[Any] = []
+    if operator:
+        clauses.append('operator = ?')
+        params.append(operator)
+    if action:
+        clauses.append('action = ?')
+        params.append(action)
+    start, end = parse_time(since), parse_time(until)
+    if start is not None:
+        clauses.append('ts >= ?')
+        params.append(start)
+    if end is not None:
+        clauses.append('ts <= ?')
+        params.append(end)
+    if cursor:
+        clauses.append('id < ?')
+        params.append(int(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sql = f'SELECT id, record FROM operations {where} ORDER BY id DESC LIMIT ?'
+    rows = _connect().execute(sql, params + [limit + 1]).fetchall()
+    records = []
+    for row_id, record in rows[:limit]:
+        rec = json.loads(record)
+        rec['id'] = row_id
+        records.append(rec)
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return records, next_cursor
+
+
+def read_lines(limit: int = 2000) -> Iterable[Dict[str, Any]]:
+    """最近 limit 条记录，按时间正序"""
+    records, _ = query(limit=limit)
+    records.reverse()
+    return records
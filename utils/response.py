@@ -1,4 +1,16 @@
-from flask import jsonify
+import hashlib
+import io
+import json
+import os
+import threading
+from urllib.parse import quote
+from flask import Response, jsonify, request, send_file, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from config import Config
+
+# 流式输出时累积到该大小再交给 WSGI 服务器，避免每个元素一次写入
+STREAM_CHUNK_SIZE = 16 * 1024
+
 
 def success_response(data=None, message='Success', code=200):
     """成功响应"""
@@ -21,3 +33,155 @@ def error_response(message='Error', code=400, details=None):
     if details:
         response['details'] = details
     return jsonify(response), code
+
+
+def _json_default(o):
+    """记录对象（services.models）在序列化时才转换为 dict"""
+    to_dict = getattr(o, 'to_dict', None)
+    if to_dict is not None:
+        return to_dict()
+    return DefaultJSONProvider.default(o)
+
+
+class RecordJSONProvider(DefaultJSONProvider):
+    """jsonify 支持 __slots__ 记录对象"""
+
+    default = staticmethod(_json_default)
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def _buffered(pieces):
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_list_response(key, items, extra=None, message='Success'):
+    """与 success_response 结构相同，但 data[key] 列表逐个序列化输出，不在内存中拼出完整 JSON"""
+    head = {'success': True, 'message': message, 'code': 200}
+
+    def pieces():
+        yield _dumps(head)[:-1] + ',"data":{'
+        for name, value in (extra or {}).items():
+            yield _dumps(name) + ':' + _dumps(value) + ','
+        yield _dumps(key) + ':['
+        for i, item in enumerate(items):
+            yield (',' if i else '') + _dumps(item)
+        yield ']}}'
+
+    return Response(stream_with_context(_buffered(pieces())), mimetype='application/json')
+
+
+def ndjson_response(items, on_error=None):
+    """NDJSON 流式响应：每行一个 JSON 对象；迭代出错时输出一行 {'error': ...}"""
+    def pieces():
+        try:
+            for item in items:
+                yield _dumps(item) + '\n'
+        except Exception as e:
+            if on_error is not None:
+                on_error(e)
+            yield _dumps({'error': str(e)}) + '\n'
+
+    return Response(stream_with_context(_buffered(pieces())), mimetype='application/x-ndjson')
+
+
+class StaticJSON:
+    """预先序列化的静态 JSON（如 swagger 文档），带 ETag，未变化时返回 304"""
+
+    def __init__(self, obj):
+        self.body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+    def response(self):
+        resp = Response(self.body, mimetype='application/json')
+        # 弱 ETag：gzip / br 编码后的内容与原文语义等价，可共用同一个 ETag
+        resp.set_etag(self.etag, weak=True)
+        resp.cache_control.no_cache = True
+        return resp.make_conditional(request)
+
+
+class _ClosingFile(io.FileIO):
+    """关闭时执行回调；WSGI 服务器在响应发送完毕后关闭 file_wrapper，从而关闭该文件"""
+
+    def __init__(self, path, on_close=None):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            callback, self._on_close = self._on_close, None
+            if callback is not None:
+                callback()
+
+
+class _ThrottledFile(_ClosingFile):
+    """每次读取后调用 throttle(字节数) 限速；不提供 fileno，WSGI 服务器不会改用 sendfile 绕过限速"""
+
+    def __init__(self, path, on_close=None, throttle=None):
+        super().__init__(path, on_close)
+        self._throttle = throttle
+
+    def fileno(self):
+        raise io.UnsupportedOperation('限速发送不使用 sendfile')
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if data:
+            self._throttle(len(data))
+        return data
+
+
+def file_download_response(path, download_name, on_close=None, mimetype='application/octet-stream', shaper=None):
+    """发送大文件，on_close 在发送结束后调用（本函数抛出异常时不会调用）
+
+    SENDFILE_MODE=x-accel 且文件位于下载目录时只返回 X-Accel-Redirect 头，由 Nginx 发送，
+    此时无法得知发送何时结束，on_close 延迟 X_ACCEL_CLEANUP_DELAY 秒执行；
+    否则通过 wsgi.file_wrapper 发送（gunicorn 下为 os.sendfile 零拷贝），支持 Range 续传
+
+    shaper 为限速任务（services.bandwidth.Job）：开始发送时已有限速则逐块读取并限速，
+    不再使用 sendfile；x-accel 模式下通过 X-Accel-Limit-Rate 交给 Nginx 限速
+    """
+    limited = shaper is not None and shaper.limited()
+    if Config.SENDFILE_MODE == 'x-accel':
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(Config.DOWNLOAD_FOLDER))
+        if not relative.startswith('..'):
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = Config.X_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+            response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+            if limited:
+                response.headers['X-Accel-Limit-Rate'] = str(shaper.rate())
+            if on_close is not None:
+                timer = threading.Timer(Config.X_ACCEL_CLEANUP_DELAY, on_close)
+                timer.daemon = True
+                timer.start()
+            return response
+
+    size = os.path.getsize(path)
+    file = _ThrottledFile(path, on_close, shaper.throttle) if limited else _ClosingFile(path, on_close)
+    try:
+        # 传入文件对象时 send_file 不会计算长度与修改时间，这里补上后再处理 Range / 条件请求
+        response = send_file(file, mimetype=mimetype, as_attachment=True, download_name=download_name, conditional=False, etag=False)
+        response.content_length = size
+        response.last_modified = os.path.getmtime(path)
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except Exception:
+        # 出错时由调用方负责清理，这里只关闭文件
+        file._on_close = None
+        file.close()
+        raise
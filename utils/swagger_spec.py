@@ -12,7 +12,8 @@ SWAGGER_SPEC = {
     "tags": [
         {"name": "Harbor", "description": "Harbor 仓库相关操作"},
         {"name": "Docker", "description": "Docker 镜像操作"},
-        {"name": "System", "description": "系统管理"}
+        {"name": "System", "description": "系统管理"},
+        {"name": "Batch", "description": "批量请求"}
     ],
     "paths": {
         "/harbor/test-connection": {
@@ -120,6 +121,190 @@ SWAGGER_SPEC = {
                 }
             }
         },
+        "/harbor/catalog/sync": {
+            "post": {
+                "tags": ["Harbor"],
+                "summary": "增量同步本地元数据目录",
+                "description": "基于 update_time/push_time 水位线仅拉取变化的仓库，并按 repo_count/artifact_count 对账删除",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "harborUrl": {"type": "string"},
+                                    "username": {"type": "string"},
+                                    "password": {"type": "string"},
+                                    "withArtifacts": {"type": "boolean", "default": False},
+                                    "full": {"type": "boolean", "default": False},
+                                    "autoSync": {"type": "boolean", "default": False}
+                                }
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "同步完成"}
+                }
+            }
+        },
+        "/harbor/catalog": {
+            "post": {
+                "tags": ["Harbor"],
+                "summary": "读取本地元数据目录",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "harborUrl": {"type": "string"},
+                                    "username": {"type": "string"},
+                                    "password": {"type": "string"},
+                                    "project": {"type": "string"}
+                                }
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "获取成功"},
+                    "404": {"description": "目录尚未同步"}
+                }
+            }
+        },
+        "/harbor/repositories/tags": {
+            "post": {
+                "tags": ["Harbor"],
+                "summary": "批量获取多个仓库的标签",
+                "description": "并发解析每个仓库的标签，返回按“项目/仓库”索引的结果（仓库名已含项目前缀时即为仓库名），单个仓库失败不影响整体",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "harborUrl": {"type": "string"},
+                                    "username": {"type": "string"},
+                                    "password": {"type": "string"},
+                                    "project": {"type": "string", "description": "默认项目名"},
+                                    "repos": {
+                                        "type": "array",
+                                        "items": {"type": "string"},
+                                        "example": ["library/nginx", "library/redis"]
+                                    }
+                                },
+                                "required": ["harborUrl", "username", "password", "repos"]
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "获取完成（data.failed 列出失败的仓库）"}
+                }
+            }
+        },
+        "/harbor/analytics/storage": {
+            "post": {
+                "tags": ["Harbor"],
+                "summary": "存储分析（按层去重）",
+                "description": "拉取全部 artifact 的 manifest 建立层引用索引，统计各项目/仓库独占与共享的字节数；manifest 按 digest 缓存，重复调用只处理变化的仓库。索引在后台刷新：首次刷新完成前返回 202，客户端轮询；projects 只筛选输出，引用计数基于全部项目",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "harborUrl": {"type": "string"},
+                                    "username": {"type": "string"},
+                                    "password": {"type": "string"},
+                                    "projects": {"type": "array", "items": {"type": "string"}},
+                                    "refresh": {"type": "boolean", "description": "立即在后台刷新索引"},
+                                    "candidates": {
+                                        "type": "array",
+                                        "description": "待删除的 tag，用于估算可释放空间",
+                                        "items": {
+                                            "type": "object",
+                                            "properties": {
+                                                "repo": {"type": "string", "example": "library/nginx"},
+                                                "tag": {"type": "string", "example": "1.0"}
+                                            }
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "分析结果（data.status.refreshing 表示后台刷新仍在进行）"},
+                    "202": {"description": "首次刷新进行中，稍后重试"}
+                }
+            }
+        },
+        "/harbor/webhook": {
+            "post": {
+                "tags": ["Harbor"],
+                "summary": "接收 Harbor Webhook 事件",
+                "description": "处理 PUSH_ARTIFACT / DELETE_ARTIFACT：使本地目录、搜索索引、存储分析失效，并按 WEBHOOK_PREWARM_PATTERNS 预热导出。Authorization 头需与 HARBOR_WEBHOOK_SECRET 一致",
+                "parameters": [
+                    {"name": "Authorization", "in": "header", "required": True, "schema": {"type": "string"}}
+                ],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {"type": "object"}
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "事件已处理"},
+                    "401": {"description": "认证失败"}
+                }
+            }
+        },
+        "/batch": {
+            "post": {
+                "tags": ["Batch"],
+                "summary": "批量执行 Harbor 操作",
+                "description": "支持的 op：projects、project、repositories、tags、search、system-info、statistics、check-upload-permission；结果按 name 返回",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "harborUrl": {"type": "string"},
+                                    "username": {"type": "string"},
+                                    "password": {"type": "string"},
+                                    "operations": {
+                                        "type": "array",
+                                        "items": {
+                                            "type": "object",
+                                            "properties": {
+                                                "name": {"type": "string", "example": "stats"},
+                                                "op": {"type": "string", "example": "statistics"},
+                                                "params": {"type": "object"}
+                                            }
+                                        }
+                                    }
+                                },
+                                "required": ["harborUrl", "username", "password", "operations"]
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "执行完成（data.failed 列出失败的操作）"}
+                }
+            }
+        },
         "/docker/download": {
             "post": {
                 "tags": ["Docker"],
@@ -156,6 +341,57 @@ SWAGGER_SPEC = {
                 }
             }
         },
+        "/docker/jobs": {
+            "post": {
+                "tags": ["Docker"],
+                "summary": "进行中与可续传的传输任务",
+                "description": "当前用户在该 Harbor 上发起的、服务重启或工作进程退出后中断的导出 / 上传任务；data.shutdown 为本进程的停止状态",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {"$ref": "#/components/schemas/HarborConfig"}
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "获取成功"},
+                    "401": {"description": "Harbor 认证失败"}
+                }
+            }
+        },
+        "/docker/jobs/{job_id}/resume": {
+            "post": {
+                "tags": ["Docker"],
+                "summary": "续传中断的任务",
+                "description": "导出任务发送中断前已打包的文件（镜像 digest 变化时重新导出），上传任务跳过已推送的镜像；只有任务的发起用户可以续传，目标为任务原来的 Harbor；任务日志不保存密码，需重新提供",
+                "parameters": [
+                    {"name": "job_id", "in": "path", "required": True, "schema": {"type": "string"}}
+                ],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "username": {"type": "string"},
+                                    "password": {"type": "string"}
+                                },
+                                "required": ["username", "password"]
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "导出任务返回文件流，上传任务返回上传结果"},
+                    "401": {"description": "Harbor 认证失败"},
+                    "404": {"description": "任务不存在或不属于当前用户"},
+                    "409": {"description": "任务不处于可续传状态"},
+                    "503": {"description": "服务正在停止或排队超时"}
+                }
+            }
+        },
         "/docker/local-images": {
             "get": {
                 "tags": ["Docker"],
@@ -313,20 +549,117 @@ SWAGGER_SPEC = {
             "get": {
                 "tags": ["System"],
                 "summary": "健康检查",
+                "description": "返回后台探测的缓存结果（Docker ping 延迟、Harbor 可达性及检查时间）",
                 "responses": {
                     "200": {"description": "服务正常"}
                 }
             }
         },
+        "/system/health/live": {
+            "get": {
+                "tags": ["System"],
+                "summary": "存活探针",
+                "responses": {
+                    "200": {"description": "进程存活"}
+                }
+            }
+        },
+        "/system/health/ready": {
+            "get": {
+                "tags": ["System"],
+                "summary": "就绪探针",
+                "responses": {
+                    "200": {"description": "已就绪"},
+                    "503": {"description": "未就绪（details 中给出原因）"}
+                }
+            }
+        },
         "/system/info": {
             "get": {
                 "tags": ["System"],
                 "summary": "获取系统信息",
+                "description": "返回后台采样的最近快照，不阻塞请求",
+                "parameters": [
+                    {"name": "history", "in": "query", "schema": {"type": "boolean"}, "description": "是否返回历史采样"}
+                ],
+                "responses": {
+                    "200": {"description": "获取成功"}
+                }
+            }
+        },
+        "/system/scheduler": {
+            "get": {
+                "tags": ["System"],
+                "summary": "并发调度状态",
+                "description": "按 registry 主机与操作类型（transfer / api）返回并发上限、占用槽位、排队深度、最久等待与平均等待时间、429 暂停剩余时间及各租户的权重、占用与排队数（当前工作进程）",
+                "responses": {
+                    "200": {"description": "获取成功"}
+                }
+            }
+        },
+        "/system/bandwidth": {
+            "get": {
+                "tags": ["System"],
+                "summary": "带宽限速状态",
+                "description": "返回当前生效的全局 / 按客户端 IP / 按任务限速（字节/秒，0 为不限）、按任务单独设置的限速，以及当前工作进程中进行中的下载与上传传输",
+                "responses": {
+                    "200": {"description": "获取成功"}
+                }
+            },
+            "put": {
+                "tags": ["System"],
+                "summary": "修改带宽限速",
+                "description": "运行时修改限速，所有工作进程在 1 秒内生效；jobs 以传输 ID（GET /system/bandwidth 返回的 jobs[].id，由请求 ID 加随机后缀组成）为键单独限速，值为 null 时取消。限速只作用于开始时已有限速的传输",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "global": {"type": "integer", "minimum": 0},
+                                    "per_ip": {"type": "integer", "minimum": 0},
+                                    "per_job": {"type": "integer", "minimum": 0},
+                                    "jobs": {"type": "object", "additionalProperties": {"type": "integer", "nullable": True}}
+                                }
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {"description": "修改成功"},
+                    "400": {"description": "参数错误"}
+                }
+            },
+            "delete": {
+                "tags": ["System"],
+                "summary": "恢复默认带宽限速",
+                "description": "清除运行时修改，恢复 BANDWIDTH_* 配置的限速",
+                "responses": {
+                    "200": {"description": "已恢复"}
+                }
+            }
+        },
+        "/system/janitor": {
+            "get": {
+                "tags": ["System"],
+                "summary": "后台清理任务状态",
+                "description": "返回保留策略、上次清理统计以及进行中操作引用的文件和镜像",
                 "responses": {
                     "200": {"description": "获取成功"}
                 }
             }
         },
+        "/system/janitor/run": {
+            "post": {
+                "tags": ["System"],
+                "summary": "立即执行一次清理",
+                "description": "按最长保留时间与容量配额（LRU）清理下载/上传目录及本服务拉取的本地镜像，跳过进行中的操作",
+                "responses": {
+                    "200": {"description": "清理完成"}
+                }
+            }
+        },
         "/system/cleanup": {
             "post": {
                 "tags": ["System"],
@@ -336,14 +669,99 @@ SWAGGER_SPEC = {
                 }
             }
         },
+        "/system/operations": {
+            "get": {
+                "tags": ["System"],
+                "summary": "查询操作日志",
+                "description": "按时间倒序返回；next_cursor 不为空时作为 cursor 参数获取下一页",
+                "parameters": [
+                    {"name": "operator", "in": "query", "schema": {"type": "string"}},
+                    {"name": "action", "in": "query", "schema": {"type": "string"}},
+                    {"name": "since", "in": "query", "schema": {"type": "string", "example": "2024-01-01 00:00:00"}, "description": "起始时间（时间戳或 YYYY-MM-DD[ HH:MM:SS]）"},
+                    {"name": "until", "in": "query", "schema": {"type": "string"}},
+                    {"name": "cursor", "in": "query", "schema": {"type": "integer"}},
+                    {"name": "limit", "in": "query", "schema": {"type": "integer", "default": 100}}
+                ],
+                "responses": {
+                    "200": {"description": "获取成功"}
+                }
+            }
+        },
+        "/system/traces": {
+            "get": {
+                "tags": ["System"],
+                "summary": "最近的请求 trace",
+                "description": "每个请求的 X-Request-ID 会回写到响应头；保留包含子 span（下载 / 上传阶段、Harbor 调用）或较慢的请求",
+                "responses": {
+                    "200": {"description": "获取成功"}
+                }
+            }
+        },
+        "/system/traces/export": {
+            "get": {
+                "tags": ["System"],
+                "summary": "导出全部最近 trace（Chrome trace 格式）",
+                "responses": {
+                    "200": {"description": "trace 文件"}
+                }
+            }
+        },
+        "/system/traces/{request_id}": {
+            "get": {
+                "tags": ["System"],
+                "summary": "按请求 ID 导出 trace（Chrome trace 格式）",
+                "parameters": [
+                    {"name": "request_id", "in": "path", "required": True, "schema": {"type": "string"}}
+                ],
+                "responses": {
+                    "200": {"description": "trace 文件"},
+                    "404": {"description": "trace 不存在或已过期"}
+                }
+            }
+        },
+        "/system/traces/{request_id}/profile": {
+            "get": {
+                "tags": ["System"],
+                "summary": "请求的 cProfile 结果",
+                "description": "需开启 PROFILE_ENABLED，并在原请求中携带 X-Profile 请求头",
+                "parameters": [
+                    {"name": "request_id", "in": "path", "required": True, "schema": {"type": "string"}}
+                ],
+                "responses": {
+                    "200": {"description": "文本格式的 profile 结果"},
+                    "404": {"description": "没有该请求的 profile 结果"}
+                }
+            }
+        },
         "/system/logs": {
             "get": {
                 "tags": ["System"],
                 "summary": "获取系统日志",
+                "description": "从日志文件末尾反向读取；返回的 cursor 可用于 /system/logs/stream 续读",
+                "parameters": [
+                    {"name": "lines", "in": "query", "schema": {"type": "integer", "default": 100}},
+                    {"name": "level", "in": "query", "schema": {"type": "string", "example": "WARNING"}, "description": "最低日志级别"},
+                    {"name": "logger", "in": "query", "schema": {"type": "string", "example": "harbor_service"}, "description": "日志器名称，逗号分隔"}
+                ],
                 "responses": {
                     "200": {"description": "获取成功"}
                 }
             }
+        },
+        "/system/logs/stream": {
+            "get": {
+                "tags": ["System"],
+                "summary": "实时跟随日志（SSE）",
+                "description": "每条事件的 id 为 inode:offset，断线重连时通过 Last-Event-ID 续读；日志轮转后自动切换到新文件",
+                "parameters": [
+                    {"name": "cursor", "in": "query", "schema": {"type": "string"}, "description": "起始游标，默认从文件末尾开始"},
+                    {"name": "level", "in": "query", "schema": {"type": "string"}},
+                    {"name": "logger", "in": "query", "schema": {"type": "string"}}
+                ],
+                "responses": {
+                    "200": {"description": "text/event-stream"}
+                }
+            }
         }
     }
 }
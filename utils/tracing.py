@@ -0,0 +1,233 @@
+"""
+请求链路追踪
+每个请求以 X-Request-ID 标识，通过 contextvars 在调用链中传递当前 trace；
+下载 / 上传各阶段与 Harbor 调用记录为 span，可导出为 Chrome trace 格式
+（chrome://tracing 或 Perfetto 打开）。请求头 X-Profile 可按需对单个请求做 cProfile 采样
+"""
+
+import contextvars
+import io
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from config import Config
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+PROFILE_HEADER = 'X-Profile'
+# 外部传入的请求 ID 只接受常见字符，避免写入响应头与日志时被注入
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+# profile 结果保留的函数条数
+PROFILE_TOP = 60
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+_recent = deque(maxlen=Config.TRACE_HISTORY)
+_recent_lock = threading.Lock()
+
+
+class Trace:
+    """单个请求的 span 集合；请求结束后仍可追加（如文件发送完成时）"""
+
+    def __init__(self, request_id, name):
+        self.request_id = request_id
+        self.name = name
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.profile = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def _ts(self, perf):
+        """perf_counter 时间换算为微秒时间戳"""
+        return int((self.started_at + perf - self._origin) * 1e6)
+
+    def add(self, name, started, ended=None, **args):
+        """记录一个 span，started / ended 为 time.perf_counter() 取值"""
+        ended = time.perf_counter() if ended is None else ended
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': self._ts(started),
+            'dur': max(0, int((ended - started) * 1e6)),
+            'tid': threading.get_ident(),
+            'args': args
+        }
+        with self._lock:
+            self.spans.append(event)
+
+    def finish(self, status):
+        self.status = status
+        self.duration = time.time() - self.started_at
+
+    def summary(self):
+        return {
+            'request_id': self.request_id,
+            'name': self.name,
+            'status': self.status,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'duration_ms': round(self.duration * 1000, 2) if self.duration is not None else None,
+            'spans': len(self.spans),
+            'profiled': self.profile is not None
+        }
+
+    def chrome_events(self, pid=1):
+        with self._lock:
+            spans = list(self.spans)
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f"{self.name} [{self.request_id}]"}}]
+        for span in spans:
+            events.append(dict(span, pid=pid, cat='harbor-export'))
+        return events
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'args', 'started')
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.started = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = str(exc)
+        self.trace.add(self.name, self.started, **self.args)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def current():
+    return _trace.get()
+
+
+def current_request_id():
+    trace = _trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def span(name, **args):
+    """with span('harbor.request', endpoint=...) as s: ...；当前没有 trace 时为空操作"""
+    trace = _trace.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name, args)
+
+
+def record(name, started, **args):
+    """记录以 started（perf_counter）为起点、到现在结束的 span"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, started, **args)
+
+
+def propagate(fn):
+    """把当前 trace 带入线程池中执行的函数"""
+    trace = _trace.get()
+    if trace is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _trace.reset(token)
+
+    return run
+
+
+def request_id_from(value):
+    return value if value and _REQUEST_ID_RE.match(value) else uuid.uuid4().hex
+
+
+def start(request_id, name):
+    """开始追踪当前请求，返回 (trace, token)"""
+    trace = Trace(request_id, name)
+    return trace, _trace.set(trace)
+
+
+def end(trace, token, status):
+    """结束追踪；有子 span 或耗时超过阈值的 trace 保留在最近列表中"""
+    _trace.reset(token)
+    trace.finish(status)
+    if trace.spans or trace.profile is not None or trace.duration * 1000 >= Config.TRACE_MIN_DURATION_MS:
+        with _recent_lock:
+            _recent.append(trace)
+
+
+def recent():
+    with _recent_lock:
+        return [t.summary() for t in reversed(_recent)]
+
+
+def get(request_id):
+    with _recent_lock:
+        for trace in _recent:
+            if trace.request_id == request_id:
+                return trace
+    return None
+
+
+def chrome_trace(traces):
+    """多个 trace 导出为一个 Chrome trace 文件，每个请求作为一个进程行"""
+    events = []
+    for pid, trace in enumerate(traces, start=1):
+        events.extend(trace.chrome_events(pid))
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def all_traces():
+    with _recent_lock:
+        return list(_recent)
+
+
+class Profile:
+    """单个请求的 cProfile 采样（只覆盖处理请求的线程）"""
+
+    def __init__(self):
+        import cProfile
+        self._profiler = cProfile.Profile()
+
+    def start(self):
+        self._profiler.enable()
+        return self
+
+    def stop(self):
+        import pstats
+        self._profiler.disable()
+        out = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=out)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(PROFILE_TOP)
+        return out.getvalue()
+
+
+def profile_requested(header_value):
+    """PROFILE_ENABLED 开启且请求头 X-Profile 有值时采样；配置了 PROFILE_TOKEN 时需与其一致"""
+    if not Config.PROFILE_ENABLED or not header_value:
+        return False
+    return not Config.PROFILE_TOKEN or header_value == Config.PROFILE_TOKEN